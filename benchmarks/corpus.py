@@ -0,0 +1,41 @@
+"""
+Dialog corpora shared by the benchmark scripts.
+
+Benchmarks default to a synthetic corpus so they can run without scraping anything.
+Run them from the repository root with PYTHONPATH=. so trekipsum is importable.
+Pass the path to a real dialog.sqlite asset to benchmark against the full corpus.
+"""
+import contextlib
+import random
+import sqlite3
+
+from six.moves import range
+
+WORDS = (
+    'captain', 'engage', 'warp', 'shields', 'phasers', 'the', 'a', 'is', 'we', 'must',
+    'starfleet', 'ensign', 'klingon', 'romulan', 'borg', 'sensors', 'torpedoes', 'fire',
+    'hail', 'them', 'on', 'screen', 'make', 'it', 'so', 'number', 'one', 'sir', 'aye',
+    'logical', 'fascinating', 'doctor', 'not', 'a', 'bricklayer', 'course', 'heading',
+)
+
+
+def synthetic_dialog(line_count=100000, speaker_count=500, seed=1701):
+    """Build a reproducible list of (speaker, line) tuples of made-up dialog."""
+    rng = random.Random(seed)
+    speakers = ['SPEAKER {}'.format(i) for i in range(speaker_count)]
+    dialog = []
+    for __ in range(line_count):
+        sentences = []
+        for __ in range(rng.randint(1, 3)):
+            words = [rng.choice(WORDS) for __ in range(rng.randint(2, 12))]
+            sentences.append('{}.'.format(' '.join(words).capitalize()))
+        # skew toward a few chatty speakers, like the real corpus
+        speaker = speakers[min(int(rng.expovariate(10.0 / speaker_count)), speaker_count - 1)]
+        dialog.append((speaker, ' '.join(sentences)))
+    return dialog
+
+
+def load_dialog(sqlite_path):
+    """Load every (speaker, line) tuple from an existing dialog.sqlite asset."""
+    with contextlib.closing(sqlite3.connect(sqlite_path)) as conn:
+        return conn.execute('SELECT speaker, line FROM dialog').fetchall()
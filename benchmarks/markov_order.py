@@ -0,0 +1,92 @@
+"""
+Compare markov chain size, memory, and generation speed across chain orders.
+
+Usage: PYTHONPATH=. python benchmarks/markov_order.py [--path dialog.sqlite] [--sentences N]
+
+Pass the path to the full dialog.sqlite asset to benchmark against the real corpus; its
+dialog table is read and markov chains of each order are written to temporary files.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import tempfile
+import timeit
+
+from corpus import load_dialog, synthetic_dialog
+from trekipsum import markov
+from trekipsum.dialog.connections import OPEN_MODE_READ_ONLY
+from trekipsum.scrape import writers
+
+try:
+    import tracemalloc
+except ImportError:  # py27 reports walkers' approximate sizes instead
+    tracemalloc = None
+
+
+def parse_cli_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description='markov chain order benchmark')
+    parser.add_argument('--path', type=str,
+                        help='existing dialog.sqlite to read (default: synthetic corpus)')
+    parser.add_argument('--corpus-lines', type=int, default=100000,
+                        help='lines in the synthetic corpus (default: %(default)s)')
+    parser.add_argument('--sentences', type=int, default=20000,
+                        help='sentences to generate per order (default: %(default)s)')
+    return parser.parse_args()
+
+
+def benchmark_order(dialog_list, order, sentences):
+    """Time writing, loading, and walking every speaker's chains of the given order."""
+    handle, markov_path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(handle)
+    try:
+        start = timeit.default_timer()
+        writers.markov(markov_path, dialog_list, order=order)
+        write_seconds = timeit.default_timer() - start
+        file_size = os.path.getsize(markov_path)
+
+        with markov.DialogChainDatastore(markov_path, OPEN_MODE_READ_ONLY) as store:
+            speakers = [speaker for speaker in store.get_contexts() if speaker != 'speakers']
+            if tracemalloc is not None:
+                tracemalloc.start()
+            walkers = [markov.ChainWalker(store.to_id_chain(speaker), store.vocabulary,
+                                          store.get_order(speaker))
+                       for speaker in speakers]
+            for walker in walkers:
+                walker.build_sentence()  # compile each speaker's start of sentence
+            if tracemalloc is not None:
+                memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+            else:
+                memory = sum(walker.approximate_size() for walker in walkers)
+
+        start = timeit.default_timer()
+        for number in range(sentences):
+            walkers[number % len(walkers)].build_sentence()
+        walk_seconds = timeit.default_timer() - start
+    finally:
+        os.remove(markov_path)
+    return write_seconds, file_size, memory, walk_seconds / sentences
+
+
+def main():
+    """Run the benchmark for every supported order and print a table of results."""
+    args = parse_cli_args()
+    if args.path is None:
+        dialog_list = synthetic_dialog(args.corpus_lines)
+    else:
+        dialog_list = load_dialog(args.path)
+
+    print('{:<6} {:>10} {:>12} {:>14} {:>16}'.format(
+        'order', 'write (s)', 'file (MiB)', 'memory (MiB)', 'per sentence (us)'))
+    for order in range(1, markov.MAX_ORDER + 1):
+        write_seconds, file_size, memory, per_sentence = benchmark_order(
+            dialog_list, order, args.sentences)
+        print('{:<6} {:>10.2f} {:>12.2f} {:>14.2f} {:>16.2f}'.format(
+            order, write_seconds, file_size / 2.0 ** 20, memory / 2.0 ** 20,
+            per_sentence * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare per-line latency of the sqlite DialogChooser across database open modes.
+
+Usage: PYTHONPATH=. python benchmarks/open_modes.py [--path dialog.sqlite] [--lines N]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import tempfile
+import timeit
+
+from corpus import synthetic_dialog
+from trekipsum.dialog.connections import OPEN_MODES
+from trekipsum.dialog.sqlite import DialogChooser
+from trekipsum.scrape import writers
+
+
+def parse_cli_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description='sqlite open mode benchmark')
+    parser.add_argument('--path', type=str,
+                        help='existing dialog.sqlite to read (default: synthetic corpus)')
+    parser.add_argument('--corpus-lines', type=int, default=200000,
+                        help='lines in the synthetic corpus (default: %(default)s)')
+    parser.add_argument('--lines', type=int, default=20000,
+                        help='random lines to fetch per mode (default: %(default)s)')
+    return parser.parse_args()
+
+
+def benchmark_mode(sqlite_path, open_mode, lines):
+    """Time opening a chooser, then fetching random lines one at a time and in a batch."""
+    start = timeit.default_timer()
+    chooser = DialogChooser(sqlite_path, open_mode)
+    chooser.random_dialog()
+    open_seconds = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    for __ in range(lines):
+        chooser.random_dialog()
+    single_seconds = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    chooser.random_dialogs(lines)
+    batch_seconds = timeit.default_timer() - start
+
+    chooser.close()
+    return open_seconds, single_seconds / lines, batch_seconds / lines
+
+
+def main():
+    """Run the benchmark for every open mode and print a table of results."""
+    args = parse_cli_args()
+    sqlite_path = args.path
+    if sqlite_path is None:
+        handle, sqlite_path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        writers.sqlite(sqlite_path, synthetic_dialog(args.corpus_lines))
+
+    try:
+        print('{:<10} {:>12} {:>16} {:>16}'.format(
+            'mode', 'open (ms)', 'per line (us)', 'batched (us)'))
+        for open_mode in OPEN_MODES:
+            open_seconds, single, batched = benchmark_mode(sqlite_path, open_mode, args.lines)
+            print('{:<10} {:>12.2f} {:>16.2f} {:>16.2f}'.format(
+                open_mode, open_seconds * 1e3, single * 1e6, batched * 1e6))
+    finally:
+        if args.path is None:
+            os.remove(sqlite_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare sentences per second of the pure-Python and NumPy-vectorized markov walkers.
+
+Usage: PYTHONPATH=. python benchmarks/vectorized.py [--path dialog.sqlite] [--sentences N]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import tempfile
+import timeit
+from collections import Counter
+
+from corpus import load_dialog, synthetic_dialog
+from trekipsum import markov
+from trekipsum.markov import vectorized
+from trekipsum.scrape import writers
+
+
+def parse_cli_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description='vectorized markov walker benchmark')
+    parser.add_argument('--path', type=str,
+                        help='existing dialog.sqlite to read (default: synthetic corpus)')
+    parser.add_argument('--corpus-lines', type=int, default=100000,
+                        help='lines in the synthetic corpus (default: %(default)s)')
+    parser.add_argument('--order', type=int, default=1,
+                        help='order of the markov chains (default: %(default)s)')
+    parser.add_argument('--sentences', type=int, default=100000,
+                        help='sentences to generate per walker (default: %(default)s)')
+    return parser.parse_args()
+
+
+def main():
+    """Build the chattiest speaker's sentences with each walker and print their rates."""
+    args = parse_cli_args()
+    if vectorized.numpy is None:
+        print('NumPy is not installed; nothing to compare')
+        return
+    dialog_list = load_dialog(args.path) if args.path else synthetic_dialog(args.corpus_lines)
+    handle, markov_path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(handle)
+    try:
+        writers.markov(markov_path, dialog_list, order=args.order)
+        speaker = Counter(speaker for speaker, __ in dialog_list).most_common(1)[0][0]
+        with markov.DialogChainDatastore(markov_path) as store:
+            chain = store.to_id_chain(speaker)
+            walkers = (
+                ('python', markov.ChainWalker(chain, store.vocabulary, args.order)),
+                ('numpy', vectorized.VectorizedChainWalker(chain, store.vocabulary, args.order)),
+            )
+            print('{:<8} {:>18}'.format('walker', 'sentences per sec'))
+            for name, walker in walkers:
+                start = timeit.default_timer()
+                walker.build_sentences(args.sentences)
+                seconds = timeit.default_timer() - start
+                print('{:<8} {:>18.0f}'.format(name, args.sentences / seconds))
+    finally:
+        os.remove(markov_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,11 +19,15 @@ setup(
     packages=find_packages(exclude=['tests']),
     install_requires=[
         'beautifulsoup4',
+        'futures; python_version < "3"',
         'requests',
         'six',
         'tqdm',
         'urllib3',
     ],
+    extras_require={
+        'vectorized': ['numpy'],
+    },
     dependency_links=[],
     zip_safe=True,
     entry_points={
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import pytest
+
+from trekipsum import exceptions
+from trekipsum.dialog import compact
+from trekipsum.scrape import writers
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+DUMMY_DIALOG = [
+    ('PIKARD', 'Engage.'),
+    ('DORF', 'Aye, sir.'),
+    ('PIKARD', 'Make it so.'),
+    ('WESLEY', 'I am very smart.'),
+    ('DORF', 'Today is a good day to die.'),
+    ('RENÉ PICARD', 'Où est mon oncle?'),
+    ('PIKARD', 'Tea. Earl Grey. Hot.'),
+]
+
+
+@pytest.fixture
+def compact_path():
+    """Yield path to a temporary compact corpus written by the compact writer."""
+    handle, file_path = tempfile.mkstemp(suffix='.compact')
+    os.close(handle)
+    writers.compact(file_path, DUMMY_DIALOG)
+    yield file_path
+    os.remove(file_path)
+
+
+def test_corpus_round_trip(compact_path):
+    """Test CompactCorpus reads back every line written by write_corpus."""
+    corpus = compact.CompactCorpus(compact_path)
+    assert len(corpus) == len(DUMMY_DIALOG)
+    assert sorted(corpus.speakers) == ['DORF', 'PIKARD', 'RENÉ PICARD', 'WESLEY']
+    assert sorted(corpus.dialog(i) for i in range(len(corpus))) == sorted(DUMMY_DIALOG)
+    first, end = corpus.speaker_ranges['PIKARD']
+    assert end - first == 3
+    assert all(corpus.dialog(i)[0] == 'PIKARD' for i in range(first, end))
+    corpus.close()
+
+
+def test_write_corpus_replaces_existing_file(compact_path):
+    """Test write_corpus replaces an existing corpus through os.replace where available."""
+    with mock.patch('trekipsum.dialog.compact._replace_file',
+                    wraps=compact._replace_file) as mock_replace_file:
+        compact.write_corpus(compact_path, DUMMY_DIALOG[:2])
+    mock_replace_file.assert_called_once_with(compact_path + '.tmp', compact_path)
+    corpus = compact.CompactCorpus(compact_path)
+    assert len(corpus) == 2
+    corpus.close()
+
+
+def test_write_corpus_removes_temp_file_on_error(compact_path):
+    """Test write_corpus leaves the existing corpus and no temp file if writing fails."""
+    with mock.patch('trekipsum.dialog.compact._replace_file', side_effect=OSError()):
+        with pytest.raises(OSError):
+            compact.write_corpus(compact_path, DUMMY_DIALOG[:2])
+    assert not os.path.exists(compact_path + '.tmp')
+    corpus = compact.CompactCorpus(compact_path)
+    assert len(corpus) == len(DUMMY_DIALOG)
+    corpus.close()
+
+
+def test_corpus_rejects_other_files():
+    """Test CompactCorpus raises ValueError for files not in the compact format."""
+    with tempfile.NamedTemporaryFile(suffix='.compact') as the_file:
+        the_file.write(b'This is not the corpus you are looking for.')
+        the_file.flush()
+        with pytest.raises(ValueError):
+            compact.CompactCorpus(the_file.name)
+
+
+def test_chooser_random_dialog(compact_path):
+    """Test DialogChooser.random_dialog only returns lines from the requested speaker."""
+    expected_lines = {line for speaker, line in DUMMY_DIALOG if speaker == 'DORF'}
+    with compact.DialogChooser(compact_path) as chooser:
+        assert chooser.dialog_count() == len(DUMMY_DIALOG)
+        assert chooser.dialog_count('dorf') == 2
+        for _ in range(20):
+            speaker, line = chooser.random_dialog('Dorf')
+            assert speaker == 'DORF'
+            assert line in expected_lines
+        assert chooser.random_dialog() in DUMMY_DIALOG
+        with pytest.raises(exceptions.NoDialogFoundException):
+            chooser.random_dialog('STEVE')
+
+
+def test_chooser_random_dialogs(compact_path):
+    """Test DialogChooser.random_dialogs draws several lines at once."""
+    with compact.DialogChooser(compact_path) as chooser:
+        dialogs = chooser.random_dialogs(30)
+        assert len(dialogs) == 30
+        assert set(dialogs) <= set(DUMMY_DIALOG)
+        dialogs = chooser.random_dialogs(10, 'PIKARD', distinct=True)
+        assert sorted(dialogs) == sorted(d for d in DUMMY_DIALOG if d[0] == 'PIKARD')
+
+
+def test_chooser_random_speaker(compact_path):
+    """Test DialogChooser.random_speaker honors the excluded speaker."""
+    with compact.DialogChooser(compact_path) as chooser:
+        for weighted in (False, True):
+            speakers = set(chooser.random_speaker('pikard', weighted) for _ in range(200))
+            assert speakers == {'DORF', 'WESLEY', 'RENÉ PICARD'}
+
+
+def test_chooser_all_dialog(compact_path):
+    """Test DialogChooser.all_dialog yields all lines, optionally for one speaker."""
+    with compact.DialogChooser(compact_path) as chooser:
+        assert sorted(chooser.all_dialog()) == sorted(DUMMY_DIALOG)
+        assert list(chooser.all_dialog('wesley')) == [('WESLEY', 'I am very smart.')]
@@ -0,0 +1,100 @@
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+import six
+
+from trekipsum.dialog import connections
+
+
+def run_in_thread(fn):
+    """Run fn in a new thread and return its result."""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(fn()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+def test_pool_connection_per_thread():
+    """Test ConnectionPool opens one connection per thread and reuses it."""
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        pool = connections.ConnectionPool(the_file.name)
+        conn = pool.connection
+        assert pool.connection is conn
+        assert run_in_thread(lambda: pool.connection) is not conn
+        assert pool.random is pool.random
+        assert run_in_thread(lambda: pool.random) is not pool.random
+        pool.close()
+
+
+def test_pool_close_closes_all_threads_connections():
+    """Test ConnectionPool.close closes connections opened by other threads."""
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        pool = connections.ConnectionPool(the_file.name)
+        other_conn = run_in_thread(lambda: pool.connection)
+        pool.close()
+        with pytest.raises(sqlite3.ProgrammingError):
+            other_conn.execute('SELECT 1')
+        assert pool.connection is not other_conn
+
+
+def make_database(file_path):
+    """Create a tiny database with one table and one row at file_path."""
+    conn = sqlite3.connect(file_path)
+    with conn:
+        conn.execute('CREATE TABLE dialog (line VARCHAR)')
+        conn.execute("INSERT INTO dialog (line) VALUES ('Engage.')")
+    conn.close()
+
+
+@pytest.mark.skipif(six.PY2, reason='sqlite3 in py27 does not support URI filenames')
+@pytest.mark.parametrize('mode', (connections.OPEN_MODE_READ_ONLY,
+                                  connections.OPEN_MODE_IMMUTABLE,
+                                  connections.OPEN_MODE_MMAP))
+def test_pool_read_only_modes(mode):
+    """Test ConnectionPool read-only open modes can read but refuse writes."""
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        make_database(the_file.name)
+        pool = connections.ConnectionPool(the_file.name, mode)
+        assert pool.connection.execute('SELECT line FROM dialog').fetchall() == [('Engage.',)]
+        with pytest.raises(sqlite3.OperationalError):
+            pool.connection.execute("INSERT INTO dialog (line) VALUES ('Make it so.')")
+        pool.close()
+
+
+def test_pool_mmap_mode_sets_mmap_size():
+    """Test ConnectionPool mmap mode configures the connection's mmap_size."""
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        make_database(the_file.name)
+        pool = connections.ConnectionPool(the_file.name, connections.OPEN_MODE_MMAP,
+                                          mmap_size=4096)
+        mmap_size = pool.connection.execute('PRAGMA mmap_size').fetchone()[0]
+        assert mmap_size in (0, 4096)  # 0 if this sqlite was built without mmap support
+        pool.close()
+
+
+def test_pool_memory_mode():
+    """Test ConnectionPool memory mode copies the database and shares it across threads."""
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        make_database(the_file.name)
+        pool = connections.ConnectionPool(the_file.name, connections.OPEN_MODE_MEMORY)
+        query = 'SELECT line FROM dialog'
+        assert pool.connection.execute(query).fetchall() == [('Engage.',)]
+
+        conn = sqlite3.connect(the_file.name)
+        with conn:
+            conn.execute('DELETE FROM dialog')
+        conn.close()
+
+        assert pool.connection.execute(query).fetchall() == [('Engage.',)]
+        assert run_in_thread(lambda: pool.connection.execute(query).fetchall()) == \
+            [('Engage.',)]
+        pool.close()
+
+
+def test_pool_unknown_mode():
+    """Test ConnectionPool rejects unknown open modes."""
+    with pytest.raises(ValueError):
+        connections.ConnectionPool(':memory:', 'warp')
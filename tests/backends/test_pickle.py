@@ -1,13 +1,16 @@
 import copy
 import pickle
 import platform
+import shutil
 import tempfile
+from os import path
 
 import pytest
 import six
 
 from trekipsum import exceptions
 from trekipsum.dialog import pickle as ti_pickle
+from trekipsum.scrape import writers
 
 try:
     from unittest import mock
@@ -73,3 +76,82 @@ def test_chooser_random_dialog(mock_all_dialog, mock_randrange):
     expected_dialog = 'PIKARD', 'Make it so.'
     chooser = ti_pickle.DialogChooser()
     assert chooser.random_dialog() == expected_dialog
+
+
+@mock.patch('trekipsum.dialog.pickle.DialogChooser.all_dialog')
+def test_chooser_random_dialogs(mock_all_dialog):
+    """Test RandomDialogChooser.random_dialogs draws several lines at once."""
+    mock_all_dialog.return_value = {
+        'WESLEY': ['I am very smart.'],
+        'PIKARD': ['Engage.', 'Make it so.'],
+        'DORF': ['Aye, sir.'],
+    }
+    all_dialog = set((speaker, line) for speaker, lines in mock_all_dialog.return_value.items()
+                     for line in lines)
+    chooser = ti_pickle.DialogChooser()
+
+    dialogs = chooser.random_dialogs(20)
+    assert len(dialogs) == 20
+    assert set(dialogs) <= all_dialog
+
+    dialogs = chooser.random_dialogs(10, distinct=True)
+    assert sorted(dialogs) == sorted(all_dialog)
+
+    dialogs = chooser.random_dialogs(3, speaker='pikard')
+    assert len(dialogs) == 3
+    assert all(speaker == 'PIKARD' for speaker, __ in dialogs)
+
+    with pytest.raises(exceptions.NoDialogFoundException):
+        chooser.random_dialogs(1, speaker='STEVE')
+
+
+@mock.patch('trekipsum.dialog.pickle.DialogChooser.all_dialog')
+def test_chooser_cumulative_counts(mock_all_dialog):
+    """Test RandomDialogChooser.cumulative_counts totals lines in speaker order."""
+    mock_all_dialog.return_value = {
+        'WESLEY': ['I am very smart.'],
+        'PIKARD': ['Engage.', 'Make it so.'],
+        'DORF': ['Aye, sir.'],
+    }
+    chooser = ti_pickle.DialogChooser()
+    speakers, cumulative_counts = chooser.cumulative_counts()
+    assert speakers == ['WESLEY', 'PIKARD', 'DORF']
+    assert cumulative_counts == [1, 3, 4]
+    expected_dialog = [
+        ('WESLEY', 'I am very smart.'),
+        ('PIKARD', 'Engage.'),
+        ('PIKARD', 'Make it so.'),
+        ('DORF', 'Aye, sir.'),
+    ]
+    assert [chooser._dialog_at(offset) for offset in range(4)] == expected_dialog
+
+
+def test_chooser_sharded_pickle_loads_only_speaker_shard():
+    """Test RandomDialogChooser limited to a speaker loads only that speaker's shard."""
+    dialog_dict = {
+        'PIKARD': ['Engage.', 'Make it so.'],
+        'DORF': ['Aye, sir.'],
+    }
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        writers.pickle(path.join(tmp_dir, 'shards', ''), dialog_dict)
+        shards_path = path.join(tmp_dir, 'shards')
+
+        chooser = ti_pickle.DialogChooser()
+        chooser._pickle_path = shards_path
+        assert chooser.all_dialog() == dialog_dict
+        assert chooser.dialog_count == 3
+
+        with mock.patch('trekipsum.dialog.pickle._load_pickle',
+                        side_effect=ti_pickle._load_pickle) as mock_load_pickle:
+            chooser = ti_pickle.DialogChooser(speaker='dorf')
+            chooser._pickle_path = shards_path
+            assert chooser.random_dialog() == ('DORF', 'Aye, sir.')
+            assert mock_load_pickle.call_count == 2  # index plus one shard
+
+        chooser = ti_pickle.DialogChooser(speaker='STEVE')
+        chooser._pickle_path = shards_path
+        with pytest.raises(exceptions.NoDialogFoundException):
+            chooser.all_dialog()
+    finally:
+        shutil.rmtree(tmp_dir)
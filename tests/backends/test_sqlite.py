@@ -0,0 +1,184 @@
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+from trekipsum import exceptions
+from trekipsum.dialog import connections
+from trekipsum.dialog import sqlite as ti_sqlite
+from trekipsum.scrape import writers
+
+DUMMY_DIALOG = [
+    ('PIKARD', 'Engage.'),
+    ('DORF', 'Aye, sir.'),
+    ('PIKARD', 'Make it so.'),
+    ('WESLEY', 'I am very smart.'),
+    ('DORF', 'Today is a good day to die.'),
+    ('PIKARD', 'Tea. Earl Grey. Hot.'),
+]
+
+
+@pytest.fixture
+def sqlite_path():
+    """Yield path to a temporary sqlite db populated by the sqlite writer."""
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        writers.sqlite(the_file.name, DUMMY_DIALOG)
+        yield the_file.name
+
+
+def test_chooser_dialog_range_is_contiguous(sqlite_path):
+    """Test DialogChooser.dialog_range finds each speaker's lines in one dense run."""
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        assert chooser.dialog_range() == (6, 1, 6)
+        count, first_id, last_id = chooser.dialog_range('pikard')
+        assert count == 3
+        assert last_id - first_id + 1 == count
+        assert chooser.dialog_count('dorf') == 2
+        assert chooser.dialog_count('steve') == 0
+
+
+def test_chooser_random_dialog_by_speaker(sqlite_path):
+    """Test DialogChooser.random_dialog only returns lines from the requested speaker."""
+    expected_lines = {line for speaker, line in DUMMY_DIALOG if speaker == 'DORF'}
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        for _ in range(20):
+            speaker, line = chooser.random_dialog('Dorf')
+            assert speaker == 'DORF'
+            assert line in expected_lines
+
+
+def test_chooser_random_dialog_not_found(sqlite_path):
+    """Test DialogChooser.random_dialog raises exception if no data found for speaker."""
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        with pytest.raises(exceptions.NoDialogFoundException):
+            chooser.random_dialog('STEVE')
+
+
+def test_chooser_speaker_stats(sqlite_path):
+    """Test DialogChooser.speaker_stats loads statistics written by the sqlite writer."""
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        stats = chooser.speaker_stats('PIKARD')
+        assert stats.line_count == 3
+        assert stats.word_count == 8
+        assert chooser.speaker_stats().word_count == 21
+        assert chooser.speaker_stats('STEVE') == ti_sqlite.NO_STATS
+
+
+def test_chooser_speaker_stats_without_table(sqlite_path):
+    """Test DialogChooser computes statistics if the asset has no speaker_stats table."""
+    conn = sqlite3.connect(sqlite_path)
+    with conn:
+        conn.execute('DROP TABLE speaker_stats')
+    conn.close()
+
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        assert chooser.dialog_range() == (6, 1, 6)
+        assert chooser.dialog_count('PIKARD') == 3
+        assert chooser.speaker_stats('PIKARD').word_count is None
+
+
+def test_chooser_random_dialog_sparse_ids(sqlite_path):
+    """Test DialogChooser.random_dialog picks from cached dialog_ids if they have gaps."""
+    conn = sqlite3.connect(sqlite_path)
+    with conn:
+        conn.execute('DROP TABLE speaker_stats')
+        conn.execute("INSERT INTO dialog (speaker, line) VALUES ('DORF', 'Qapla!')")
+    conn.close()
+
+    expected_lines = {line for speaker, line in DUMMY_DIALOG if speaker == 'DORF'}
+    expected_lines.add('Qapla!')
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        count, first_id, last_id = chooser.dialog_range('DORF')
+        assert last_id - first_id + 1 > count
+        for _ in range(20):
+            speaker, line = chooser.random_dialog('DORF')
+            assert speaker == 'DORF'
+            assert line in expected_lines
+        assert len(chooser._sparse_ids['DORF']) == count
+
+
+def test_chooser_random_speaker(sqlite_path):
+    """Test DialogChooser.random_speaker draws from all known speakers."""
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        speakers = set(chooser.random_speaker() for _ in range(100))
+        assert speakers == {'PIKARD', 'DORF', 'WESLEY'}
+        speakers = set(chooser.random_speaker(weighted=True) for _ in range(100))
+        assert speakers == {'PIKARD', 'DORF', 'WESLEY'}
+
+
+def test_chooser_random_speaker_excluding(sqlite_path):
+    """Test DialogChooser.random_speaker never returns the excluded speaker."""
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        for weighted in (False, True):
+            speakers = set(chooser.random_speaker('pikard', weighted) for _ in range(100))
+            assert speakers == {'DORF', 'WESLEY'}
+
+
+def test_chooser_random_speaker_none_left(sqlite_path):
+    """Test DialogChooser.random_speaker raises exception if no candidates remain."""
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        writers.sqlite(the_file.name, [('DORF', 'Aye, sir.')])
+        with ti_sqlite.DialogChooser(the_file.name) as chooser:
+            assert chooser.random_speaker() == 'DORF'
+            with pytest.raises(exceptions.NoDialogFoundException):
+                chooser.random_speaker('DORF')
+
+
+def test_chooser_random_dialogs(sqlite_path):
+    """Test DialogChooser.random_dialogs fetches the requested number of lines."""
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        dialogs = chooser.random_dialogs(50)
+        assert len(dialogs) == 50
+        assert set(dialogs) <= set(DUMMY_DIALOG)
+
+        dialogs = chooser.random_dialogs(5, 'pikard')
+        assert len(dialogs) == 5
+        assert all(speaker == 'PIKARD' for speaker, __ in dialogs)
+
+        assert chooser.random_dialogs(0) == []
+        with pytest.raises(exceptions.NoDialogFoundException):
+            chooser.random_dialogs(1, 'STEVE')
+
+
+def test_chooser_random_dialogs_distinct(sqlite_path):
+    """Test DialogChooser.random_dialogs with distinct never repeats a line."""
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        chooser.MAX_SQL_VARIABLES = 2
+        dialogs = chooser.random_dialogs(5, distinct=True)
+        assert len(set(dialogs)) == 5
+        dialogs = chooser.random_dialogs(10, 'PIKARD', distinct=True)
+        assert sorted(dialogs) == sorted(d for d in DUMMY_DIALOG if d[0] == 'PIKARD')
+
+
+def test_chooser_shared_across_threads(sqlite_path):
+    """Test one DialogChooser may be used from several threads at once."""
+    results = []
+    errors = []
+
+    def choose():
+        try:
+            for _ in range(20):
+                results.append(chooser.random_dialog())
+                results.extend(chooser.random_dialogs(5))
+        except Exception as e:  # noqa: B902
+            errors.append(e)
+
+    with ti_sqlite.DialogChooser(sqlite_path) as chooser:
+        threads = [threading.Thread(target=choose) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    assert len(results) == 4 * 20 * 6
+    assert set(results) <= set(DUMMY_DIALOG)
+
+
+@pytest.mark.parametrize('open_mode', connections.OPEN_MODES)
+def test_chooser_open_modes(sqlite_path, open_mode):
+    """Test DialogChooser reads the same dialog in every open mode."""
+    with ti_sqlite.DialogChooser(sqlite_path, open_mode) as chooser:
+        assert chooser.dialog_count() == len(DUMMY_DIALOG)
+        assert set(chooser.random_dialogs(20)) <= set(DUMMY_DIALOG)
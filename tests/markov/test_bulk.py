@@ -0,0 +1,76 @@
+import pytest
+import six
+
+from trekipsum import markov
+from trekipsum.markov import bulk
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+LINES = [
+    'Make it so.',
+    'Tea, Earl Grey, hot. Hot!',
+    'Wait... what? Is it',
+    '',
+    '   ',
+    'So. ... it so.',
+]
+
+
+def decode_chain(chain, vocabulary):
+    """Decode a chain of packed word ids into words with rounded weights for comparison."""
+    decoded = {}
+    for key, followers in chain:
+        words = tuple(vocabulary.word(word_id) for word_id in markov.unpack_ngram(key))
+        decoded[words] = sorted((vocabulary.word(follower), round(weight, 6))
+                                for follower, weight in followers)
+    return decoded
+
+
+def test_count_ngrams():
+    """Test count_ngrams counts links within sentences and marks sentence boundaries."""
+    counts = bulk.count_ngrams(['Make it so. Make it', ''], order=1)
+    assert counts == {
+        (bulk.MARKER, 'Make'): 2,
+        ('Make', 'it'): 2,
+        ('it', 'so.'): 1,
+        ('so.', bulk.MARKER): 1,
+        ('it', bulk.MARKER): 1,
+    }
+
+
+def test_bulk_chains_match_ngram_chain_builder():
+    """Test bulk counting builds the same chains as NgramChainBuilder for every order."""
+    for order in range(1, markov.MAX_ORDER + 1):
+        vocabulary = markov.Vocabulary()
+        builder = markov.NgramChainBuilder(vocabulary, order)
+        for line in LINES:
+            builder.process_string(line)
+        expected = decode_chain(builder.iter_normalized(), vocabulary)
+
+        vocabulary = markov.Vocabulary()
+        counts = bulk.count_ngrams(LINES, order)
+        assert decode_chain(bulk.iter_normalized(counts, vocabulary), vocabulary) == expected
+
+
+def test_count_speakers_in_processes():
+    """Test count_speakers gives the same counts when sharding speakers across processes."""
+    dialog_list = [('PIKARD', line) for line in LINES] + [
+        ('SPORK', 'Illogical.'),
+        ('DORF', 'Today is a good day to die.'),
+    ]
+    serial = bulk.count_speakers(dialog_list, order=2)
+    parallel = bulk.count_speakers(dialog_list, order=2, jobs=2)
+    assert set(serial.keys()) == {'PIKARD', 'SPORK', 'DORF'}
+    for speaker, counts in six.iteritems(serial):
+        assert parallel[speaker] == counts
+
+
+def test_iter_id_counts_vocabulary_limit():
+    """Test iter_id_counts refuses n-grams once word ids outgrow packed keys."""
+    with mock.patch('trekipsum.markov.NGRAM_KEY_BASE', new=4):
+        list(bulk.iter_id_counts(bulk.count_ngrams(LINES, 1), markov.Vocabulary()))
+        with pytest.raises(ValueError):
+            bulk.iter_id_counts(bulk.count_ngrams(LINES, 2), markov.Vocabulary())
@@ -1,8 +1,12 @@
 import logging
+import tempfile
 
+import pytest
 import six
 
 from trekipsum import markov
+from trekipsum.exceptions import NoDialogFoundException
+from trekipsum.scrape import writers
 
 try:
     from unittest import mock
@@ -114,3 +118,449 @@ def test_markov_to_chain():
         assert set(chain.keys()) == set(new_chain.keys())
         for speaker, probabilities in six.iteritems(chain):
             assert sort_probs(probabilities) == sort_probs(new_chain[speaker])
+
+
+def test_markov_random_chooser_random_dialogs():
+    """Test MarkovRandomChooser.random_dialogs generates several lines at once."""
+    dialog_list = [
+        ('SPORK', 'Illogical.'),
+        ('PIKARD', 'Engage.'),
+        ('PIKARD', 'Make it so.'),
+    ]
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        writers.markov(the_file.name, dialog_list=dialog_list)
+        with mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=the_file.name):
+            chooser = markov.MarkovRandomChooser()
+
+        dialogs = chooser.random_dialogs(10, 'pikard')
+        assert len(dialogs) == 10
+        assert set(dialogs) <= {('PIKARD', 'Engage.'), ('PIKARD', 'Make it so.')}
+
+        dialogs = chooser.random_dialogs(5, distinct=True)
+        assert len(set(dialogs)) == len(dialogs)
+        assert set(dialogs) <= set(dialog_list)
+
+
+def test_walker_cache_hits_and_misses():
+    """Test WalkerCache loads each context once and counts hits and misses."""
+    chain = {'PIKARD': [('Q', 1.0)], 'Q': [('PIKARD', 1.0)]}
+    loader = mock.Mock(side_effect=lambda context: markov.ChainWalker(chain))
+    cache = markov.WalkerCache(loader)
+
+    walker = cache.get('speakers')
+    assert cache.get('speakers') is walker
+    assert loader.call_count == 1
+
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.count) == (1, 1, 0, 1)
+    assert info.size == walker.approximate_size() > 0
+
+
+def test_walker_cache_evicts_least_recently_used():
+    """Test WalkerCache evicts least recently used walkers once over its size limit."""
+    chain = {'PIKARD': [('Q', 1.0)], 'Q': [('PIKARD', 1.0)]}
+    walker_size = markov.ChainWalker(chain).approximate_size()
+    loader = mock.Mock(side_effect=lambda context: markov.ChainWalker(chain))
+    cache = markov.WalkerCache(loader, max_size=walker_size * 2)
+
+    cache.get('PIKARD')
+    cache.get('DORF')
+    cache.get('PIKARD')  # now DORF is least recently used
+    cache.get('WESLEY')
+    assert cache.info().evictions == 1
+    assert cache.info().count == 2
+
+    cache.get('PIKARD')
+    assert loader.call_count == 3
+    cache.get('DORF')
+    assert loader.call_count == 4
+
+
+def test_markov_random_chooser_caches_walkers():
+    """Test MarkovRandomChooser loads each speaker's chain only once."""
+    dialog_list = [
+        ('SPORK', 'Illogical.'),
+        ('PIKARD', 'Engage.'),
+    ]
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        writers.markov(the_file.name, dialog_list=dialog_list)
+        with mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=the_file.name):
+            chooser = markov.MarkovRandomChooser()
+
+        for _ in range(10):
+            assert chooser.random_dialog('PIKARD') == ('PIKARD', 'Engage.')
+        info = chooser.cache_info()
+        assert (info.hits, info.misses) == (9, 1)
+
+
+def test_chain_walker_next_word_distribution():
+    """Test ChainWalker.next_word picks followers in proportion to their weights."""
+    chain = {
+        'PIKARD': [('Q', 0.7), ('DORF', 0.2), ('ROKER', 0.1)],
+    }
+    walker = markov.ChainWalker(chain)
+    with mock.patch('trekipsum.markov.random.random') as mock_random:
+        for target, expected_word in ((0.0, 'Q'), (0.7, 'Q'), (0.71, 'DORF'),
+                                      (0.85, 'DORF'), (0.95, 'ROKER'), (0.99999, 'ROKER')):
+            mock_random.return_value = target
+            assert walker.next_word('PIKARD') == expected_word
+
+
+def test_chain_walker_next_word_rounding():
+    """Test ChainWalker.next_word picks the last follower if weights sum short of 1."""
+    chain = {
+        'PIKARD': [('Q', 0.5), ('DORF', 0.4999)],
+    }
+    walker = markov.ChainWalker(chain)
+    with mock.patch('trekipsum.markov.random.random', return_value=0.99995):
+        assert walker.next_word('PIKARD') == 'DORF'
+
+
+def test_chain_walker_next_word_unknown():
+    """Test ChainWalker.next_word raises KeyError for words not in the chain."""
+    walker = markov.ChainWalker({'PIKARD': [('Q', 1.0)]})
+    with pytest.raises(KeyError):
+        walker.next_word('STEVE')
+    assert walker.next_word() == 'PIKARD'
+
+
+def test_markov_word_chain_builder_iter_normalized():
+    """Test WordChainBuilder.iter_normalized lazily yields the same links as normalize."""
+    builder = markov.WordChainBuilder()
+    for word in ('PIKARD', 'Q', 'PIKARD', 'DORF', 'PIKARD'):
+        builder.add_next(word)
+
+    links = builder.iter_normalized()
+    assert not isinstance(links, dict)
+    links = dict(links)
+    chain = builder.normalize()
+    assert set(links.keys()) == set(chain.keys())
+    for leader, probs in six.iteritems(chain):
+        assert sort_probs(probs) == sort_probs(links[leader])
+    assert dict(links['PIKARD']) == {'Q': 0.5, 'DORF': 0.5}
+
+
+@mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=':memory:')
+def test_markov_store_chain_from_stream():
+    """Test DialogChainDatastore.store_chain accepts a stream of links."""
+    builder = markov.SentenceChainBuilder()
+    builder.process_string('Make it so.')
+    with markov.DialogChainDatastore() as store:
+        store.reinitialize()
+        store.store_chain('PIKARD', builder.iter_normalized())
+        assert store.get_next_word_candidates('PIKARD', 'Make') == [('it', 1.0)]
+        assert set(store.get_vocabulary('PIKARD')) == {'', 'Make', 'it', 'so.'}
+
+
+def test_markov_bulk_load():
+    """Test DialogChainDatastore.bulk_load stores chains and restores journaling."""
+    chain = {
+        'PIKARD': [('Q', 2.0 / 3), ('DORF', 1.0 / 3)],
+        'Q': [('PIKARD', 1.0)],
+    }
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        with markov.DialogChainDatastore(the_file.name) as store:
+            conn = store._conn
+            journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+            with store.bulk_load():
+                assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'memory'
+                assert conn.execute('PRAGMA synchronous').fetchone()[0] == 0
+                store.reinitialize()
+                store.store_chain('speakers', chain)
+                store.index()
+            assert conn.execute('PRAGMA journal_mode').fetchone()[0] == journal_mode
+
+            new_chain = store.to_chain('speakers')
+            for speaker, probabilities in six.iteritems(chain):
+                assert sort_probs(probabilities) == sort_probs(new_chain[speaker])
+
+            indexes = conn.execute('SELECT name FROM sqlite_master '
+                                   'WHERE type = ? AND tbl_name = ?',
+                                   ('index', 'markov')).fetchall()
+            assert indexes == [('markov_context_word_idx',)]
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + store.SQL_SELECT_BY_CONTEXT_AND_WORD,
+                                (0, 1)).fetchall()
+            assert 'COVERING INDEX' in ' '.join(str(row[-1]) for row in plan)
+
+        with markov.DialogChainDatastore(the_file.name) as store:
+            assert store.get_contexts() == ['speakers']  # committed by bulk_load
+
+
+def test_markov_bulk_load_rolls_back_on_error():
+    """Test DialogChainDatastore.bulk_load discards the transaction if an error occurs."""
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        with markov.DialogChainDatastore(the_file.name) as store:
+            store.reinitialize()
+            store._conn.commit()
+            store._conn.execute('PRAGMA cache_size=10')  # spill pages before rolling back
+            with pytest.raises(RuntimeError):
+                with store.bulk_load():
+                    for number in range(50):
+                        store.store_chain('speaker{}'.format(number), dict(
+                            ('word{}'.format(word), [('next{}'.format(word), 1.0)])
+                            for word in range(number * 20, number * 20 + 20)))
+                    raise RuntimeError()
+            assert store.get_contexts() == []
+            assert store._conn.execute('SELECT COUNT(*) FROM vocabulary').fetchone() == (1,)
+
+
+def test_markov_bulk_load_rolls_back_rebuilt_tables():
+    """Test DialogChainDatastore.bulk_load restores tables dropped and recreated within it."""
+    chain = {'PIKARD': [('Q', 1.0)], 'Q': [('PIKARD', 1.0)]}
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        with markov.DialogChainDatastore(the_file.name) as store:
+            store.reinitialize()
+            store.store_chain('speakers', chain)
+            store._conn.commit()
+            with pytest.raises(RuntimeError):
+                with store.bulk_load():
+                    store.reinitialize()
+                    store.store_chain('dialog', chain)
+                    store.index()
+                    raise RuntimeError()
+            assert store.get_contexts() == ['speakers']
+            assert store.to_chain('speakers') == chain
+            indexes = store._conn.execute('SELECT name FROM sqlite_master WHERE type = ?',
+                                          ('index',)).fetchall()
+            assert ('markov_context_word_idx',) not in indexes
+
+
+def test_vocabulary():
+    """Test Vocabulary interns words as dense ids starting after the delimiter."""
+    vocabulary = markov.Vocabulary()
+    assert vocabulary.word_id(markov.SENTENCE_DELIMITER) == markov.SENTENCE_DELIMITER_ID
+    assert vocabulary.intern('Engage.') == 1
+    assert vocabulary.intern('Make') == 2
+    assert vocabulary.intern('Engage.') == 1
+    assert vocabulary.word(2) == 'Make'
+    assert 'Make' in vocabulary
+    assert 'so.' not in vocabulary
+    assert len(vocabulary) == 3
+
+
+def test_markov_datastore_interns_words():
+    """Test DialogChainDatastore stores only integer ids in the markov table."""
+    builder = markov.SentenceChainBuilder()
+    builder.process_string('Make it so.')
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        with markov.DialogChainDatastore(the_file.name) as store:
+            store.reinitialize()
+            store.store_chain('PIKARD', builder.iter_normalized())
+            store.store_chain('RIKER', {'': [('Make', 1.0)], 'Make': [('', 1.0)]})
+            types = store._conn.execute('SELECT DISTINCT typeof(context_id), typeof(word_id), '
+                                        'typeof(next_word_id) FROM markov').fetchall()
+            assert types == [('integer', 'integer', 'integer')]
+
+        with markov.DialogChainDatastore(the_file.name) as store:
+            vocabulary = store.vocabulary
+            assert sorted(vocabulary.words) == ['', 'Make', 'it', 'so.']
+            id_chain = store.to_id_chain('RIKER')
+            make_id = vocabulary.word_id('Make')
+            assert id_chain[markov.SENTENCE_DELIMITER_ID] == [(make_id, 1.0)]
+            assert id_chain[make_id] == [(markov.SENTENCE_DELIMITER_ID, 1.0)]
+            assert store.to_id_chain('SPORK') == {}
+
+            walker = markov.ChainWalker(store.to_id_chain('PIKARD'), vocabulary)
+            assert walker.build_sentence() == 'Make it so.'
+
+
+def test_markov_adjacency_layout():
+    """Test MarkovRandomChooser walks the adjacency table lazily when it exists."""
+    dialog_list = [
+        ('SPORK', 'Illogical.'),
+        ('PIKARD', 'Make it so.'),
+    ]
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        writers.markov(the_file.name, dialog_list=dialog_list,
+                       markov_layout=markov.MARKOV_LAYOUT_ADJACENCY)
+        with markov.DialogChainDatastore(the_file.name) as store:
+            assert store.has_adjacency()
+            make_id = store.vocabulary.word_id('Make')
+            next_word_ids, cumulative_weights = store.get_adjacency('PIKARD', make_id)
+            assert list(next_word_ids) == [store.vocabulary.word_id('it')]
+            assert list(cumulative_weights) == [1.0]
+            assert store.get_adjacency('SPORK', make_id) is None
+
+        with mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=the_file.name):
+            chooser = markov.MarkovRandomChooser()
+        assert chooser.random_dialog('pikard') == ('PIKARD', 'Make it so.')
+        walker = chooser._walkers.get('PIKARD')
+        assert isinstance(walker, markov.LazyChainWalker)
+        assert len(walker._compiled) == 4  # delimiter plus each word reached
+        with pytest.raises(NoDialogFoundException):
+            chooser.random_dialog('Q')
+
+
+def test_lazy_walkers_stay_within_cache_size():
+    """Test lazy walkers drop old rows and are evicted from the cache as they grow."""
+    dialog_list = [
+        (speaker, ' '.join('{}{}'.format(speaker, number) for number in range(50)) + '.')
+        for speaker in ('PIKARD', 'RIKER', 'DORF')
+    ]
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        writers.markov(the_file.name, dialog_list=dialog_list,
+                       markov_layout=markov.MARKOV_LAYOUT_ADJACENCY)
+        with markov.DialogChainDatastore(the_file.name) as store:
+            walker = markov.LazyChainWalker(store, 'PIKARD', max_size=2048)
+            assert walker.build_sentence() == dialog_list[0][1]
+            assert walker.approximate_size() <= 2048
+            assert 0 < len(walker._compiled) < 51
+
+        with mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=the_file.name):
+            chooser = markov.MarkovRandomChooser(cache_size=6000)
+        for speaker, line in dialog_list:
+            assert chooser.random_dialog(speaker) == (speaker, line)
+            chooser.random_dialog(speaker)  # measures the walker after it grew
+        info = chooser.cache_info()
+        walkers = [walker for walker, __ in chooser._walkers._walkers.values()]
+        assert info.evictions > 0
+        assert info.size == sum(walker.approximate_size() for walker in walkers)
+        assert info.size <= 6000
+
+
+def test_pack_ngram():
+    """Test pack_ngram keys single words by id and round-trips longer n-grams."""
+    assert markov.pack_ngram([5]) == 5
+    for word_ids in ((0, 0), (1, 2), (3, 0, 7), (markov.NGRAM_KEY_BASE - 2,) * 3):
+        key = markov.pack_ngram(word_ids)
+        assert key >= markov.NGRAM_KEY_BASE
+        assert key < 2 ** 63
+        assert markov.unpack_ngram(key) == word_ids
+    assert markov.pack_ngram((1, 2)) != markov.pack_ngram((2, 1))
+
+
+@mock.patch('trekipsum.markov.NGRAM_KEY_BASE', new=4)
+@mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=':memory:')
+def test_ngram_vocabulary_limit():
+    """Test chains above order 1 refuse vocabularies too big for packed n-gram keys."""
+    markov.NgramChainBuilder(markov.Vocabulary(), order=1).process_string('a b c d e.')
+    builder = markov.NgramChainBuilder(markov.Vocabulary(), order=2)
+    with pytest.raises(ValueError):
+        builder.process_string('a b c d e.')
+
+    with markov.DialogChainDatastore() as store:
+        store.reinitialize()
+        for word in ('a', 'b', 'c', 'd'):
+            store.vocabulary.intern(word)
+        store.store_id_counts('PIKARD', [(1, [(2, 1)])])
+        with pytest.raises(ValueError):
+            store.store_id_counts('RIKER', [(1, [(2, 1)])], order=2)
+        with pytest.raises(ValueError):
+            store.store_id_chain('RIKER', [(1, [(2, 1.0)])], order=2)
+
+
+def test_ngram_chain_builder():
+    """Test NgramChainBuilder adds links for every context length up to its order."""
+    vocabulary = markov.Vocabulary()
+    builder = markov.NgramChainBuilder(vocabulary, order=2)
+    builder.process_string('Make it so. Make it go.')
+    chain = builder.normalize()
+    ids = vocabulary.word_id
+    assert sort_probs(chain[ids('it')]) == [(ids('so.'), 0.5), (ids('go.'), 0.5)]
+    assert chain[markov.pack_ngram((markov.SENTENCE_DELIMITER_ID, ids('Make')))] == \
+        [(ids('it'), 1.0)]
+    assert chain[markov.pack_ngram((ids('Make'), ids('it')))] == chain[ids('it')]
+    assert markov.pack_ngram((ids('so.'), markov.SENTENCE_DELIMITER_ID)) not in chain
+
+    with pytest.raises(ValueError):
+        markov.NgramChainBuilder(vocabulary, order=markov.MAX_ORDER + 1)
+
+
+def test_chain_walker_backs_off():
+    """Test ChainWalker falls back to shorter contexts missing from higher-order chains."""
+    vocabulary = markov.Vocabulary(['', 'Make', 'it', 'so.'])
+    delimiter = markov.SENTENCE_DELIMITER_ID
+    chain = {
+        delimiter: [(1, 1.0)],
+        markov.pack_ngram((delimiter, 1)): [(2, 1.0)],
+        2: [(3, 1.0)],  # no (Make, it) context, so walking backs off to (it,)
+        3: [(delimiter, 1.0)],
+    }
+    walker = markov.ChainWalker(chain, vocabulary, order=2)
+    assert walker.build_sentence() == 'Make it so.'
+    with pytest.raises(KeyError):
+        walker.next_word_after([1, 3, 1])
+
+
+def test_markov_higher_order_chooser():
+    """Test MarkovRandomChooser walks higher-order chains written by the markov writer."""
+    dialog_list = [
+        ('PIKARD', 'Make it so. Tea, Earl Grey, hot.'),
+        ('SPORK', 'Illogical.'),
+    ]
+    for markov_layout in markov.MARKOV_LAYOUTS:
+        with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+            writers.markov(the_file.name, dialog_list=dialog_list, order=3,
+                           markov_layout=markov_layout)
+            with markov.DialogChainDatastore(the_file.name) as store:
+                assert store.get_order('PIKARD') == 3
+                assert store.get_order('speakers') == 1
+                assert set(store.get_vocabulary('SPORK')) == {'', 'Illogical.'}
+                assert store.to_chain('PIKARD')[('', 'Make', 'it')] == [('so.', 1.0)]
+
+            with mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=the_file.name):
+                chooser = markov.MarkovRandomChooser()
+            lines = set(line for __, line in chooser.random_dialogs(20, 'PIKARD'))
+            assert lines <= {'Make it so.', 'Tea, Earl Grey, hot.'}
+
+
+@mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=':memory:')
+def test_markov_merge_counts():
+    """Test DialogChainDatastore.merge_counts renormalizes only the merged groups."""
+    with markov.DialogChainDatastore() as store:
+        store.reinitialize()
+        store.store_id_counts('PIKARD', [(1, [(2, 3), (3, 1)]), (2, [(1, 1)])])
+        store.index()
+        store.merge_counts('PIKARD', [(1, [(3, 2), (4, 1)])])
+        chain = store.to_id_chain('PIKARD')
+        assert sort_probs(chain[1]) == sort_probs([(2, 3.0 / 7), (3, 3.0 / 7), (4, 1.0 / 7)])
+        assert chain[2] == [(1, 1.0)]
+        counts = store._conn.execute('SELECT next_word_id, count FROM markov '
+                                     'WHERE word_id=1 ORDER BY next_word_id').fetchall()
+        assert counts == [(2, 3), (3, 3), (4, 1)]
+
+
+@mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=':memory:')
+def test_markov_merge_counts_errors():
+    """Test DialogChainDatastore.merge_counts refuses chains it cannot merge into."""
+    with markov.DialogChainDatastore() as store:
+        store.reinitialize()
+        store.store_chain('speakers', {'PIKARD': [('Q', 1.0)]})
+        with pytest.raises(ValueError):
+            store.merge_counts('speakers', [(store.vocabulary.word_id('PIKARD'), [(1, 1)])])
+        store.store_id_counts('PIKARD', [(1, [(2, 1)])], order=2)
+        with pytest.raises(ValueError):
+            store.merge_counts('PIKARD', [(1, [(2, 1)])])
+
+
+def test_chain_walker_build_sentence_limits():
+    """Test ChainWalker.build_sentence ends sentences soon after reaching its limits."""
+    chain = {
+        '': [('Ha', 1.0)],
+        'Ha': [('ha', 1.0)],
+        'ha': [('ha', 0.999999), ('ha!', 0.000001)],
+        'ha!': [('', 1.0)],
+    }
+    walker = markov.ChainWalker(chain)
+    # no word can end the sentence, so it is cut off at twice the limit
+    assert len(walker.build_sentence(max_words=5).split()) == 10
+    assert len(walker.build_sentence(max_words=None, max_chars=12)) <= 24 + len(' ha')
+
+    chain['ha'].append(('', 0.000001))
+    walker = markov.ChainWalker(chain)
+    # once over the limit, the first word that can end the sentence does
+    assert walker.build_sentence(max_words=3) == 'Ha ha ha'
+
+
+def test_markov_random_chooser_latency_info():
+    """Test MarkovRandomChooser records how long each sentence takes to build."""
+    dialog_list = [('PIKARD', 'Make it so.')]
+    with tempfile.NamedTemporaryFile(suffix='.sqlite') as the_file:
+        writers.markov(the_file.name, dialog_list=dialog_list)
+        with mock.patch('trekipsum.markov.DEFAULT_SQLITE_PATH', new=the_file.name):
+            chooser = markov.MarkovRandomChooser(max_words=2)
+        assert chooser.random_dialog('PIKARD') == ('PIKARD', 'Make it so.')
+        chooser.random_dialogs(4, 'PIKARD')
+        info = chooser.latency_info()
+        assert info.count == 5
+        assert 0 < info.p50 <= info.p99 <= info.max
@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+from trekipsum.exceptions import NoDialogFoundException
+from trekipsum.markov import pool
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def mock_chooser():
+    """Build a mock chooser whose lines say which call generated them."""
+    chooser = mock.Mock()
+    chooser.random_speaker.return_value = 'PIKARD'
+
+    def random_dialogs(count, speaker=None, distinct=False):
+        if speaker == 'Q':
+            raise NoDialogFoundException(speaker)
+        return [(speaker, 'pooled') for __ in range(count)]
+
+    chooser.random_dialogs.side_effect = random_dialogs
+    chooser.random_dialog.side_effect = lambda speaker: (speaker, 'on demand')
+    return chooser
+
+
+def test_sentence_pool_serves_from_buffer():
+    """Test SentencePool serves pooled sentences and refills below the low-water mark."""
+    chooser = mock_chooser()
+    with pool.SentencePool(chooser, high_water=4, speakers=['pikard']) as sentence_pool:
+        assert sentence_pool.wait_for_refills(timeout=5)
+        chooser.random_dialogs.assert_called_once_with(4, 'PIKARD')
+        assert sentence_pool.info().buffered == 4
+
+        assert sentence_pool.random_dialog('Pikard') == ('PIKARD', 'pooled')
+        assert sentence_pool.random_dialog() == ('PIKARD', 'pooled')
+        assert sentence_pool.random_dialog() == ('PIKARD', 'pooled')  # now below low water
+        assert sentence_pool.wait_for_refills(timeout=5)
+        chooser.random_dialogs.assert_called_with(3, 'PIKARD')
+
+        info = sentence_pool.info()
+        assert (info.hits, info.misses, info.refills, info.buffered) == (3, 0, 2, 4)
+        assert info.refill_lag.count == 2
+    chooser.random_dialog.assert_not_called()
+
+
+def test_sentence_pool_falls_back_when_empty():
+    """Test SentencePool generates on demand when a speaker has no pooled sentences."""
+    chooser = mock_chooser()
+    with pool.SentencePool(chooser, high_water=2) as sentence_pool:
+        assert sentence_pool.random_dialog('SPORK') == ('SPORK', 'on demand')
+        assert sentence_pool.wait_for_refills(timeout=5)
+        assert sentence_pool.random_dialogs(2, 'SPORK') == [('SPORK', 'pooled')] * 2
+        assert sentence_pool.info()[:2] == (2, 1)
+
+        # speakers without dialog are skipped by the refill thread
+        chooser.random_dialog.side_effect = NoDialogFoundException('Q')
+        with pytest.raises(NoDialogFoundException):
+            sentence_pool.random_dialog('Q')
+        sentence_pool._request_refill('Q')
+        assert sentence_pool.wait_for_refills(timeout=5)
+        assert sentence_pool.info().refills == 2
+
+
+def test_sentence_pool_rejects_empty_buffers():
+    """Test SentencePool needs room for at least one sentence per speaker."""
+    with pytest.raises(ValueError):
+        pool.SentencePool(mock_chooser(), high_water=0)
+
+
+def test_sentence_pool_survives_refill_errors():
+    """Test SentencePool keeps refilling after the chooser fails, counting failures."""
+    chooser = mock_chooser()
+    random_dialogs = chooser.random_dialogs.side_effect
+    errors = [sqlite3.OperationalError('database is locked')]
+
+    def flaky_random_dialogs(count, speaker=None, distinct=False):
+        if errors:
+            raise errors.pop()
+        return random_dialogs(count, speaker, distinct)
+
+    chooser.random_dialogs.side_effect = flaky_random_dialogs
+    with pool.SentencePool(chooser, high_water=2, speakers=['pikard']) as sentence_pool:
+        assert sentence_pool.wait_for_refills(timeout=5)
+        assert sentence_pool.random_dialog('PIKARD') == ('PIKARD', 'on demand')
+        assert sentence_pool.wait_for_refills(timeout=5)
+        assert sentence_pool.random_dialog('PIKARD') == ('PIKARD', 'pooled')
+
+        info = sentence_pool.info()
+        assert (info.misses, info.hits, info.refills, info.failures) == (1, 1, 1, 1)
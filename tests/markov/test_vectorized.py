@@ -0,0 +1,73 @@
+from collections import Counter
+
+import pytest
+
+from trekipsum import markov
+from trekipsum.markov import vectorized
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+DELIMITER = markov.SENTENCE_DELIMITER_ID
+
+
+def build_vocabulary():
+    """Build a vocabulary with ids 1 to 4 for Make, it, so., and go."""
+    return markov.Vocabulary(['', 'Make', 'it', 'so.', 'go.'])
+
+
+def test_vectorized_walker_distribution():
+    """Test VectorizedChainWalker draws followers in proportion to their weights."""
+    numpy = pytest.importorskip('numpy')
+    chain = {
+        DELIMITER: [(1, 1.0)],
+        1: [(2, 1.0)],
+        2: [(3, 0.25), (4, 0.75)],
+        3: [(DELIMITER, 1.0)],
+        4: [(DELIMITER, 1.0)],
+    }
+    walker = vectorized.VectorizedChainWalker(chain, build_vocabulary())
+    sentences = walker.build_sentences(20000, random_state=numpy.random.RandomState(1701))
+    counts = Counter(sentences)
+    assert set(counts.keys()) == {'Make it so.', 'Make it go.'}
+    assert counts['Make it so.'] / 20000.0 == pytest.approx(0.25, abs=0.02)
+
+
+def test_vectorized_walker_backs_off_and_limits():
+    """Test VectorizedChainWalker backs off to shorter contexts and bounds sentences."""
+    pytest.importorskip('numpy')
+    chain = {
+        DELIMITER: [(1, 1.0)],
+        markov.pack_ngram((DELIMITER, 1)): [(2, 1.0)],
+        2: [(2, 0.999999), (3, 0.000001)],  # no (Make, it) context; back off to (it,)
+        3: [(DELIMITER, 1.0)],
+    }
+    walker = vectorized.VectorizedChainWalker(chain, build_vocabulary(), order=2)
+    assert walker.build_sentences(3, max_words=4) == ['Make it it it it it it it'] * 3
+
+    chain[2].append((DELIMITER, 0.000001))
+    walker = vectorized.VectorizedChainWalker(chain, build_vocabulary(), order=2)
+    assert walker.build_sentence(max_words=4) == 'Make it it it'
+
+    with pytest.raises(ValueError):
+        walker.build_sentences(1, max_words=None)
+    with pytest.raises(ValueError):
+        walker.build_sentences(1, max_chars=80)
+    with pytest.raises(KeyError):
+        vectorized.VectorizedChainWalker({DELIMITER: [(1, 1.0)]}, build_vocabulary(),
+                                         order=2).build_sentences(1)
+
+
+def test_batch_walker_falls_back_without_numpy():
+    """Test batch_walker uses the pure-Python ChainWalker when NumPy is absent."""
+    chain = {DELIMITER: [(1, 1.0)], 1: [(DELIMITER, 1.0)]}
+    with mock.patch('trekipsum.markov.vectorized.numpy', new=None):
+        walker = vectorized.batch_walker(chain, build_vocabulary())
+        with pytest.raises(ImportError):
+            vectorized.VectorizedChainWalker(chain, build_vocabulary())
+    assert isinstance(walker, markov.ChainWalker)
+    assert walker.build_sentences(2) == ['Make', 'Make']
+    assert walker.build_sentences(2, random_state=mock.sentinel.random_state) == \
+        ['Make', 'Make']
@@ -0,0 +1,26 @@
+from trekipsum.scrape.sources import extracted
+
+
+def test_extraction_cache_matches_version_and_hash():
+    """Test ExtractionCache only hits for the same extractor version and script hash."""
+    dialog = [('PIKARD', 'Engage.'), ('RIKER', 'Aye, sir.')]
+    with extracted.ExtractionCache(':memory:') as cache:
+        assert cache.get('chakoteya.net', 'NextGen/101.htm', 1, 'abc') is None
+        cache.put('chakoteya.net', 'NextGen/101.htm', 1, 'abc', dialog)
+
+        assert cache.get('chakoteya.net', 'NextGen/101.htm', 1, 'abc') == dialog
+        assert cache.get('chakoteya.net', 'NextGen/101.htm', 2, 'abc') is None
+        assert cache.get('chakoteya.net', 'NextGen/101.htm', 1, 'def') is None
+        assert cache.get('st-minutiae.com', 'NextGen/101.htm', 1, 'abc') is None
+        assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_extraction_cache_replaces_older_extraction():
+    """Test ExtractionCache keeps only the latest extraction of each script."""
+    with extracted.ExtractionCache(':memory:') as cache:
+        cache.put('st-minutiae.com', 102, 1, 'abc', [('PIKARD', 'Engage.')])
+        cache.put('st-minutiae.com', 102, 1, 'def', [('PIKARD', 'Make it so.')])
+
+        assert cache.get('st-minutiae.com', 102, 1, 'abc') is None
+        assert cache.get('st-minutiae.com', 102, 1, 'def') == [('PIKARD', 'Make it so.')]
+        assert cache._conn.execute('SELECT COUNT(*) FROM extracted').fetchone() == (1,)
@@ -0,0 +1,53 @@
+import json
+import shutil
+import tempfile
+from os import path
+
+from trekipsum.scrape.sources import manifest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def test_manifest_records_and_saves():
+    """Test ScriptManifest records downloads and saves them for the next run."""
+    tmp_dir = tempfile.mkdtemp()
+    file_path = path.join(tmp_dir, manifest.MANIFEST_FILE_NAME)
+    response = mock.Mock(headers={'ETag': '"1701"', 'Last-Modified': 'Sat, 1 Jan 2364'})
+    try:
+        script_manifest = manifest.ScriptManifest(file_path)
+        assert script_manifest.get('tng/101') is None
+        assert script_manifest.conditional_headers('tng/101') == {}
+        script_manifest.record('tng/101', 'http://example.foobar/101', response, 'Engage.')
+        script_manifest.save()
+
+        with open(file_path) as f:
+            entry = json.load(f)['tng/101']
+        assert entry['url'] == 'http://example.foobar/101'
+        assert entry['sha1'] == manifest.content_hash('Engage.')
+        assert manifest.ScriptManifest(file_path).conditional_headers('tng/101') == {
+            'If-None-Match': '"1701"',
+            'If-Modified-Since': 'Sat, 1 Jan 2364',
+        }
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_manifest_not_modified_keeps_hash():
+    """Test recording an unchanged script only updates when it was fetched."""
+    script_manifest = manifest.ScriptManifest('/nonexistent/manifest.json')
+    script_manifest.record(1, 'http://example.foobar/1', mock.Mock(headers={}), 'Make it so.')
+    first = dict(script_manifest.get(1))
+    script_manifest.record(1, 'http://example.foobar/1', mock.Mock(headers={}), None)
+    second = script_manifest.get(1)
+    assert second['sha1'] == first['sha1']
+    assert second['fetched_at'] >= first['fetched_at']
+
+
+def test_manifest_save_skips_unchanged():
+    """Test ScriptManifest.save writes nothing when nothing was recorded."""
+    script_manifest = manifest.ScriptManifest('/nonexistent/manifest.json')
+    script_manifest.save()
+    assert not path.exists('/nonexistent/manifest.json')
@@ -1,11 +1,18 @@
+import os
 import shutil
 import tempfile
+import threading
+import time
+import timeit
 import uuid
 from os import path
 
 import six
+from six.moves import range, socketserver
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
-from trekipsum.scrape.sources import scraper
+from trekipsum.scrape import sources, utils
+from trekipsum.scrape.sources import manifest, scraper
 
 from . import TEST_ASSETS_PATH
 
@@ -25,6 +32,14 @@ class ConcreteTestScraper(scraper.AbstractScraper):
         pass
 
 
+def test_manifest_path_within_assets_path():
+    """Test scrapers keep their manifest in their assets_path, and none without one."""
+    scraper = ConcreteTestScraper()
+    assert scraper.manifest is None
+    scraper.assets_path = TEST_ASSETS_PATH
+    assert scraper._manifest_path() == path.join(TEST_ASSETS_PATH, manifest.MANIFEST_FILE_NAME)
+
+
 def test_extract_dialog_does_scrape_when_not_yet_on_disk():
     """Test extract_dialog scrapes script if not found on disk."""
     script_id = 1701
@@ -38,7 +53,7 @@ def test_extract_dialog_does_scrape_when_not_yet_on_disk():
 
         results = scraper.extract_dialog(script_id)
 
-        scraper.scrape_script.assert_called_with(script_id, file_path)
+        scraper.scrape_script.assert_called_with(script_id, file_path + '.gz')
         assert scraper._extract_from_file.called is False
         assert results == []
 
@@ -53,6 +68,17 @@ def test_extract_dialog_does_scrape_when_not_yet_on_disk():
             shutil.rmtree(tmp_dir)
 
 
+def test_extract_dialog_without_fetch_skips_missing_script():
+    """Test extract_dialog without fetch returns no dialog for a script not on disk."""
+    scraper = ConcreteTestScraper()
+    scraper.scrape_script = mock.Mock()
+    scraper._path_for_script_id = mock.Mock(return_value=path.join(
+        tempfile.gettempdir(), str(uuid.uuid4())))
+
+    assert scraper.extract_dialog(1701, fetch=False) == []
+    assert scraper.scrape_script.called is False
+
+
 def test_extract_dialog_reads_version_from_disk():
     """Test extract_dialog uses the version already saved to disk."""
     script_id = 1701
@@ -88,8 +114,8 @@ def test_scrape_script(mock_retriable_session):
         mock_retriable_session.assert_called_with()
         mock_retriable_session.return_value.get.assert_called_with(expected_called_url, timeout=1)
 
-        out_file.seek(0)
-        written_contents = out_file.read()
+        with open(out_file.name) as f:  # replaced by the download, so reopen
+            written_contents = f.read()
         assert written_contents == dummy_script
 
 
@@ -120,3 +146,193 @@ def test_scrape_script_not_found(mock_retriable_session):
         assert size == 0  # file should be empty
 
     mock_get.assert_called_with(expected_called_url, timeout=1)
+
+
+class LocalScriptServer(object):
+    """Threaded local HTTP server serving scripts slowly, asking for a retry at first."""
+
+    def __init__(self, latency=0.1, retry_after=1):
+        """Start serving on a free port in a background thread."""
+        server = self
+        self.latency = latency
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server.lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    server.requests.append((self.path, timeit.default_timer()))
+                    retry = server.retry_after and len(server.requests) == 1
+                try:
+                    time.sleep(server.latency)
+                    if retry:
+                        self.send_response(429)
+                        self.send_header('Retry-After', str(server.retry_after))
+                        self.end_headers()
+                        return
+                    etag = '"{}"'.format(self.path)
+                    if self.headers.get('If-None-Match') == etag:
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    body = 'script {}'.format(self.path).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.host = '127.0.0.1:{}'.format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """Stop serving."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request on its own thread."""
+
+    daemon_threads = True
+
+
+class LocalTestScraper(ConcreteTestScraper):
+    """Save scripts from a LocalScriptServer into a directory."""
+
+    def __init__(self, host, directory):
+        """Initialize with the server's host and the directory to save into."""
+        super(LocalTestScraper, self).__init__()
+        self.script_url = 'http://' + host + '/{}.txt'
+        self.directory = directory
+
+    def _path_for_script_id(self, script_id):
+        return path.join(self.directory, 'scripts', '{}.txt'.format(script_id))
+
+    def _manifest_path(self):
+        return path.join(self.directory, 'manifest.json')
+
+    def read_script(self, script_id):
+        """Read a downloaded script's text."""
+        with scraper.open_script(self.fetch_script(script_id)) as f:
+            return f.read()
+
+    def write_script(self, script_id, text):
+        """Overwrite a downloaded script's text."""
+        with scraper.open_script(self.fetch_script(script_id), 'w') as f:
+            f.write(text)
+
+
+def test_fetch_ids_limits_concurrency_and_honors_retry_after():
+    """Test concurrent fetching stays within host limits and waits as asked by Retry-After."""
+    server = LocalScriptServer(latency=0.1, retry_after=1)
+    tmp_dir = tempfile.mkdtemp()
+    script_ids = list(range(8))
+    try:
+        utils.set_host_limits(server.host, max_concurrent=2, requests_per_second=100)
+        scraper = LocalTestScraper(server.host, tmp_dir)
+
+        sources._fetch_ids(script_ids, scraper, 'local', fetch_threads=4)
+
+        for script_id in script_ids:
+            assert scraper.read_script(script_id) == 'script /{}.txt'.format(script_id)
+        assert len(server.requests) == len(script_ids) + 1
+        assert server.max_in_flight == 2
+        # no request started from the 429 arriving until its Retry-After had passed
+        refused_path, refused_at = server.requests[0]
+        answered_at = refused_at + server.latency
+        assert not [requested_at for __, requested_at in server.requests
+                    if answered_at + 0.05 < requested_at < answered_at + 0.95]
+        retried_at = [requested_at for request_path, requested_at in server.requests[1:]
+                      if request_path == refused_path]
+        assert retried_at[0] >= answered_at + 0.95
+    finally:
+        server.close()
+        shutil.rmtree(tmp_dir)
+
+
+def test_fetch_ids_skips_scripts_on_disk():
+    """Test concurrent fetching makes no requests for scripts already downloaded."""
+    server = LocalScriptServer(latency=0, retry_after=0)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        scraper = LocalTestScraper(server.host, tmp_dir)
+        os.makedirs(path.join(tmp_dir, 'scripts'))
+        with open(scraper._path_for_script_id(1), 'w') as f:
+            f.write('already here')
+
+        sources._fetch_ids([1, 2], scraper, 'local', fetch_threads=2)
+
+        assert [request_path for request_path, __ in server.requests] == ['/2.txt']
+        assert scraper.read_script(1) == 'already here'
+        assert not path.exists(scraper._path_for_script_id(1))  # compressed instead
+    finally:
+        server.close()
+        shutil.rmtree(tmp_dir)
+
+
+def test_fetch_ids_refresh_sends_conditional_requests():
+    """Test refreshing records a manifest and re-downloads only scripts that changed."""
+    server = LocalScriptServer(latency=0, retry_after=0)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        scraper = LocalTestScraper(server.host, tmp_dir)
+        sources._fetch_ids([1, 2], scraper, 'local')
+        scraper.save_manifest()
+        entry = LocalTestScraper(server.host, tmp_dir).manifest.get(1)
+        assert entry['url'] == scraper.script_url.format(1)
+        assert entry['etag'] == '"/1.txt"'
+        assert entry['sha1'] == manifest.content_hash('script /1.txt')
+
+        # script 2 changed on the server, so its etag no longer matches
+        scraper = LocalTestScraper(server.host, tmp_dir)
+        scraper.manifest.get(2)['etag'] = '"stale"'
+        scraper.write_script(2, 'stale')
+        del server.requests[:]
+        sources._fetch_ids([1, 2], scraper, 'local', refresh=True)
+
+        assert sorted(request_path for request_path, __ in server.requests) == [
+            '/1.txt', '/2.txt']
+        assert scraper.read_script(2) == 'script /2.txt'
+        assert scraper.manifest.get(1)['fetched_at'] >= entry['fetched_at']
+        assert scraper.manifest.get(2)['etag'] == '"/2.txt"'
+    finally:
+        server.close()
+        shutil.rmtree(tmp_dir)
+
+
+def test_extract_dialog_streams_compressed_script():
+    """Test extract_dialog reads a compressed script like the loose one it replaced."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_path = path.join(tmp_dir, 'tng.txt')
+        shutil.copy(path.join(TEST_ASSETS_PATH, 'tng.txt'), file_path)
+        scraper = ConcreteTestScraper()
+        scraper._path_for_script_id = mock.Mock(return_value=file_path)
+        scraper._extract_from_file = mock.Mock(side_effect=lambda f: f.read())
+        loose_text = scraper.extract_dialog(1701)
+
+        scraper.scrape_script = mock.Mock()
+        compressed_path = scraper.fetch_script(1701)
+
+        assert compressed_path == file_path + '.gz'
+        assert not path.exists(file_path)
+        assert scraper.scrape_script.called is False
+        assert path.getsize(compressed_path) < len(loose_text)
+        assert scraper.extract_dialog(1701) == loose_text
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -1,4 +1,14 @@
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
 from trekipsum.scrape import sources
+from trekipsum.scrape.sources import scraper as scraper_module
+from trekipsum.scrape.sources.extracted import ExtractionCache
+
+from . import TEST_ASSETS_PATH
 
 try:
     from unittest import mock
@@ -43,3 +53,84 @@ def test_ds9(mock_extract_dialog):
     assert mock_extract_dialog.call_count == expected_count
     assert len(extracted_dialog) == expected_count
     assert extracted_dialog == [dummy_dialog] * expected_count
+
+
+def test_scrape_ids_in_worker_processes():
+    """Test extracting in worker processes matches a serial run, in script order."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        shutil.copy(path.join(TEST_ASSETS_PATH, 'tos.html'), tmp_dir)
+        scraper = sources.chakoteya.Scraper()
+        scraper.assets_path = tmp_dir
+        script_ids = ['tos.html'] * 6
+        serial_dialog = sources._scrape_ids(script_ids, scraper, 'test')
+        # the script is on disk, so this only compresses it before extracting
+        with ProcessPoolExecutor(2) as executor:
+            parallel_dialog = sources._scrape_ids(script_ids, scraper, 'test', executor=executor)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    assert len(serial_dialog) > 0
+    assert parallel_dialog == serial_dialog
+
+
+def test_scrapers_use_extractor_versions():
+    """Test each scraper's extractor_version is its Extractor's version."""
+    for module in (sources.chakoteya, sources.stminutiae):
+        assert module.Scraper().extractor_version == module.Extractor.version
+        assert module.Scraper.extractor_version == module.Extractor.version
+
+
+def test_scraper_pickles_without_sessions():
+    """Test scrapers can be sent to worker processes, getting new sessions there."""
+    scraper = sources.chakoteya.Scraper()
+    unpickled = pickle.loads(pickle.dumps(scraper))
+    assert unpickled.script_url == scraper.script_url
+    assert unpickled.session is not scraper.session
+
+
+def test_scrape_ids_reuses_cached_dialog():
+    """Test only scripts that are new or changed since cached are extracted again."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        shutil.copy(path.join(TEST_ASSETS_PATH, 'tos.html'), path.join(tmp_dir, 'a.html'))
+        shutil.copy(path.join(TEST_ASSETS_PATH, 'tos.html'), path.join(tmp_dir, 'b.html'))
+        scraper = sources.chakoteya.Scraper()
+        scraper.assets_path = tmp_dir
+        script_ids = ['a.html', 'b.html']
+        with ExtractionCache(':memory:') as cache:
+            first_dialog = sources._scrape_ids(script_ids, scraper, 'test', extraction_cache=cache)
+
+            with mock.patch.object(scraper, 'extract_dialog') as mock_extract_dialog:
+                cached_dialog = sources._scrape_ids(script_ids, scraper, 'test',
+                                                    extraction_cache=cache)
+                assert mock_extract_dialog.called is False
+            assert cached_dialog == first_dialog
+
+            with scraper_module.open_script(scraper.fetch_script('b.html')) as f:
+                script = f.read()
+            with scraper_module.open_script(scraper.fetch_script('b.html'), 'w') as f:
+                f.write(script.replace(u'eight.', u'Qapla!'))
+            with mock.patch.object(scraper, 'extract_dialog',
+                                   wraps=scraper.extract_dialog) as mock_extract_dialog:
+                changed_dialog = sources._scrape_ids(script_ids, scraper, 'test',
+                                                     extraction_cache=cache)
+                mock_extract_dialog.assert_called_once_with('b.html', fetch=False)
+            assert ('BONES', 'Qapla!') in changed_dialog
+            assert changed_dialog.count(('BONES', 'eight.')) == 1
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_scrape_ids_downloads_each_script_once():
+    """Test scripts that failed to download are not downloaded again to extract them."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        scraper = sources.chakoteya.Scraper()
+        scraper.assets_path = tmp_dir
+        with mock.patch.object(scraper, 'scrape_script') as mock_scrape_script:
+            dialog = sources._scrape_ids(['a.html', 'b.html'], scraper, 'test', fetch_threads=2)
+        assert dialog == []
+        assert mock_scrape_script.call_count == 2
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -1,5 +1,7 @@
 import shlex
 
+import pytest
+
 from trekipsum.scrape import cli
 
 try:
@@ -15,6 +17,11 @@ def test_parse_cli_args():
         args = cli.parse_cli_args()
     assert args.no_assets is False
     assert args.speakers is None
+    assert args.markov_layout == 'edges'
+    assert args.order == 1
+    assert args.jobs == 1
+    assert args.fetch_threads == cli.DEFAULT_FETCH_THREADS
+    assert args.refresh is False
     # If specified, limit source data to
     assert args.mov_tos is False
     assert args.mov_tng is False
@@ -25,11 +32,38 @@ def test_parse_cli_args():
     assert args.json == 'foo.json'
     assert args.pickle is None
     assert args.sqlite is None
+    assert args.compact is None
     # CLI display options
     assert args.progress is False
     assert args.verbose == 0
 
 
+@pytest.mark.parametrize('option', ['--jobs', '--fetch-threads'])
+def test_parse_cli_args_rejects_nonpositive_counts(option):
+    """Test parse_cli_args rejects worker counts below one."""
+    for value in ('0', '-2'):
+        with mock.patch('argparse._sys.argv', ['.', option, value]):
+            with pytest.raises(SystemExit):
+                cli.parse_cli_args()
+
+
+@mock.patch('trekipsum.scrape.cli.ProcessPoolExecutor')
+def test_read_sources_shares_worker_processes(mock_executor):
+    """Test read_sources gives every source one pool of extraction processes."""
+    first_source = mock.Mock(return_value=[('PIKARD', 'Engage.')])
+    second_source = mock.Mock(return_value=[('RIKER', 'Aye.')])
+
+    all_dialog = cli.read_sources([first_source, second_source], False, fetch_threads=2, jobs=3)
+
+    assert all_dialog == [('PIKARD', 'Engage.'), ('RIKER', 'Aye.')]
+    mock_executor.assert_called_once_with(3)
+    for source in (first_source, second_source):
+        source.assert_called_once_with(cli.chakoteya, False, fetch_threads=2,
+                                       executor=mock_executor.return_value, refresh=False,
+                                       extraction_cache=None)
+    mock_executor.return_value.shutdown.assert_called_once_with()
+
+
 @mock.patch('trekipsum.scrape.cli.logging')
 @mock.patch('trekipsum.scrape.cli.logger')
 def test_configure_logging_0(mock_logger, mock_logging):
@@ -1,4 +1,10 @@
-from trekipsum.scrape.utils import magicdictlist, retriable_session
+import email.utils
+import threading
+import time
+import timeit
+
+from trekipsum.scrape.utils import (RateLimiter, magicdictlist, rate_limiter, retriable_session,
+                                    retry_after_seconds, set_host_limits)
 
 
 def test_magicdictlist_getitem():
@@ -43,3 +49,66 @@ def test_retriable_session():
     assert session.adapters['https://'] == session.adapters['http://']
     assert session.adapters['https://'].max_retries.total == total
     assert session.adapters['https://'].max_retries.backoff_factor == backoff_factor
+    assert session.adapters['https://'].max_retries.respect_retry_after_header is False
+
+
+def test_rate_limiter_spaces_requests():
+    """Test RateLimiter starts requests no faster than requests_per_second."""
+    limiter = RateLimiter(max_concurrent=5, requests_per_second=20)
+    starts = []
+    for __ in range(4):
+        with limiter:
+            starts.append(timeit.default_timer())
+    assert all(later - earlier >= 0.04 for earlier, later in zip(starts, starts[1:]))
+
+
+def test_rate_limiter_limits_concurrency():
+    """Test RateLimiter never lets more than max_concurrent requests in at once."""
+    limiter = RateLimiter(max_concurrent=2, requests_per_second=None)
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, max
+
+    def request():
+        with limiter:
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+
+    threads = [threading.Thread(target=request) for __ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert in_flight == [0, 2]
+
+
+def test_rate_limiter_hold_off():
+    """Test RateLimiter.hold_off delays the next request."""
+    limiter = RateLimiter(requests_per_second=None)
+    limiter.hold_off(0.1)
+    start = timeit.default_timer()
+    with limiter:
+        assert timeit.default_timer() - start >= 0.09
+
+
+def test_rate_limiter_shared_per_host():
+    """Test rate_limiter returns one limiter per host, using its configured limits."""
+    assert rate_limiter('http://example.foobar/1.txt') is rate_limiter('http://example.foobar/2')
+    assert rate_limiter('http://example.foobar/') is not rate_limiter('http://example.foobaz/')
+    limiter = rate_limiter('http://limited.foobar/')
+    set_host_limits('limited.foobar', max_concurrent=1, requests_per_second=None)
+    assert rate_limiter('http://limited.foobar/') is not limiter
+    assert rate_limiter('http://limited.foobar/')._interval == 0.0
+
+
+def test_retry_after_seconds():
+    """Test retry_after_seconds reads delays and HTTP dates, ignoring anything else."""
+    assert retry_after_seconds('120') == 120.0
+    assert retry_after_seconds('-5') == 0.0
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds('soon') is None
+    in_a_minute = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 55 <= retry_after_seconds(in_a_minute) <= 60
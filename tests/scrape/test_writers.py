@@ -1,5 +1,7 @@
 import json
+import os
 import pickle
+import shutil
 import tempfile
 
 import six
@@ -7,6 +9,11 @@ import six
 from trekipsum import markov
 from trekipsum.scrape import writers
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 
 def test_dictify_dialog():
     """Test _dictify_dialog correctly de-dupes and organizes into dict(list)."""
@@ -93,3 +100,98 @@ def test_write_markov():
             writers.markov(the_file.name, dialog_list=dialog_list)
             speakers = datastore.get_vocabulary(context='speakers')
             assert set(speakers) == set([item[0] for item in dialog_list])
+
+
+def test_write_pickle_shards():
+    """Test pickle writes one shard per speaker when given a directory."""
+    dummy_data = {
+        'SPORK': ['Illogical'],
+        'PIKARD': ['Engage.', 'Make it so.'],
+    }
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        writers.pickle(tmp_dir, dummy_data)
+        with open(os.path.join(tmp_dir, 'index.pickle'), 'rb') as index_file:
+            shard_index = pickle.load(index_file)
+        assert set(shard_index.keys()) == set(dummy_data.keys())
+        for speaker, shard_name in six.iteritems(shard_index):
+            with open(os.path.join(tmp_dir, shard_name), 'rb') as shard_file:
+                assert pickle.load(shard_file) == dummy_data[speaker]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_update_markov():
+    """Test update_markov gives the same chains as rewriting markov with all dialog."""
+    old_dialog = [
+        ('PIKARD', 'Make it so.'),
+        ('SPORK', 'Illogical.'),
+    ]
+    new_dialog = [
+        ('PIKARD', 'Make it go. Tea, Earl Grey, hot.'),
+        ('DORF', 'Today is a good day to die.'),
+    ]
+
+    def read_chains(file_path):
+        with markov.DialogChainDatastore(file_path) as datastore:
+            chains = dict(
+                (speaker, dict((word, sorted((next_word, round(weight, 6))
+                                             for next_word, weight in links))
+                               for word, links in six.iteritems(datastore.to_chain(speaker))))
+                for speaker in ('PIKARD', 'SPORK', 'DORF'))
+            next_word_ids, cumulative_weights = datastore.get_adjacency(
+                'PIKARD', datastore.vocabulary.word_id('it'))
+            chains['adjacency'] = sorted(datastore.vocabulary.word(word_id)
+                                         for word_id in next_word_ids)
+            turns = datastore.get_next_word_candidates('speakers', 'PIKARD')
+            return chains, sorted(speaker for speaker, __ in turns)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        updated_path = os.path.join(tmp_dir, 'updated.sqlite')
+        rewritten_path = os.path.join(tmp_dir, 'rewritten.sqlite')
+        writers.markov(updated_path, old_dialog, markov_layout=markov.MARKOV_LAYOUT_ADJACENCY)
+        writers.update_markov(updated_path, new_dialog)
+        writers.markov(rewritten_path, old_dialog + new_dialog,
+                       markov_layout=markov.MARKOV_LAYOUT_ADJACENCY)
+        updated_chains, updated_turns = read_chains(updated_path)
+        rewritten_chains, rewritten_turns = read_chains(rewritten_path)
+        assert updated_chains == rewritten_chains
+        assert updated_chains['adjacency'] == ['go.', 'so.']
+        assert updated_turns == rewritten_turns == ['DORF', 'SPORK']
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_write_assets_skips_unchanged():
+    """Test write_assets leaves assets built from the same dialog and options alone."""
+    dialog_list = [
+        ('PIKARD', 'Make it so.'),
+        ('SPORK', 'Illogical.'),
+    ]
+
+    tmp_dir = tempfile.mkdtemp()
+    sqlite_path = os.path.join(tmp_dir, 'dialog.sqlite')
+    compact_path = os.path.join(tmp_dir, 'dialog.compact')
+    try:
+        with mock.patch('trekipsum.scrape.writers.DEFAULT_SQLITE_PATH', new=sqlite_path), \
+                mock.patch('trekipsum.dialog.compact.DEFAULT_COMPACT_PATH', new=compact_path):
+            writers.write_assets(dialog_list)
+            assert os.path.exists(sqlite_path) and os.path.exists(compact_path)
+            with mock.patch('trekipsum.scrape.writers.sqlite') as mock_sqlite:
+                writers.write_assets(list(dialog_list))
+                assert mock_sqlite.called is False
+            with mock.patch('trekipsum.scrape.writers.ASSETS_FORMAT_VERSION', new=-1), \
+                    mock.patch('trekipsum.scrape.writers.sqlite') as mock_sqlite:
+                writers.write_assets(dialog_list)
+                assert mock_sqlite.called is True
+
+            writers.write_assets(dialog_list, order=2)
+            with markov.DialogChainDatastore(sqlite_path) as datastore:
+                assert datastore.get_order('PIKARD') == 2
+            writers.write_assets([('DORF', 'Qapla!')] + dialog_list, order=2)
+            with markov.DialogChainDatastore(sqlite_path) as datastore:
+                assert 'DORF' in datastore.get_vocabulary('speakers')
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -19,18 +19,20 @@ def test_parse_cli_args_default():
     assert args.paragraphs == 3
     assert args.sentences == 4
     assert args.attribute is False
+    assert args.open_mode == 'ro'
     assert args.debug is False
 
 
 def test_parse_cli_args_misc_args():
     """Test parse_cli_args for some typical CLI arguments."""
-    cli_args = shlex.split('. --speaker pikard --attribute -n 1 -s 5')
+    cli_args = shlex.split('. --speaker pikard --attribute -n 1 -s 5 --open-mode memory')
     with mock.patch('argparse._sys.argv', cli_args):
         args = cli.parse_cli_args()
     assert args.speaker == 'pikard'
     assert args.paragraphs == 1
     assert args.sentences == 5
     assert args.attribute is True
+    assert args.open_mode == 'memory'
     assert args.debug is False
 
 
@@ -48,3 +50,23 @@ def test_print_dialog_without_speaker(mock_print):
     line, speaker, show = 'Did he say, "engage"?', 'DORF', False
     cli.print_dialog(line, speaker, show)
     mock_print.assert_called_with('Did he say, "engage"?')
+
+
+@mock.patch('trekipsum.cli.print_dialog')
+@mock.patch('trekipsum.cli.dialog.SqliteRandomChooser')
+def test_main_cli_batches_sentences(mock_chooser_class, mock_print_dialog):
+    """Test main_cli fetches each paragraph's remaining sentences in one batch."""
+    mock_chooser = mock_chooser_class.return_value
+    mock_chooser.random_dialog.return_value = ('PIKARD', 'Engage.')
+    mock_chooser.random_dialogs.return_value = [('PIKARD', 'Make it so.')] * 4
+    cli_args = shlex.split('. -n 2 -s 5')
+    with mock.patch('argparse._sys.argv', cli_args):
+        cli.main_cli()
+
+    assert mock_chooser.random_dialog.call_count == 2
+    mock_chooser.random_dialog.assert_called_with(None)
+    assert mock_chooser.random_dialogs.call_count == 2
+    mock_chooser.random_dialogs.assert_called_with(4, 'PIKARD')
+    line, speaker, show_speaker = mock_print_dialog.call_args[0]
+    assert sorted(line.split('. ')) in (['Engage', 'Make it so.'], ['Engage.', 'Make it so'])
+    assert (speaker, show_speaker) == ('PIKARD', False)
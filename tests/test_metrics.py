@@ -0,0 +1,37 @@
+import pytest
+
+from trekipsum import metrics
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def test_latency_histogram_percentiles():
+    """Test LatencyHistogram reports percentiles as their buckets' upper bounds."""
+    histogram = metrics.LatencyHistogram(min_latency=0.001, bucket_count=4)
+    assert histogram.info() == metrics.LatencyInfo(0, 0.0, 0.0, 0.0, 0.0)
+    for seconds in [0.0005] * 90 + [0.003] * 9 + [0.5]:
+        histogram.record(seconds)
+    assert histogram.count == 100
+    assert histogram.percentile(50) == 0.001
+    assert histogram.percentile(99) == 0.004
+    assert histogram.info() == metrics.LatencyInfo(100, 0.001, 0.001, 0.004, 0.5)
+    assert histogram.buckets() == [(0.001, 90), (0.002, 0), (0.004, 9), (0.008, 0), (0.5, 1)]
+    assert histogram.percentile(100) == 0.5
+
+
+@mock.patch('trekipsum.metrics.timeit.default_timer')
+def test_latency_histogram_time(mock_timer):
+    """Test LatencyHistogram.time records its block's latency even if it raises."""
+    mock_timer.side_effect = [10.0, 10.0015, 20.0, 20.25]
+    histogram = metrics.LatencyHistogram(min_latency=0.001, bucket_count=4)
+    with histogram.time():
+        pass
+    with pytest.raises(RuntimeError):
+        with histogram.time():
+            raise RuntimeError()
+    assert histogram.count == 2
+    assert histogram.max == pytest.approx(0.25)
+    assert [count for __, count in histogram.buckets()] == [0, 1, 0, 0, 1]
@@ -0,0 +1,36 @@
+import random
+from collections import Counter
+
+import pytest
+
+from trekipsum import sampling
+
+
+def test_alias_table_distribution():
+    """Test AliasTable.sample draws indexes in proportion to their weights."""
+    weights = [1, 2, 0, 7]
+    table = sampling.AliasTable(weights)
+    assert len(table) == len(weights)
+
+    rng = random.Random(1701)
+    draws = 100000
+    counts = Counter(table.sample(rng) for _ in range(draws))
+    assert counts[2] == 0
+    for index, weight in enumerate(weights):
+        expected = 1.0 * weight / sum(weights)
+        assert abs(1.0 * counts[index] / draws - expected) < 0.01
+
+
+def test_alias_table_uniform():
+    """Test AliasTable.sample handles equal weights."""
+    table = sampling.AliasTable([3] * 5)
+    rng = random.Random(1701)
+    assert set(table.sample(rng) for _ in range(1000)) == set(range(5))
+
+
+def test_alias_table_requires_positive_weight():
+    """Test AliasTable raises ValueError when no weight is positive."""
+    with pytest.raises(ValueError):
+        sampling.AliasTable([])
+    with pytest.raises(ValueError):
+        sampling.AliasTable([0, 0])
@@ -4,6 +4,7 @@ import argparse
 import logging
 
 from trekipsum import dialog, markov
+from trekipsum.dialog.connections import OPEN_MODE_READ_ONLY, OPEN_MODES
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,8 @@ def parse_cli_args():
                         help='number of paragraphs to output (default: %(default)s)')
     parser.add_argument('-s', '--sentences', type=positive, default=4,
                         help='number of sentences per paragraph (default: %(default)s)')
+    parser.add_argument('--open-mode', choices=OPEN_MODES, default=OPEN_MODE_READ_ONLY,
+                        help='how to open the dialog database (default: %(default)s)')
     parser.add_argument('--debug', action='store_true',
                         help='enable debug logging')
     return parser.parse_args()
@@ -51,16 +54,14 @@ def main_cli():
     logger.setLevel(loglevel)
 
     if args.markov is True:
-        chooser = markov.MarkovRandomChooser()
+        chooser = markov.MarkovRandomChooser(open_mode=args.open_mode)
     else:
-        chooser = dialog.SqliteRandomChooser()
+        chooser = dialog.SqliteRandomChooser(open_mode=args.open_mode)
 
     for paragraph in range(args.paragraphs):
-        speaker = args.speaker
-        lines = []
-        for __ in range(args.sentences):
-            speaker, line = chooser.random_dialog(speaker)
-            lines.append(line)
+        speaker, line = chooser.random_dialog(args.speaker)
+        lines = [line]
+        lines.extend(line for __, line in chooser.random_dialogs(args.sentences - 1, speaker))
         print_dialog(' '.join(set(lines)), speaker, args.attribute)
         if paragraph < args.paragraphs - 1:
             print()  # padding between paragraphs
@@ -1 +1,2 @@
+from .compact import DialogChooser as CompactRandomChooser  # noqa: F401
 from .sqlite import DialogChooser as SqliteRandomChooser  # noqa: F401
@@ -0,0 +1,282 @@
+"""
+Compact, memory-mapped dialog corpus.
+
+All lines live in one UTF-8 blob indexed by an array of byte offsets, with a parallel
+array of speaker ids. Lines are grouped by speaker, so each speaker's lines are one
+contiguous range of indexes. The file is memory-mapped read-only, so loading it costs
+almost nothing and every process reading it shares the same pages.
+
+File layout (all integers little-endian)::
+
+    8 bytes   magic
+    4 bytes   uint32 length of the JSON header
+    header    JSON describing the speakers and where each section starts
+    offsets   uint32 * (line_count + 1), byte offsets of each line within the text
+    speakers  uint16 * line_count, speaker id of each line
+    text      UTF-8 encoded lines concatenated with no separators
+
+Sections are aligned to 8 bytes from the start of the file.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import sys
+from array import array
+from os import path
+
+import six
+from six.moves import range
+
+from ..exceptions import NoDialogFoundException
+from ..sampling import AliasTable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPACT_PATH = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                                 'assets', 'dialog.compact')
+
+MAGIC = b'TREKIPSM'
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+MAX_SPEAKERS = 2 ** 16
+
+_replace_file = getattr(os, 'replace', os.rename)  # atomic, and on Windows overwrites
+
+
+def _padding(length):
+    return b'\0' * (-length % ALIGNMENT)
+
+
+def _to_little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tostring() if six.PY2 else values.tobytes()
+
+
+def write_corpus(file_path, dialog_list):
+    """Write (speaker, line) tuples to file_path in the compact corpus format."""
+    speakers = []
+    speaker_ids = array('H')
+    offsets = array('I', [0])
+    text = bytearray()
+    for speaker, line in sorted(dialog_list, key=lambda dialog: dialog[0]):
+        if not speakers or speakers[-1][0] != speaker:
+            if len(speakers) == MAX_SPEAKERS:
+                raise ValueError('compact corpus supports at most {} speakers'.format(
+                    MAX_SPEAKERS))
+            speakers.append([speaker, len(speaker_ids), len(speaker_ids)])
+        speakers[-1][2] += 1
+        speaker_ids.append(len(speakers) - 1)
+        text.extend(line.encode('utf-8'))
+        offsets.append(len(text))
+
+    sections = [_to_little_endian(offsets), _to_little_endian(speaker_ids), bytes(text)]
+    header = {
+        'version': FORMAT_VERSION,
+        'line_count': len(speaker_ids),
+        'speakers': speakers,  # [name, first index, last index + 1]
+        'sections': [],
+    }
+    # the header's own length determines where sections start, so settle it first
+    header_length = 0
+    while True:
+        position = len(MAGIC) + 4 + header_length
+        position += len(_padding(position))
+        header['sections'] = []
+        for section in sections:
+            header['sections'].append([position, len(section)])
+            position += len(section) + len(_padding(len(section)))
+        encoded_header = json.dumps(header, sort_keys=True).encode('utf-8')
+        if len(encoded_header) == header_length:
+            break
+        header_length = len(encoded_header)
+
+    # write beside the target and rename over it so processes that currently have the
+    # old file mapped keep reading the old, intact pages
+    temp_path = '{}.tmp'.format(file_path)
+    replaced = False
+    try:
+        with open(temp_path, 'wb') as compact_file:
+            compact_file.write(MAGIC)
+            compact_file.write(struct.pack('<I', header_length))
+            compact_file.write(encoded_header)
+            compact_file.write(_padding(len(MAGIC) + 4 + header_length))
+            for section in sections:
+                compact_file.write(section)
+                compact_file.write(_padding(len(section)))
+        _replace_file(temp_path, file_path)
+        replaced = True
+    finally:
+        if not replaced and path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class CompactCorpus(object):
+    """Read-only view of a memory-mapped compact corpus file."""
+
+    def __init__(self, file_path):
+        """Memory-map the corpus at file_path and read its header."""
+        with open(file_path, 'rb') as compact_file:
+            self._mmap = mmap.mmap(compact_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError('{} is not a compact dialog corpus'.format(file_path))
+        header_start = len(MAGIC) + 4
+        header_length = struct.unpack('<I', self._mmap[len(MAGIC):header_start])[0]
+        header = json.loads(self._mmap[header_start:header_start + header_length]
+                            .decode('utf-8'))
+        if header['version'] != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError('unsupported compact corpus version {}'.format(
+                header['version']))
+
+        self.line_count = header['line_count']
+        self.speakers = [speaker for speaker, __, __ in header['speakers']]
+        self.speaker_ranges = dict((speaker, (first, end))
+                                   for speaker, first, end in header['speakers'])
+        (offsets_at, offsets_length), (ids_at, ids_length), (text_at, __) = \
+            header['sections']
+        self._view = None if six.PY2 else memoryview(self._mmap)
+        self._offsets = self._array('I', offsets_at, offsets_length)
+        self._speaker_ids = self._array('H', ids_at, ids_length)
+        self._text_at = text_at
+
+    def _array(self, typecode, start, length):
+        """Get a typed view of a section, avoiding a copy wherever possible."""
+        if six.PY2 or sys.byteorder != 'little':
+            values = array(typecode)
+            values.fromstring(self._mmap[start:start + length])
+            if sys.byteorder != 'little':
+                values.byteswap()
+            return values
+        return self._view[start:start + length].cast(typecode)
+
+    def __len__(self):
+        return self.line_count
+
+    def line(self, index):
+        """Get the line of dialog at index."""
+        start = self._text_at + self._offsets[index]
+        end = self._text_at + self._offsets[index + 1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def dialog(self, index):
+        """Get the (speaker, line) at index."""
+        return self.speakers[self._speaker_ids[index]], self.line(index)
+
+    def close(self):
+        """Release the memory-mapped file."""
+        for view in (self._offsets, self._speaker_ids, self._view):
+            if isinstance(view, memoryview):
+                view.release()
+        self._mmap.close()
+
+
+class DialogChooser(object):
+    """Randomly choose dialog from a compact corpus file."""
+
+    def __init__(self, file_path=None):
+        """Initialize by memory-mapping the corpus at the default compact path."""
+        self._compact_path = file_path or DEFAULT_COMPACT_PATH
+        self._corpus = CompactCorpus(self._compact_path)
+        self._speaker_indexes = dict((speaker, index)
+                                     for index, speaker in enumerate(self._corpus.speakers))
+        self._speaker_aliases = AliasTable([
+            end - first for first, end in
+            (self._corpus.speaker_ranges[speaker] for speaker in self._corpus.speakers)
+        ]) if self._corpus.speakers else None
+        logger.debug('mapped %s lines of dialog for %s speakers',
+                     len(self._corpus), len(self._corpus.speakers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the memory-mapped corpus."""
+        self._corpus.close()
+
+    def _index_range(self, speaker=None):
+        if speaker is None:
+            return 0, len(self._corpus)
+        return self._corpus.speaker_ranges.get(speaker, (0, 0))
+
+    def dialog_count(self, speaker=None):
+        """Get count of lines."""
+        first, end = self._index_range(speaker.upper() if speaker else None)
+        return end - first
+
+    def random_dialog(self, speaker=None):
+        """
+        Get random line of dialog, optionally limited to specific speaker.
+
+        Returns:
+            tuple containing (speaker name, line of dialog)
+        """
+        speaker = speaker.upper() if speaker else None
+        first, end = self._index_range(speaker)
+        if end == first:
+            raise NoDialogFoundException(speaker)
+        return self._corpus.dialog(random.randrange(first, end))
+
+    def random_dialogs(self, count, speaker=None, distinct=False):
+        """
+        Get several random lines of dialog, optionally limited to specific speaker.
+
+        If distinct is True, no line is repeated, and fewer than count lines are returned
+        if the speaker does not have enough.
+
+        Returns:
+            list of tuples containing (speaker name, line of dialog)
+        """
+        speaker = speaker.upper() if speaker else None
+        first, end = self._index_range(speaker)
+        if end == first:
+            raise NoDialogFoundException(speaker)
+        if distinct:
+            indexes = random.sample(range(first, end), min(count, end - first))
+        else:
+            indexes = [random.randrange(first, end) for __ in range(count)]
+        return [self._corpus.dialog(index) for index in indexes]
+
+    def random_speaker(self, not_speaker=None, weighted=False):
+        """
+        Get random speaker name, optionally excluding specific speaker from candidacy.
+
+        Speakers are drawn uniformly unless weighted is True, in which case each speaker is
+        drawn in proportion to their count of lines.
+        """
+        speakers = self._corpus.speakers
+        excluded = self._speaker_indexes.get(not_speaker.upper()) if not_speaker else None
+        candidate_count = len(speakers) - (0 if excluded is None else 1)
+        if candidate_count < 1:
+            raise NoDialogFoundException()
+
+        if weighted:
+            index = self._speaker_aliases.sample()
+            while index == excluded:
+                index = self._speaker_aliases.sample()
+        else:
+            index = random.randrange(candidate_count)
+            if excluded is not None and index >= excluded:
+                index += 1
+        return speakers[index]
+
+    def all_dialog(self, speaker=None):
+        """
+        Yield all available dialog, optionally limited to specific speaker.
+
+        Returns:
+            generator of tuples containing (speaker name, line of dialog)
+        """
+        first, end = self._index_range(speaker.upper() if speaker else None)
+        for index in range(first, end):
+            yield self._corpus.dialog(index)
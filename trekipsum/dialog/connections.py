@@ -0,0 +1,140 @@
+import logging
+import random
+import sqlite3
+import threading
+import uuid
+from os import path
+
+import six
+from six.moves.urllib.request import pathname2url
+
+logger = logging.getLogger(__name__)
+
+OPEN_MODE_READ_WRITE = 'rw'
+OPEN_MODE_READ_ONLY = 'ro'
+OPEN_MODE_IMMUTABLE = 'immutable'
+OPEN_MODE_MMAP = 'mmap'
+OPEN_MODE_MEMORY = 'memory'
+OPEN_MODES = (
+    OPEN_MODE_READ_WRITE,
+    OPEN_MODE_READ_ONLY,
+    OPEN_MODE_IMMUTABLE,
+    OPEN_MODE_MMAP,
+    OPEN_MODE_MEMORY,
+)
+
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+
+
+def copy_database(source, target):
+    """Copy the entire contents of the source connection's database into target."""
+    if hasattr(source, 'backup'):
+        source.backup(target)
+    else:  # sqlite3 before python 3.7 has no backup API
+        target.executescript('\n'.join(source.iterdump()))
+
+
+class ConnectionPool(object):
+    """
+    Lazily open one sqlite connection per thread for a single database.
+
+    Each thread also gets its own random.Random so callers sharing one object across a
+    thread pool neither share a connection nor contend for the global generator's state.
+
+    The open mode controls how connections see the database file:
+
+    rw: default read-write connections
+    ro: read-only connections
+    immutable: read-only connections that also skip all file locking and change detection
+    mmap: read-only connections that read pages through a memory-mapped file
+    memory: the database is copied once into memory and every thread reads that copy
+    """
+
+    def __init__(self, file_path, mode=OPEN_MODE_READ_WRITE, mmap_size=DEFAULT_MMAP_SIZE):
+        """Initialize a new pool for the database at file_path."""
+        if mode not in OPEN_MODES:
+            raise ValueError('unknown open mode: {}'.format(mode))
+        self.file_path = file_path
+        self.mode = mode
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._memory_uri = None
+        self._memory_keeper = None
+
+    @property
+    def connection(self):
+        """Get the calling thread's connection, opening it if needed."""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @property
+    def random(self):
+        """Get the calling thread's random number generator."""
+        rng = getattr(self._local, 'random', None)
+        if rng is None:
+            rng = self._local.random = random.Random()
+        return rng
+
+    def _file_uri(self, **params):
+        query = '&'.join('{}={}'.format(key, value) for key, value in sorted(params.items()))
+        return 'file:{}?{}'.format(pathname2url(path.abspath(self.file_path)), query)
+
+    def _connect(self):
+        logger.debug('opening %s connection to %s in thread %s',
+                     self.mode, self.file_path, threading.current_thread().name)
+        if self.mode == OPEN_MODE_MEMORY:
+            return self._connect_memory()
+
+        if self.mode != OPEN_MODE_READ_WRITE and not six.PY2 and self.file_path != ':memory:':
+            if self.mode == OPEN_MODE_IMMUTABLE:
+                uri = self._file_uri(mode='ro', immutable=1)
+            else:
+                uri = self._file_uri(mode='ro')
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.file_path, check_same_thread=False)
+        if self.mode == OPEN_MODE_MMAP:
+            conn.execute('PRAGMA mmap_size={:d}'.format(self.mmap_size))
+        return conn
+
+    def _connect_memory(self):
+        if six.PY2:  # no URI support for a shared in-memory database; copy per thread
+            conn = sqlite3.connect(':memory:', check_same_thread=False)
+            self._copy_from_file(conn)
+            return conn
+
+        with self._lock:
+            if self._memory_keeper is None:
+                # the shared in-memory database lives only as long as a connection to it
+                self._memory_uri = 'file:trekipsum-{}?mode=memory&cache=shared'.format(
+                    uuid.uuid4().hex)
+                self._memory_keeper = sqlite3.connect(self._memory_uri, uri=True,
+                                                      check_same_thread=False)
+                self._copy_from_file(self._memory_keeper)
+        return sqlite3.connect(self._memory_uri, uri=True, check_same_thread=False)
+
+    def _copy_from_file(self, target):
+        logger.debug('loading %s into memory', self.file_path)
+        source = sqlite3.connect(self.file_path)
+        try:
+            copy_database(source, target)
+        finally:
+            source.close()
+
+    def close(self):
+        """Close every connection opened by any thread."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            if self._memory_keeper is not None:
+                connections.append(self._memory_keeper)
+                self._memory_keeper = None
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
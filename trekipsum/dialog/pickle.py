@@ -3,12 +3,14 @@ Pickle-based dialog chooser is deprecated.
 """
 from __future__ import absolute_import
 
+import bisect
 import logging
 import pickle
 import random
 from os import path
 
 import six
+from six.moves import range
 
 from ..exceptions import NoDialogFoundException
 
@@ -16,45 +18,98 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_PICKLE_PATH = path.join(path.dirname(path.dirname(path.abspath(__file__))),
                                 'assets', 'dialog.pickle')
+SHARD_INDEX_FILENAME = 'index.pickle'
+
+
+def _load_pickle(file_path):
+    with open(file_path, mode='rb') as pickle_file:
+        return pickle.load(pickle_file)
 
 
 class DialogChooser(object):
-    """Randomly choose dialog from pickled data."""
+    """
+    Randomly choose dialog from pickled data.
+
+    The pickle path may name either a single pickle of all dialog or a directory of
+    per-speaker shards as written by the pickle writer. With shards, a chooser limited to
+    one speaker loads only that speaker's shard.
+    """
 
     def __init__(self, speaker=None):
         """Initialize with no dialog and default pickle path."""
         self.speaker = speaker.upper() if speaker else None
         self._all_dialog = None
-        self._dialog_count = 0
+        self._speakers = None
+        self._cumulative_counts = None
         self._pickle_path = DEFAULT_PICKLE_PATH
 
     @property
     def dialog_count(self):
         """Lazy-load and return count of all speakers' lines."""
-        if self._dialog_count == 0:
-            self._dialog_count = sum(len(lines) for _, lines in six.iteritems(self.all_dialog()))
-        return self._dialog_count
+        cumulative_counts = self.cumulative_counts()[1]
+        return cumulative_counts[-1] if cumulative_counts else 0
+
+    def cumulative_counts(self):
+        """
+        Lazy-load and return speakers with the running total of their lines.
+
+        Returns:
+            tuple containing (list of speakers, list of cumulative line counts)
+        """
+        if self._cumulative_counts is None:
+            speakers, cumulative_counts, total = [], [], 0
+            for speaker, lines in six.iteritems(self.all_dialog()):
+                total += len(lines)
+                speakers.append(speaker)
+                cumulative_counts.append(total)
+            self._speakers, self._cumulative_counts = speakers, cumulative_counts
+        return self._speakers, self._cumulative_counts
 
     def all_dialog(self):
         """Lazy-load and return all dialog."""
         if self._all_dialog is None:
-            logger.debug('no dialog found; loading from pickle')
-            with open(self._pickle_path, mode='rb') as pickle_file:
-                self._all_dialog = pickle.load(pickle_file)
+            if path.isdir(self._pickle_path):
+                logger.debug('no dialog found; loading from pickle shards')
+                self._all_dialog = self._load_shards()
+            else:
+                logger.debug('no dialog found; loading from pickle')
+                self._all_dialog = _load_pickle(self._pickle_path)
             if self.speaker is not None:
                 if self.speaker not in self.all_dialog():
                     raise NoDialogFoundException(self.speaker)
                 self._all_dialog = {
                     self.speaker: self._all_dialog[self.speaker]
                 }
+            total = 0
             for speaker in self._all_dialog.keys():
                 count = len(self._all_dialog[speaker])
                 logger.debug('%s has %s dialog lines', speaker, count)
-                self._dialog_count += count
+                total += count
             logger.debug('%s lines of dialog loaded for %s speakers',
-                         self._dialog_count, len(self._all_dialog.keys()))
+                         total, len(self._all_dialog.keys()))
         return self._all_dialog
 
+    def _load_shards(self):
+        """Load only the needed speakers' shards from the shard directory."""
+        shard_index = _load_pickle(path.join(self._pickle_path, SHARD_INDEX_FILENAME))
+        if self.speaker is None:
+            speakers = shard_index.keys()
+        elif self.speaker in shard_index:
+            speakers = (self.speaker,)
+        else:
+            raise NoDialogFoundException(self.speaker)
+        return dict((speaker, _load_pickle(path.join(self._pickle_path, shard_index[speaker])))
+                    for speaker in speakers)
+
+    def _dialog_at(self, offset):
+        """Get the (speaker, line) at the offset into all speakers' lines."""
+        speakers, cumulative_counts = self.cumulative_counts()
+        index = bisect.bisect_right(cumulative_counts, offset)
+        if index > 0:
+            offset -= cumulative_counts[index - 1]
+        speaker = speakers[index]
+        return speaker, self.all_dialog()[speaker][offset]
+
     def random_dialog(self):
         """
         Get random line of dialog.
@@ -64,9 +119,32 @@ class DialogChooser(object):
         """
         logger.debug('choosing random from count %s', self.dialog_count)
         offset = random.randrange(self.dialog_count)
-        for speaker, lines in six.iteritems(self.all_dialog()):
-            count = len(lines)
-            if offset >= count:
-                offset -= count
-                continue
-            return speaker, lines[offset]
+        return self._dialog_at(offset)
+
+    def random_dialogs(self, count, speaker=None, distinct=False):
+        """
+        Get several random lines of dialog, optionally limited to specific speaker.
+
+        If distinct is True, no line is repeated, and fewer than count lines are returned
+        if there are not enough.
+
+        Returns:
+            list of tuples containing (speaker name, line of dialog)
+        """
+        if speaker is not None:
+            speaker = speaker.upper()
+            if speaker not in self.all_dialog():
+                raise NoDialogFoundException(speaker)
+            lines = self.all_dialog()[speaker]
+            offsets = _random_offsets(len(lines), count, distinct)
+            return [(speaker, lines[offset]) for offset in offsets]
+
+        offsets = _random_offsets(self.dialog_count, count, distinct)
+        return [self._dialog_at(offset) for offset in offsets]
+
+
+def _random_offsets(total, count, distinct=False):
+    """Draw count random offsets in range(total), optionally without repeats."""
+    if distinct:
+        return random.sample(range(total), min(count, total))
+    return [random.randrange(total) for __ in range(count)]
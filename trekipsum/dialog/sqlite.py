@@ -1,87 +1,214 @@
 import logging
-import random
 import sqlite3
+from collections import namedtuple
 from os import path
 
+from six.moves import range
+
 from ..exceptions import NoDialogFoundException
+from ..sampling import AliasTable
+from .connections import OPEN_MODE_READ_ONLY, ConnectionPool
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_SQLITE_PATH = path.join(path.dirname(path.dirname(path.abspath(__file__))),
                                 'assets', 'dialog.sqlite')
 
+SpeakerStats = namedtuple('SpeakerStats',
+                          ('line_count', 'first_dialog_id', 'last_dialog_id', 'word_count'))
+NO_STATS = SpeakerStats(0, None, None, 0)
+
 
 class DialogChooser(object):
-    """Randomly choose dialog from sqlite database."""
-
-    SQL_COUNT = 'SELECT COUNT(1) FROM dialog'
-    SQL_COUNT_BY_SPEAKER = 'SELECT COUNT(1) FROM dialog WHERE speaker = ?'
-    SQL_GET_RANDOM = 'SELECT speaker, line FROM dialog ORDER BY dialog_id LIMIT 1 OFFSET ?'
-    SQL_GET_RANDOM_BY_SPEAKER = 'SELECT speaker, line FROM dialog WHERE speaker = ?' \
-                                'ORDER BY dialog_id LIMIT 1 OFFSET ?'
-    SQL_GET_RANDOM_SPEAKER = 'SELECT DISTINCT speaker FROM dialog ORDER BY RANDOM() LIMIT 1'
-    SQL_GET_RANDOM_SPEAKER_EXCLUDING = 'SELECT DISTINCT speaker FROM dialog WHERE speaker <> ?' \
-                                       'ORDER BY RANDOM() LIMIT 1'
+    """
+    Randomly choose dialog from sqlite database.
+
+    One chooser may be shared across threads; each thread reads through its own read-only
+    connection and random number generator. See ConnectionPool for available open modes.
+    """
+
+    SQL_GET_STATS = 'SELECT speaker, line_count, first_dialog_id, last_dialog_id, word_count ' \
+                    'FROM speakers JOIN speaker_stats USING (speaker_id) ' \
+                    'ORDER BY speaker_id'
+    SQL_COMPUTE_STATS = 'SELECT speaker, COUNT(1), MIN(dialog_id), MAX(dialog_id), NULL ' \
+                        'FROM dialog GROUP BY speaker ORDER BY speaker'
+    SQL_GET_BY_ID = 'SELECT speaker, line FROM dialog WHERE dialog_id = ?'
+    SQL_GET_BY_IDS = 'SELECT dialog_id, speaker, line FROM dialog WHERE dialog_id IN ({})'
+    SQL_GET_IDS = 'SELECT dialog_id FROM dialog ORDER BY dialog_id'
+    SQL_GET_IDS_BY_SPEAKER = 'SELECT dialog_id FROM dialog WHERE speaker = ? ORDER BY dialog_id'
     SQL_GET_ALL = 'SELECT speaker, line FROM dialog'
     SQL_GET_ALL_BY_SPEAKER = 'SELECT speaker, line FROM dialog WHERE speaker = ?'
 
-    def __init__(self):
-        """Initialize with no dialog and default sqlite path."""
-        self._dialog_counts = {}
-        self._sqlite_path = DEFAULT_SQLITE_PATH
-        self._conn = sqlite3.connect(self._sqlite_path)
+    MAX_SQL_VARIABLES = 999  # SQLITE_MAX_VARIABLE_NUMBER for sqlite < 3.32
+
+    def __init__(self, file_path=None, open_mode=OPEN_MODE_READ_ONLY):
+        """Initialize with default sqlite path and load per-speaker statistics."""
+        self._sqlite_path = file_path or DEFAULT_SQLITE_PATH
+        self._pool = ConnectionPool(self._sqlite_path, open_mode)
+        self._speaker_stats = self._load_speaker_stats()
+        self._speakers = [speaker for speaker in self._speaker_stats if speaker is not None]
+        self._speakers.sort(key=lambda speaker: self._speaker_stats[speaker].first_dialog_id)
+        self._speaker_indexes = dict((speaker, index)
+                                     for index, speaker in enumerate(self._speakers))
+        self._sparse_ids = {}
+        self._speaker_aliases = AliasTable([self._speaker_stats[speaker].line_count
+                                            for speaker in self._speakers]) \
+            if self._speakers else None
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args):
-        self._conn.close()
+        self.close()
 
-    def __del__(self, *args):
-        self._conn.close()
+    @property
+    def _conn(self):
+        return self._pool.connection
 
-    def dialog_count(self, speaker=None):
-        """Lazy-load and return count of lines."""
+    def close(self):
+        """Close all threads' connections to the database."""
+        self._pool.close()
+
+    def _load_speaker_stats(self):
+        """
+        Load statistics for all speakers, plus the totals for all dialog keyed by None.
+
+        Statistics are read from the speaker_stats table written by the sqlite writer. For
+        older assets lacking that table, they are aggregated from the dialog table once.
+        """
+        try:
+            rows = self._conn.execute(self.SQL_GET_STATS).fetchall()
+        except sqlite3.OperationalError:
+            logger.debug('no speaker_stats found; aggregating from dialog')
+            rows = self._conn.execute(self.SQL_COMPUTE_STATS).fetchall()
+
+        all_stats = dict((row[0], SpeakerStats(*row[1:])) for row in rows if row[1] > 0)
+        if all_stats:
+            word_counts = [stats.word_count for stats in all_stats.values()]
+            all_stats[None] = SpeakerStats(
+                sum(stats.line_count for stats in all_stats.values()),
+                min(stats.first_dialog_id for stats in all_stats.values()),
+                max(stats.last_dialog_id for stats in all_stats.values()),
+                None if None in word_counts else sum(word_counts),
+            )
+        logger.debug('loaded stats for %s speakers', len(all_stats))
+        return all_stats
+
+    def speaker_stats(self, speaker=None):
+        """
+        Get statistics about lines, optionally limited to specific speaker.
+
+        Returns:
+            SpeakerStats containing line_count, first_dialog_id, last_dialog_id, word_count
+        """
         speaker = speaker.upper() if speaker else None
-        if speaker not in self._dialog_counts:
-            if speaker is not None:
-                count = self._conn.execute(self.SQL_COUNT_BY_SPEAKER,
-                                           (speaker,)).fetchone()[0]
-            else:
-                count = self._conn.execute(self.SQL_COUNT).fetchone()[0]
-            self._dialog_counts[speaker] = count
-        return self._dialog_counts[speaker]
+        return self._speaker_stats.get(speaker, NO_STATS)
+
+    def dialog_range(self, speaker=None):
+        """
+        Get the count and dialog_id bounds of lines.
+
+        Returns:
+            tuple containing (count of lines, first dialog_id, last dialog_id)
+        """
+        return tuple(self.speaker_stats(speaker)[:3])
+
+    def dialog_count(self, speaker=None):
+        """Get count of lines."""
+        return self.speaker_stats(speaker).line_count
 
     def random_dialog(self, speaker=None):
         """
         Get random line of dialog, optionally limited to specific speaker.
 
+        The line is fetched directly by its primary key, drawn from the speaker's
+        dialog_ids as for random_dialogs.
+
         Returns:
             tuple containing (speaker name, line of dialog)
         """
         speaker = speaker.upper() if speaker else None
-        if self.dialog_count(speaker) == 0:
+        dialog_ids = self._dialog_ids(speaker)
+        if len(dialog_ids) == 0:
             raise NoDialogFoundException(speaker)
 
-        logger.debug('choosing random from count %s', self.dialog_count)
-        offset = random.randrange(self.dialog_count(speaker))
-        if speaker is None:
-            speaker, line = self._conn.execute(self.SQL_GET_RANDOM,
-                                               (offset,)).fetchone()
-        else:
-            speaker, line = self._conn.execute(self.SQL_GET_RANDOM_BY_SPEAKER,
-                                               (speaker, offset)).fetchone()
-        return speaker, line
+        logger.debug('choosing random from count %s', len(dialog_ids))
+        dialog_id = self._pool.random.choice(dialog_ids)
+        return self._conn.execute(self.SQL_GET_BY_ID, (dialog_id,)).fetchone()
+
+    def _dialog_ids(self, speaker=None):
+        """
+        Get sequence of all dialog_ids, optionally limited to specific speaker.
+
+        If the lines occupy a contiguous run of dialog_ids (as written by the sqlite
+        writer), this is a range; otherwise the ids are read once and cached.
+        """
+        count, first_id, last_id = self.dialog_range(speaker)
+        if count == 0:
+            return ()
+        if last_id - first_id + 1 == count:
+            return range(first_id, last_id + 1)
+        if speaker not in self._sparse_ids:
+            if speaker is None:
+                result = self._conn.execute(self.SQL_GET_IDS)
+            else:
+                result = self._conn.execute(self.SQL_GET_IDS_BY_SPEAKER, (speaker,))
+            self._sparse_ids[speaker] = [row[0] for row in result]
+        return self._sparse_ids[speaker]
+
+    def random_dialogs(self, count, speaker=None, distinct=False):
+        """
+        Get several random lines of dialog, optionally limited to specific speaker.
+
+        All dialog_ids are drawn up front and fetched together with as few queries as
+        the sqlite variable limit allows. If distinct is True, no line is repeated, and
+        fewer than count lines are returned if the speaker does not have enough.
 
-    def random_speaker(self, not_speaker=None):
+        Returns:
+            list of tuples containing (speaker name, line of dialog)
+        """
+        speaker = speaker.upper() if speaker else None
+        dialog_ids = self._dialog_ids(speaker)
+        if len(dialog_ids) == 0:
+            raise NoDialogFoundException(speaker)
+
+        rng = self._pool.random
+        if distinct:
+            chosen_ids = rng.sample(dialog_ids, min(count, len(dialog_ids)))
+        else:
+            chosen_ids = [rng.choice(dialog_ids) for __ in range(count)]
+
+        found = {}
+        unique_ids = list(set(chosen_ids))
+        for start in range(0, len(unique_ids), self.MAX_SQL_VARIABLES):
+            chunk = unique_ids[start:start + self.MAX_SQL_VARIABLES]
+            query = self.SQL_GET_BY_IDS.format(','.join('?' * len(chunk)))
+            for dialog_id, found_speaker, line in self._conn.execute(query, chunk):
+                found[dialog_id] = (found_speaker, line)
+        return [found[dialog_id] for dialog_id in chosen_ids]
+
+    def random_speaker(self, not_speaker=None, weighted=False):
         """
         Get random speaker name, optionally excluding specific speaker from candidacy.
+
+        Speakers are drawn uniformly unless weighted is True, in which case each speaker is
+        drawn in proportion to their count of lines.
         """
-        if not_speaker is None:
-            return self._conn.execute(self.SQL_GET_RANDOM_SPEAKER).fetchone()[0]
+        excluded = self._speaker_indexes.get(not_speaker.upper()) if not_speaker else None
+        candidate_count = len(self._speakers) - (0 if excluded is None else 1)
+        if candidate_count < 1:
+            raise NoDialogFoundException()
+
+        rng = self._pool.random
+        if weighted:
+            index = self._speaker_aliases.sample(rng)
+            while index == excluded:
+                index = self._speaker_aliases.sample(rng)
         else:
-            return self._conn.execute(self.SQL_GET_RANDOM_SPEAKER_EXCLUDING,
-                                      (not_speaker.upper(),)).fetchone()[0]
+            index = rng.randrange(candidate_count)
+            if excluded is not None and index >= excluded:
+                index += 1
+        return self._speakers[index]
 
     def all_dialog(self, speaker=None):
         """
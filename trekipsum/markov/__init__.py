@@ -1,14 +1,68 @@
-import copy
+import bisect
+import contextlib
+import itertools
 import random
 import sqlite3
-from collections import defaultdict
+import sys
+import threading
+from array import array
+from collections import OrderedDict, defaultdict, namedtuple
 
 import six
+from six.moves import range
 
+from ..dialog.connections import OPEN_MODE_READ_ONLY, OPEN_MODE_READ_WRITE, ConnectionPool
 from ..dialog.sqlite import DEFAULT_SQLITE_PATH
 from ..exceptions import NoDialogFoundException
+from ..metrics import LatencyHistogram
 
 SENTENCE_DELIMITER = ''  # special value for beginning/ending a sentence
+SENTENCE_DELIMITER_ID = 0  # SENTENCE_DELIMITER's id in every Vocabulary
+DEFAULT_WALKER_CACHE_SIZE = 64 * 1024 * 1024  # approximate bytes
+COMPILED_WEIGHT_SIZE = array('d').itemsize
+MARKOV_LAYOUT_EDGES = 'edges'  # one markov row per link
+MARKOV_LAYOUT_ADJACENCY = 'adjacency'  # plus one packed markov_adjacency row per word
+MARKOV_LAYOUTS = (MARKOV_LAYOUT_EDGES, MARKOV_LAYOUT_ADJACENCY)
+WORD_ID_BITS = 21  # bits per word in a packed n-gram key
+MAX_ORDER = 3  # so packed n-gram keys fit in sqlite's signed 64-bit integers
+NGRAM_KEY_BASE = 1 << WORD_ID_BITS  # keys of two or more words are never less than this
+DEFAULT_MAX_WORDS = 40  # per sentence, before walkers start looking for an ending
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'evictions', 'count', 'size', 'max_size'))
+
+
+def pack_ngram(word_ids):
+    """
+    Pack a sequence of up to MAX_ORDER word ids into a single integer key.
+
+    A single id is its own key, so order-1 chains are keyed by plain word ids. Longer
+    sequences store each id plus one in WORD_ID_BITS bits, oldest first, which limits
+    n-gram vocabularies to NGRAM_KEY_BASE - 1 words.
+    """
+    if len(word_ids) == 1:
+        return word_ids[0]
+    key = 0
+    for word_id in word_ids:
+        key = (key << WORD_ID_BITS) | (word_id + 1)
+    return key
+
+
+def check_ngram_vocabulary(vocabulary, order):
+    """Raise ValueError if the vocabulary has outgrown the word ids pack_ngram can hold."""
+    if order > 1 and len(vocabulary) >= NGRAM_KEY_BASE:
+        raise ValueError('chains of order {} allow at most {} words, not {}'.format(
+            order, NGRAM_KEY_BASE - 1, len(vocabulary)))
+
+
+def unpack_ngram(key):
+    """Get the tuple of word ids packed into the key by pack_ngram."""
+    if key < NGRAM_KEY_BASE:
+        return (key,)
+    word_ids = []
+    while key:
+        word_ids.append((key & (NGRAM_KEY_BASE - 1)) - 1)
+        key >>= WORD_ID_BITS
+    return tuple(reversed(word_ids))
 
 
 class WordChainBuilder(object):
@@ -30,6 +84,21 @@ class WordChainBuilder(object):
             self.add_link(self.__last_leader, follower)
         self.__last_leader = follower
 
+    def iter_normalized(self):
+        """
+        Lazily normalize the chain for use in probabilistic walking.
+
+        Each leader's follower counts are converted as they are yielded, straight from the
+        count table and without copying it, so the builder must not change meanwhile.
+
+        Returns:
+            generator of tuples like ('a', [('a', 0.1), ('b', 0.2), ('c', 0.7)])
+        """
+        for leader, followers in six.iteritems(self._chain):
+            total = float(sum(six.itervalues(followers)))
+            yield leader, [(follower, count / total)
+                           for follower, count in six.iteritems(followers)]
+
     def normalize(self):
         """
         Normalize the chain for use in probabilistic walking.
@@ -37,15 +106,7 @@ class WordChainBuilder(object):
         Returns:
             dict(list(tuple)) like {'a': [('a', 0.1), ('b', 0.2), ('c', 0.7)]}
         """
-        chain = copy.deepcopy(self._chain)
-        for leader, followers in chain.items():
-            total = sum(followers.values())
-            normalized_followers = list()
-            for follower in followers.keys():
-                norm_value = 1.0 * chain[leader][follower] / total
-                normalized_followers.append((follower, norm_value))
-            chain[leader] = normalized_followers
-        return chain
+        return dict(self.iter_normalized())
 
 
 class SentenceChainBuilder(WordChainBuilder):
@@ -68,28 +129,125 @@ class SentenceChainBuilder(WordChainBuilder):
             self.add_link(last_word, delimiter)
 
 
+class NgramChainBuilder(WordChainBuilder):
+    """
+    Markov chain builder for sentences, following contexts of up to order preceding words.
+
+    Words are interned in the vocabulary and each context is packed into an integer key
+    with pack_ngram, so no tuples are kept. Links are added for every context length from
+    1 to order, letting walkers back off to shorter contexts.
+    """
+
+    def __init__(self, vocabulary, order=1):
+        """Initialize a new empty builder interning words in the vocabulary."""
+        super(NgramChainBuilder, self).__init__()
+        if not 1 <= order <= MAX_ORDER:
+            raise ValueError('order must be between 1 and {}'.format(MAX_ORDER))
+        self.vocabulary = vocabulary
+        self.order = order
+
+    def add_sentence(self, word_ids):
+        """Add the sentence's word ids to the chain, between sentence delimiters."""
+        check_ngram_vocabulary(self.vocabulary, self.order)
+        history = [SENTENCE_DELIMITER_ID]
+        for word_id in itertools.chain(word_ids, (SENTENCE_DELIMITER_ID,)):
+            for length in range(1, min(len(history), self.order) + 1):
+                self.add_link(pack_ngram(history[-length:]), word_id)
+            history.append(word_id)
+
+    def process_string(self, input_string):
+        """Process the given string to add to the chain."""
+        intern = self.vocabulary.intern
+        sentence = []
+        for word in input_string.split():
+            sentence.append(intern(word))
+            if word[-1] in ('.', '!', '?') and len(word.strip('.')) > 0:
+                # specially handle word ending with period as end of sentence
+                self.add_sentence(sentence)
+                sentence = []
+
+        if sentence:
+            # ensure last word is end of sentence if not already
+            self.add_sentence(sentence)
+
+
 class ChainWalker(object):
-    """Markov chain walker."""
+    """
+    Markov chain walker.
+
+    Each word's followers are compiled on first use into a list of words and an array of
+    cumulative weights, so choosing the next word is a binary search rather than a scan.
+
+    If a vocabulary is given, the chain holds word ids rather than words, and sentences are
+    decoded through the vocabulary only as they are built. Id chains may have an order
+    above 1, keyed by pack_ngram as NgramChainBuilder builds them.
+    """
+
+    grows = False  # whether approximate_size may increase as sentences are built
 
-    def __init__(self, chain):
+    def __init__(self, chain, vocabulary=None, order=1):
         """Initialize a new walker with the given chain."""
         self._chain = chain
+        self._vocabulary = vocabulary
+        self._words = None
+        self._compiled = {}
+        self.order = order
+
+    def _compile(self, word):
+        """Get the word's followers and their cumulative weights, compiling if needed."""
+        compiled = self._compiled.get(word)
+        if compiled is None:
+            followers = []
+            cumulative_weights = array('d')
+            total = 0.0
+            for next_word, probability in self._chain[word]:
+                total += probability
+                followers.append(next_word)
+                cumulative_weights.append(total)
+            compiled = self._compiled[word] = (followers, cumulative_weights)
+        return compiled
+
+    def _followers(self, key):
+        """Get the compiled followers of the key, or None if it is not in the chain."""
+        if key not in self._chain:
+            return None
+        return self._compile(key)
+
+    def _start_words(self):
+        """Get the list of words to choose from when no word precedes."""
+        if self._words is None:
+            if self.order > 1:
+                self._words = [key for key in self._chain.keys() if key < NGRAM_KEY_BASE]
+            else:
+                self._words = list(self._chain.keys())
+        return self._words
 
     def next_word(self, from_word=None):
         """Generate the next word from the markov chain."""
         if from_word is None:
-            word = random.choice(list(self._chain.keys()))
-        else:
-            if from_word not in self._chain:
-                raise KeyError(from_word)
-            target = random.random()
-            total = 0.0
-            for next_word, probability in self._chain[from_word]:
-                word = next_word
-                total += probability
-                if total >= target:
-                    break
-        return word
+            return random.choice(self._start_words())
+
+        compiled = self._followers(from_word)
+        if compiled is None:
+            raise KeyError(from_word)
+        return _choose(compiled)
+
+    def _context_followers(self, history):
+        """Get the compiled followers of the longest context ending the history."""
+        for length in range(min(len(history), self.order), 0, -1):
+            compiled = self._followers(pack_ngram(history[-length:]))
+            if compiled is not None:
+                return compiled
+        raise KeyError(history[-1])
+
+    def next_word_after(self, history):
+        """
+        Generate the next word id following the list of preceding word ids.
+
+        The longest context of up to order preceding words found in the chain is used,
+        backing off to shorter contexts.
+        """
+        return _choose(self._context_followers(history))
 
     def generate_words(self, from_word=None, stop_word=None):
         """
@@ -103,83 +261,619 @@ class ChainWalker(object):
             generator that produces words
         """
         word = self.next_word(from_word=from_word)
+        history = [] if from_word is None else [from_word]
         while word != stop_word:
             yield word
-            word = self.next_word(from_word=word)
+            if self.order == 1:
+                word = self.next_word(from_word=word)
+            else:
+                history.append(word)
+                del history[:-self.order]
+                word = self.next_word_after(history)
 
-    def build_sentence(self):
+    def build_sentence(self, max_words=DEFAULT_MAX_WORDS, max_chars=None):
         """
         Build a complete sentence from the chain.
 
+        Once the sentence reaches max_words words or max_chars characters, it ends at the
+        first word that can end a sentence. If it reaches twice either limit first, it is
+        cut off there, so the time to build a sentence is bounded even for chains with
+        unlikely endings. Pass None to lift a limit.
+
         Note: this assumes the chain was built with SENTENCE_DELIMITER in mind.
         """
-        words = self.generate_words(SENTENCE_DELIMITER, SENTENCE_DELIMITER)
+        if self._vocabulary is None:
+            delimiter, decode = SENTENCE_DELIMITER, None
+        else:
+            delimiter, decode = SENTENCE_DELIMITER_ID, self._vocabulary.word
+        words = []
+        chars = -1  # counting a space before each word but the first
+        history = [delimiter]
+        word = self.next_word(delimiter)
+        while word != delimiter:
+            words.append(decode(word) if decode else word)
+            chars += len(words[-1]) + 1
+            history.append(word)
+            del history[:-self.order]
+            if _reached(len(words), max_words, 2) or _reached(chars, max_chars, 2):
+                break
+            compiled = self._context_followers(history)
+            if _reached(len(words), max_words) or _reached(chars, max_chars):
+                if delimiter in compiled[0]:
+                    break
+            word = _choose(compiled)
         return '{}{}'.format(' '.join(words), SENTENCE_DELIMITER)
 
+    def build_sentences(self, count, max_words=DEFAULT_MAX_WORDS, max_chars=None,
+                        random_state=None):
+        """
+        Build several complete sentences from the chain, one at a time.
+
+        random_state is ignored, accepted only so calls match VectorizedChainWalker;
+        words are drawn with the random module.
+        """
+        return [self.build_sentence(max_words, max_chars) for __ in range(count)]
+
+    def approximate_size(self):
+        """Estimate the memory in bytes held by this walker once its chain is compiled."""
+        size = sys.getsizeof(self._chain) + sys.getsizeof(self._compiled)
+        for word, followers in six.iteritems(self._chain):
+            size += sys.getsizeof(word) + sys.getsizeof(followers)
+            size += sum(sys.getsizeof(follower) for follower in followers)
+            # compiled list of followers plus array of cumulative weights
+            size += 2 * sys.getsizeof(followers) + COMPILED_WEIGHT_SIZE * len(followers)
+        return size
+
+
+def _choose(compiled):
+    """Choose a follower at random from a word's compiled followers and weights."""
+    followers, cumulative_weights = compiled
+    # the last weight may fall just short of 1.0 from rounding; it takes the remainder
+    index = bisect.bisect_left(cumulative_weights, random.random())
+    return followers[min(index, len(followers) - 1)]
+
+
+def _reached(value, limit, factor=1):
+    """See if the value has reached factor times the limit, if there is one."""
+    return limit is not None and value >= limit * factor
+
+
+class LazyChainWalker(ChainWalker):
+    """
+    Markov chain walker reading one word's followers at a time from the adjacency table.
+
+    Nothing is read until a word is reached, so building a sentence touches only the
+    rows for the words in it. Requires a datastore written with MARKOV_LAYOUT_ADJACENCY.
+    Rows read are kept in least-recently-used order, and the oldest are dropped once they
+    take more than max_size bytes. Since the walker grows as words are reached, a
+    WalkerCache measures it again whenever it is fetched.
+    """
+
+    grows = True
+
+    def __init__(self, datastore, context, max_size=DEFAULT_WALKER_CACHE_SIZE):
+        """Initialize a new walker over the context's chain in the datastore."""
+        super(LazyChainWalker, self).__init__(None, datastore.vocabulary,
+                                              datastore.get_order(context))
+        self._datastore = datastore
+        self._context = context
+        self._compiled = OrderedDict()
+        self._compiled_size = 0
+        self._lock = threading.Lock()
+        self.max_size = max_size
+
+    def _followers(self, key):
+        with self._lock:
+            compiled = self._compiled.pop(key, None)
+            if compiled is not None:
+                self._compiled[key] = compiled
+                return compiled or None
+        # remember missing keys too, since backing off may look them up repeatedly
+        compiled = self._datastore.get_adjacency(self._context, key) or ()
+        with self._lock:
+            if key not in self._compiled:
+                self._compiled[key] = compiled
+                self._compiled_size += _compiled_size(compiled)
+            while self.approximate_size() > self.max_size and len(self._compiled) > 1:
+                __, evicted = self._compiled.popitem(last=False)
+                self._compiled_size -= _compiled_size(evicted)
+        return compiled or None
+
+    def _start_words(self):
+        if self._words is None:
+            self._words = self._datastore.get_adjacency_word_ids(self._context)
+        return self._words
+
+    def approximate_size(self):
+        """Estimate the memory in bytes held by the words loaded so far."""
+        return sys.getsizeof(self._compiled) + self._compiled_size
+
+
+def _compiled_size(compiled):
+    """Estimate the bytes held by one word's compiled followers and weights."""
+    return sys.getsizeof(compiled) + sum(sys.getsizeof(values) for values in compiled)
+
+
+class WalkerCache(object):
+    """
+    Least-recently-used cache of chain walkers keyed by context.
+
+    Walkers are evicted once their combined approximate size exceeds max_size, although
+    the most recently used walker is always kept. Walkers that grow as they are used are
+    measured again each time they are fetched. The cache is safe to share across
+    threads; two threads missing on the same context may both load it.
+    """
+
+    def __init__(self, loader, max_size=DEFAULT_WALKER_CACHE_SIZE):
+        """Initialize a new empty cache that builds walkers with loader(context)."""
+        self._loader = loader
+        self._walkers = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, context):
+        """Get the walker for the context, loading it if not already cached."""
+        with self._lock:
+            if context in self._walkers:
+                self.hits += 1
+                walker, size = self._walkers.pop(context)
+                if walker.grows:
+                    self.size -= size
+                    size = walker.approximate_size()
+                    self.size += size
+                self._walkers[context] = (walker, size)
+                self._evict()
+                return walker
+
+        walker = self._loader(context)
+        size = walker.approximate_size()
+        with self._lock:
+            self.misses += 1
+            if context in self._walkers:
+                self.size -= self._walkers.pop(context)[1]
+            self._walkers[context] = (walker, size)
+            self.size += size
+            self._evict()
+        return walker
+
+    def _evict(self):
+        """Evict least recently used walkers until within max_size, keeping the newest."""
+        while self.size > self.max_size and len(self._walkers) > 1:
+            __, (__, evicted_size) = self._walkers.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def info(self):
+        """Get a snapshot of the cache's counters."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, len(self._walkers),
+                             self.size, self.max_size)
+
+
+def _pack_array(values):
+    """Get the array's machine values as bytes for storing in a BLOB."""
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+
+def _unpack_array(typecode, blob):
+    """Get an array of the typecode from bytes packed by _pack_array."""
+    values = array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(bytes(blob))
+    else:
+        values.fromstring(bytes(blob))
+    return values
+
+
+def _counted_rows(context_id, key, followers):
+    """Get markov rows for the key's (next_word_id, count) followers, heaviest first."""
+    followers = sorted(followers, key=lambda follower: follower[1], reverse=True)
+    total = float(sum(count for __, count in followers))
+    return [(context_id, key, next_word_id, count / total, count)
+            for next_word_id, count in followers]
+
+
+def _adjacency_row(context_id, word_id, links):
+    """Get a markov_adjacency row packing the word's (next_word_id, weight) links."""
+    next_word_ids = array('I')
+    cumulative_weights = array('f')
+    total = 0.0
+    for next_word_id, weight in links:
+        total += weight
+        next_word_ids.append(next_word_id)
+        cumulative_weights.append(total)
+    return context_id, word_id, _pack_array(next_word_ids), _pack_array(cumulative_weights)
+
+
+class Vocabulary(object):
+    """
+    Two-way mapping between words and dense integer ids.
+
+    SENTENCE_DELIMITER always has id SENTENCE_DELIMITER_ID, so chains of ids can mark
+    sentence boundaries without knowing the vocabulary.
+    """
+
+    def __init__(self, words=(SENTENCE_DELIMITER,)):
+        """Initialize with words in id order."""
+        self._words = list(words)
+        self._ids = dict((word, word_id) for word_id, word in enumerate(self._words))
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._ids
+
+    @property
+    def words(self):
+        """Get list of all words indexed by their ids."""
+        return self._words
+
+    def intern(self, word):
+        """Get the word's id, assigning the next id if the word is new."""
+        word_id = self._ids.get(word)
+        if word_id is None:
+            word_id = self._ids[word] = len(self._words)
+            self._words.append(word)
+        return word_id
+
+    def word_id(self, word):
+        """Get the id of a known word."""
+        return self._ids[word]
+
+    def word(self, word_id):
+        """Get the word for a known id."""
+        return self._words[word_id]
+
 
 class DialogChainDatastore(object):
     """
     Datastore accessor for markov chains.
+
+    Words and contexts are interned in the vocabulary and contexts tables, so the markov
+    table itself holds only integers. Chains stored from raw counts keep them alongside
+    the weights, so new counts can later be merged in without rebuilding; see
+    merge_counts. Stores written with MARKOV_LAYOUT_ADJACENCY also pack each word's
+    followers into a single markov_adjacency row; see build_adjacency.
+
+    One datastore may be shared across threads for reading; each thread uses its own
+    connection. Writes and the commit on exit apply to the calling thread's connection.
+    Open modes other than the default rw are read-only; see ConnectionPool.
     """
 
-    SQL_DROP = 'DROP TABLE IF EXISTS markov'
-    SQL_CREATE = 'CREATE TABLE IF NOT EXISTS markov (' \
-                 '  context VARCHAR,' \
-                 '  word VARCHAR,' \
-                 '  next_word VARCHAR,' \
-                 '  weight REAL' \
-                 ')'
-    SQL_INDEX1 = 'CREATE INDEX markov_context_idx ON markov(context)'
-    SQL_INDEX2 = 'CREATE INDEX markov_context_word_idx ON markov(context, word)'
-    SQL_INSERT = 'INSERT INTO markov (context, word, next_word, weight) VALUES (?,?,?,?)'
-    SQL_SELECT_ALL_CONTEXTS = 'SELECT DISTINCT context FROM markov ' \
+    SQL_DROP_ADJACENCY = 'DROP TABLE IF EXISTS markov_adjacency'
+    SQL_DROP = (
+        SQL_DROP_ADJACENCY,
+        'DROP TABLE IF EXISTS markov',
+        'DROP TABLE IF EXISTS vocabulary',
+        'DROP TABLE IF EXISTS contexts',
+    )
+    SQL_CREATE = (
+        'CREATE TABLE IF NOT EXISTS vocabulary ('
+        '  word_id INTEGER PRIMARY KEY,'
+        '  word VARCHAR UNIQUE'
+        ')',
+        'CREATE TABLE IF NOT EXISTS contexts ('
+        '  context_id INTEGER PRIMARY KEY,'
+        '  context VARCHAR UNIQUE,'
+        '  chain_order INTEGER DEFAULT 1'
+        ')',
+        'CREATE TABLE IF NOT EXISTS markov ('
+        '  context_id INTEGER,'
+        '  word_id INTEGER,'
+        '  next_word_id INTEGER,'
+        '  weight REAL,'
+        '  count INTEGER'
+        ')',
+    )
+    # covers every read query, so lookups never touch the table itself
+    SQL_INDEX = 'CREATE INDEX markov_context_word_idx ' \
+                'ON markov(context_id, word_id, weight DESC, next_word_id)'
+    SQL_CREATE_ADJACENCY = 'CREATE TABLE markov_adjacency (' \
+                           '  context_id INTEGER,' \
+                           '  word_id INTEGER,' \
+                           '  next_word_ids BLOB,' \
+                           '  cumulative_weights BLOB,' \
+                           '  PRIMARY KEY (context_id, word_id)' \
+                           ')'
+    SQL_INSERT_ADJACENCY = 'INSERT INTO markov_adjacency ' \
+                           '(context_id, word_id, next_word_ids, cumulative_weights) ' \
+                           'VALUES (?,?,?,?)'
+    SQL_SELECT_ADJACENCY = 'SELECT next_word_ids, cumulative_weights FROM markov_adjacency ' \
+                           'WHERE context_id=? AND word_id=?'
+    SQL_SELECT_ADJACENCY_WORDS = 'SELECT word_id FROM markov_adjacency ' \
+                                 'WHERE context_id=? AND word_id<?'
+    SQL_SELECT_ADJACENCY_EXISTS = 'SELECT EXISTS(' \
+                                  'SELECT 1 FROM sqlite_master ' \
+                                  'WHERE type=? AND name=?)'
+    SQL_SELECT_ALL_BY_CONTEXT_AND_WORD = 'SELECT context_id, word_id, next_word_id, weight ' \
+                                         'FROM markov ' \
+                                         'ORDER BY context_id, word_id, weight DESC'
+    SQL_INSERT = 'INSERT INTO markov (context_id, word_id, next_word_id, weight) ' \
+                 'VALUES (?,?,?,?)'
+    SQL_INSERT_COUNTED = 'INSERT INTO markov (context_id, word_id, next_word_id, weight, count) ' \
+                         'VALUES (?,?,?,?,?)'
+    SQL_SELECT_COUNTS = 'SELECT next_word_id, count FROM markov WHERE context_id=? AND word_id=?'
+    SQL_DELETE_GROUP = 'DELETE FROM markov WHERE context_id=? AND word_id=?'
+    SQL_DELETE_ADJACENCY = 'DELETE FROM markov_adjacency WHERE context_id=? AND word_id=?'
+    SQL_INSERT_WORD = 'INSERT INTO vocabulary (word_id, word) VALUES (?,?)'
+    SQL_INSERT_CONTEXT = 'INSERT INTO contexts (context_id, context, chain_order) ' \
+                         'VALUES (?,?,?)'
+    SQL_SELECT_ORDER = 'SELECT chain_order FROM contexts WHERE context=?'
+    SQL_SELECT_VOCABULARY = 'SELECT word FROM vocabulary ORDER BY word_id ASC'
+    SQL_SELECT_CONTEXT_IDS = 'SELECT context, context_id FROM contexts'
+    SQL_SELECT_ALL_CONTEXTS = 'SELECT context FROM contexts ' \
+                              'WHERE EXISTS(SELECT 1 FROM markov ' \
+                              '             WHERE markov.context_id = contexts.context_id) ' \
                               'ORDER BY context ASC'
-    SQL_SELECT_WORDS_BY_CONTEXT = 'SELECT DISTINCT word FROM markov WHERE context=? ' \
-                                  'ORDER BY word ASC'
+    SQL_SELECT_WORDS_BY_CONTEXT = 'SELECT DISTINCT word_id FROM markov ' \
+                                  'WHERE context_id=? AND word_id<?'
     SQL_SELECT_WORD_EXISTS = 'SELECT EXISTS(' \
-                             'SELECT 1 FROM markov WHERE context=? AND word=? ' \
+                             'SELECT 1 FROM markov WHERE context_id=? AND word_id=? ' \
                              'LIMIT 1)'
-    SQL_SELECT_BY_CONTEXT_AND_WORD = 'SELECT next_word, weight ' \
-                                     'FROM markov WHERE context=? AND word=? ' \
-                                     'ORDER BY weight DESC, next_word ASC'
-    SQL_SELECT_BY_CONTEXT = 'SELECT word, next_word, weight ' \
-                            'FROM markov WHERE context=? ' \
-                            'ORDER BY weight DESC, next_word ASC'
-
-    def __init__(self, file_path=None):
+    SQL_SELECT_BY_CONTEXT_AND_WORD = 'SELECT next_word_id, weight ' \
+                                     'FROM markov WHERE context_id=? AND word_id=? ' \
+                                     'ORDER BY weight DESC'
+    SQL_SELECT_BY_CONTEXT = 'SELECT word_id, next_word_id, weight ' \
+                            'FROM markov WHERE context_id=? ' \
+                            'ORDER BY word_id, weight DESC'
+
+    def __init__(self, file_path=None, open_mode=OPEN_MODE_READ_WRITE):
         """Initialize a new dialog chain datastore accessor."""
         self._sqlite_path = file_path or DEFAULT_SQLITE_PATH
-        self._conn = sqlite3.connect(self._sqlite_path)
+        self._pool = ConnectionPool(self._sqlite_path, open_mode)
+        self._vocabulary = None
+        self._stored_word_count = 0
+        self._context_ids = None
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args):
         self._conn.commit()
-        self._conn.close()
+        self.close()
+
+    @property
+    def _conn(self):
+        return self._pool.connection
+
+    def close(self):
+        """Close all threads' connections to the database."""
+        self._pool.close()
 
-    def __del__(self, *args):
-        self._conn.close()
+    @property
+    def vocabulary(self):
+        """Lazy-load and return the Vocabulary shared by all contexts."""
+        if self._vocabulary is None:
+            try:
+                words = [row[0] for row in self._conn.execute(self.SQL_SELECT_VOCABULARY)]
+            except sqlite3.OperationalError:
+                words = []
+            vocabulary = Vocabulary(words) if words else Vocabulary()
+            self._stored_word_count = len(words)
+            self._vocabulary = vocabulary
+        return self._vocabulary
 
-    def reinitialize(self):
-        """Reinitialize the database tables."""
-        self._conn.execute(self.SQL_DROP)
-        self._conn.execute(self.SQL_CREATE)
+    def _load_context_ids(self):
+        if self._context_ids is None:
+            try:
+                self._context_ids = dict(self._conn.execute(self.SQL_SELECT_CONTEXT_IDS))
+            except sqlite3.OperationalError:
+                self._context_ids = {}
+        return self._context_ids
+
+    def _context_id(self, context, create=False, order=1):
+        """Get the context's id, optionally storing the context if it is new."""
+        context_ids = self._load_context_ids()
+        if context not in context_ids and create:
+            context_ids[context] = len(context_ids)
+            self._conn.execute(self.SQL_INSERT_CONTEXT, (context_ids[context], context, order))
+        return context_ids.get(context)
+
+    def _store_new_words(self):
+        """Store words interned since the vocabulary was last stored."""
+        words = self.vocabulary.words
+        if len(words) > self._stored_word_count:
+            self._conn.executemany(self.SQL_INSERT_WORD, (
+                (word_id, words[word_id])
+                for word_id in range(self._stored_word_count, len(words))
+            ))
+            self._stored_word_count = len(words)
+
+    def reinitialize(self, vocabulary=None):
+        """Reinitialize the database tables, optionally starting from a built vocabulary."""
+        for sql in self.SQL_DROP:
+            self._conn.execute(sql)
+        for sql in self.SQL_CREATE:
+            self._conn.execute(sql)
+        self._vocabulary = vocabulary or Vocabulary()
+        self._stored_word_count = 0
+        self._context_ids = {}
+        self._store_new_words()
 
     def index(self):
         """Create DB indexes for (hopefully) faster lookup."""
-        self._conn.execute(self.SQL_INDEX1)
-        self._conn.execute(self.SQL_INDEX2)
+        self._conn.execute(self.SQL_INDEX)
+
+    @contextlib.contextmanager
+    def bulk_load(self):
+        """
+        Context manager for quickly storing many chains in a single transaction.
+
+        The rollback journal is kept in memory and syncing is turned off until the context
+        exits, so the database may be corrupted if the process dies mid-load; only use this
+        while building from scratch. The transaction commits on success and rolls back on
+        error, even once it has spilled past the page cache. It includes tables dropped and
+        created within it, as by reinitialize, index and build_adjacency.
+        """
+        conn = self._conn
+        conn.commit()  # pragmas cannot change journal mode inside a transaction
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        synchronous = conn.execute('PRAGMA synchronous').fetchone()[0]
+        conn.execute('PRAGMA journal_mode=MEMORY')
+        conn.execute('PRAGMA synchronous=OFF')
+        # begin and commit explicitly; otherwise sqlite3 runs DROP and CREATE statements
+        # outside the transaction, or on Python 2 commits before them
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None
+        conn.execute('BEGIN')
+        loaded = False
+        try:
+            yield self
+            conn.execute('COMMIT')
+            loaded = True
+        finally:
+            if not loaded:
+                conn.execute('ROLLBACK')
+                # interned words and contexts may have been rolled back with the transaction
+                self._vocabulary = self._context_ids = None
+            conn.isolation_level = isolation_level
+            conn.execute('PRAGMA journal_mode={}'.format(journal_mode))
+            conn.execute('PRAGMA synchronous={:d}'.format(synchronous))
 
     def insert(self, context, word, next_word, weight):
         """Insert a link to the markov chain."""
-        self._conn.execute(self.SQL_INSERT, (context, word, next_word, weight))
+        self.store_chain(context, ((word, ((next_word, weight),)),))
 
     def store_chain(self, context, chain):
-        """Store all elements of the chain for the context."""
-        for word, next_words in six.iteritems(chain):
-            for next_word, weight in next_words:
-                self.insert(context, word, next_word, weight)
+        """
+        Store all elements of the chain for the context.
+
+        The chain may be a dict like normalize returns or an iterable of (word, next_words)
+        pairs like iter_normalized yields.
+        """
+        context_id = self._context_id(context, create=True)
+        intern = self.vocabulary.intern
+        links = six.iteritems(chain) if hasattr(chain, 'items') else chain
+        self._conn.executemany(self.SQL_INSERT, (
+            (context_id, word_id, intern(next_word), weight)
+            for word, next_words in links
+            for word_id in (intern(word),)
+            for next_word, weight in next_words
+        ))
+        self._store_new_words()
+
+    def build_adjacency(self):
+        """
+        Rebuild the markov_adjacency table from the stored chains.
+
+        Each (context, word) row holds the word's follower ids as a packed array('I') and
+        their running total of weights as a packed array('f'), ready for bisecting.
+        """
+        self._conn.execute(self.SQL_DROP_ADJACENCY)
+        self._conn.execute(self.SQL_CREATE_ADJACENCY)
+        edges = self._conn.execute(self.SQL_SELECT_ALL_BY_CONTEXT_AND_WORD)
+        self._conn.executemany(self.SQL_INSERT_ADJACENCY, (
+            _adjacency_row(context_id, word_id,
+                           ((next_word_id, weight) for __, __, next_word_id, weight in links))
+            for (context_id, word_id), links in itertools.groupby(edges, key=lambda e: e[:2])
+        ))
+
+    def has_adjacency(self):
+        """See if the markov_adjacency table has been built."""
+        result = self._conn.execute(self.SQL_SELECT_ADJACENCY_EXISTS,
+                                    ('table', 'markov_adjacency'))
+        return result.fetchone()[0] == 1
+
+    def get_adjacency(self, context, word_id):
+        """
+        Get the word's followers from the markov_adjacency table.
+
+        Returns:
+            tuple containing (array of follower ids, array of cumulative weights), or None
+            if the context has no such word
+        """
+        context_id = self._context_id(context)
+        row = self._conn.execute(self.SQL_SELECT_ADJACENCY, (context_id, word_id)).fetchone()
+        if row is None:
+            return None
+        return _unpack_array('I', row[0]), _unpack_array('f', row[1])
+
+    def get_adjacency_word_ids(self, context):
+        """Get a list of ids of all words with followers in the markov_adjacency table."""
+        context_id = self._context_id(context)
+        result = self._conn.execute(self.SQL_SELECT_ADJACENCY_WORDS,
+                                    (context_id, NGRAM_KEY_BASE))
+        return [row[0] for row in result]
+
+    def store_id_counts(self, context, counts, order=1):
+        """
+        Store a chain of word ids for the context from raw counts of its links.
+
+        The counts are an iterable of (key, followers) pairs like bulk.iter_id_counts
+        yields, where followers is a list of (next_word_id, count) tuples. Keys and words
+        follow the same rules as for store_id_chain.
+        """
+        context_id = self._context_id(context, create=True, order=order)
+        self._conn.executemany(self.SQL_INSERT_COUNTED, (
+            row for key, followers in counts for row in _counted_rows(context_id, key, followers)
+        ))
+        check_ngram_vocabulary(self.vocabulary, order)
+        self._store_new_words()
+
+    def merge_counts(self, context, counts, order=1):
+        """
+        Add raw counts of new links to the context's stored counts.
+
+        Only the (context, key) groups in counts are read, renormalized, and rewritten,
+        along with their markov_adjacency rows if that table has been built, so the cost
+        follows the size of the new counts rather than of the whole chain. The counts are
+        like those for store_id_counts, and the context must have been stored from counts
+        of the same order, if at all.
+        """
+        context_id = self._context_id(context)
+        if context_id is not None and self.get_order(context) != order:
+            raise ValueError('cannot merge order {} counts into order {} context {}'.format(
+                order, self.get_order(context), context))
+        context_id = self._context_id(context, create=True, order=order)
+        has_adjacency = self.has_adjacency()
+        for key, followers in counts:
+            merged = defaultdict(int)
+            for next_word_id, count in self._conn.execute(self.SQL_SELECT_COUNTS,
+                                                          (context_id, key)):
+                if count is None:
+                    raise ValueError('context {} was not stored with counts'.format(context))
+                merged[next_word_id] = count
+            for next_word_id, count in followers:
+                merged[next_word_id] += count
+            rows = _counted_rows(context_id, key, six.iteritems(merged))
+            self._conn.execute(self.SQL_DELETE_GROUP, (context_id, key))
+            self._conn.executemany(self.SQL_INSERT_COUNTED, rows)
+            if has_adjacency:
+                self._conn.execute(self.SQL_DELETE_ADJACENCY, (context_id, key))
+                self._conn.execute(self.SQL_INSERT_ADJACENCY, _adjacency_row(
+                    context_id, key, ((row[2], row[3]) for row in rows)))
+        self._store_new_words()
+
+    def store_id_chain(self, context, chain, order=1):
+        """
+        Store all elements of a chain of word ids for the context.
+
+        The chain's words must already be interned in vocabulary, as NgramChainBuilder does,
+        and its keys packed with pack_ngram for orders above 1. Like store_chain, the chain
+        may be a dict or an iterable of (key, next_words) pairs.
+        """
+        context_id = self._context_id(context, create=True, order=order)
+        links = six.iteritems(chain) if hasattr(chain, 'items') else chain
+        self._conn.executemany(self.SQL_INSERT, (
+            (context_id, key, next_word_id, weight)
+            for key, next_words in links
+            for next_word_id, weight in next_words
+        ))
+        check_ngram_vocabulary(self.vocabulary, order)
+        self._store_new_words()
+
+    def get_order(self, context):
+        """Get the order of the context's chain, which is 1 for stores predating n-grams."""
+        try:
+            row = self._conn.execute(self.SQL_SELECT_ORDER, (context,)).fetchone()
+        except sqlite3.OperationalError:
+            return 1
+        return row[0] if row is not None and row[0] else 1
 
     def get_contexts(self):
         """Get a list of all stored contexts."""
@@ -188,42 +882,111 @@ class DialogChainDatastore(object):
 
     def word_exists(self, context, word):
         """See if the word exists for the given context."""
-        result = self._conn.execute(self.SQL_SELECT_WORD_EXISTS, (context, word))
+        context_id = self._context_id(context)
+        if context_id is None or word not in self.vocabulary:
+            return False
+        result = self._conn.execute(self.SQL_SELECT_WORD_EXISTS,
+                                    (context_id, self.vocabulary.word_id(word)))
         return result.fetchone()[0] == 1
 
     def get_vocabulary(self, context):
         """Get a list of all words for the given contexts."""
-        result = self._conn.execute(self.SQL_SELECT_WORDS_BY_CONTEXT, (context,))
-        return [row[0] for row in result.fetchall()]
+        context_id = self._context_id(context)
+        result = self._conn.execute(self.SQL_SELECT_WORDS_BY_CONTEXT,
+                                    (context_id, NGRAM_KEY_BASE))
+        return sorted(self.vocabulary.word(row[0]) for row in result)
 
     def get_next_word_candidates(self, context, word):
         """Get all next word candidates with their weights for the given context and word."""
-        result = self._conn.execute(self.SQL_SELECT_BY_CONTEXT_AND_WORD, (context, word))
-        return result.fetchall()
+        context_id = self._context_id(context)
+        if context_id is None or word not in self.vocabulary:
+            return []
+        result = self._conn.execute(self.SQL_SELECT_BY_CONTEXT_AND_WORD,
+                                    (context_id, self.vocabulary.word_id(word)))
+        decode = self.vocabulary.word
+        return [(decode(next_word_id), weight) for next_word_id, weight in result]
+
+    def to_id_chain(self, context):
+        """
+        Fetch and construct a chain of word ids for use in probabilistic walking.
+
+        Decode the ids with vocabulary.
+
+        Returns:
+            dict(list(tuple)) like {1: [(1, 0.1), (2, 0.2), (3, 0.7)]}
+        """
+        chain = defaultdict(lambda: list())
+        context_id = self._context_id(context)
+        if context_id is not None:
+            result = self._conn.execute(self.SQL_SELECT_BY_CONTEXT, (context_id,))
+            for word_id, next_word_id, weight in result:
+                chain[word_id].append((next_word_id, weight))
+        return chain
 
     def to_chain(self, context):
         """
         Fetch and construct a chain for use in probabilistic walking.
 
+        Contexts of more than one word in higher-order chains are keyed by tuples of words.
+
         Returns:
             dict(list(tuple)) like {'a': [('a', 0.1), ('b', 0.2), ('c', 0.7)]}
         """
-        result = self._conn.execute(self.SQL_SELECT_BY_CONTEXT, (context,))
-        links = result.fetchall()
-
+        decode = self.vocabulary.word
         chain = defaultdict(lambda: list())
-        for link in links:
-            chain[link[0]].append((link[1], link[2]))
+        for key, next_words in six.iteritems(self.to_id_chain(context)):
+            if key < NGRAM_KEY_BASE:
+                word = decode(key)
+            else:
+                word = tuple(decode(word_id) for word_id in unpack_ngram(key))
+            chain[word] = [(decode(next_word_id), weight) for next_word_id, weight in next_words]
         return chain
 
 
 class MarkovRandomChooser(object):
-    """Walk Markov chains to generate dialog from datastore."""
+    """
+    Walk Markov chains to generate dialog from datastore.
 
-    def __init__(self):
+    If the datastore has a markov_adjacency table, speakers' chains are read lazily one
+    word at a time rather than loaded whole. Sentences are limited to max_words words and
+    max_chars characters as described for ChainWalker.build_sentence, and the time taken
+    to build each one is recorded in sentence_latency.
+    """
+
+    DISTINCT_ATTEMPTS = 10  # per requested line, when generating distinct lines
+
+    def __init__(self, open_mode=OPEN_MODE_READ_ONLY, cache_size=DEFAULT_WALKER_CACHE_SIZE,
+                 max_words=DEFAULT_MAX_WORDS, max_chars=None):
         """Initialize a new dialog markov chain chooser for dialog."""
-        self._datastore = DialogChainDatastore()
+        self._datastore = DialogChainDatastore(open_mode=open_mode)
         self._speaker_walker = ChainWalker(self._datastore.to_chain('speakers'))
+        self._walkers = WalkerCache(self._load_walker, cache_size)
+        self._lazy = self._datastore.has_adjacency()
+        self.max_words = max_words
+        self.max_chars = max_chars
+        self.sentence_latency = LatencyHistogram()
+
+    def _load_walker(self, speaker):
+        if self._lazy:
+            return LazyChainWalker(self._datastore, speaker, self._walkers.max_size)
+        return ChainWalker(self._datastore.to_id_chain(speaker), self._datastore.vocabulary,
+                           self._datastore.get_order(speaker))
+
+    def cache_info(self):
+        """Get hit, miss, and size counters for the cache of speakers' chain walkers."""
+        return self._walkers.info()
+
+    def latency_info(self):
+        """Get the count, percentiles, and maximum of seconds taken to build sentences."""
+        return self.sentence_latency.info()
+
+    def _build_sentence(self, speaker):
+        """Build a sentence from the speaker's chain, recording how long it takes."""
+        with self.sentence_latency.time():
+            try:
+                return self._walkers.get(speaker).build_sentence(self.max_words, self.max_chars)
+            except KeyError:
+                raise NoDialogFoundException(speaker)
 
     def random_dialog(self, speaker):
         """
@@ -235,11 +998,33 @@ class MarkovRandomChooser(object):
         speaker = speaker.upper() if speaker else None
         if speaker is None:
             speaker = self.random_speaker()
-        dialog_walker = ChainWalker(self._datastore.to_chain(speaker))
-        try:
-            return speaker, dialog_walker.build_sentence()
-        except KeyError:
-            raise NoDialogFoundException(speaker)
+        return speaker, self._build_sentence(speaker)
+
+    def random_dialogs(self, count, speaker=None, distinct=False):
+        """
+        Get several random lines of dialog, optionally limited to specific speaker.
+
+        If distinct is True, no sentence is repeated; since chains may not produce enough
+        unique sentences, generation gives up after a bounded number of attempts and may
+        return fewer.
+
+        Returns:
+            list of tuples containing (speaker name, line of dialog)
+        """
+        speaker = speaker.upper() if speaker else None
+        dialogs = []
+        seen = set()
+        for __ in range(count * self.DISTINCT_ATTEMPTS if distinct else count):
+            if len(dialogs) == count:
+                break
+            line_speaker = speaker or self.random_speaker()
+            line = self._build_sentence(line_speaker)
+            if distinct:
+                if line in seen:
+                    continue
+                seen.add(line)
+            dialogs.append((line_speaker, line))
+        return dialogs
 
     def random_speaker(self, from_speaker=None):
         """
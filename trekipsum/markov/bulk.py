@@ -0,0 +1,131 @@
+"""
+Fast bulk construction of speakers' markov chains.
+
+Rather than feeding words one at a time through NgramChainBuilder, each speaker's lines
+are tokenized with a single regular expression pass and their n-grams are tallied by a
+Counter, keeping the per-word work in C. Speakers may be counted in parallel processes.
+"""
+from __future__ import absolute_import
+
+import itertools
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import six
+from six.moves import range, zip
+
+from . import SENTENCE_DELIMITER_ID, check_ngram_vocabulary, pack_ngram
+
+MARKER = '\x00'  # stands in for SENTENCE_DELIMITER, which whitespace splitting would lose
+# a word ending with '.', '!', or '?' that is not only periods ends a sentence; markers are
+# inserted after every such ending with a literal replacement, then removed after the rare
+# all-period words, which is much faster than checking each word in one expression
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])(?!\S)')
+SENTENCE_END_REPLACEMENT = ' {}'.format(MARKER)
+ONLY_PERIODS_RE = re.compile(r'(?<!\S)(\.+){}'.format(SENTENCE_END_REPLACEMENT))
+LINE_SEPARATOR = ' {} '.format(MARKER)
+
+
+def count_ngrams(lines, order=1):
+    """
+    Count every context of up to order words with the word following it in the lines.
+
+    Sentences are split the same way as by NgramChainBuilder.process_string.
+
+    Returns:
+        Counter of tuples like ('a', 'b', 'c') for context ('a', 'b') followed by 'c', where
+        MARKER stands in for SENTENCE_DELIMITER
+    """
+    text = SENTENCE_END_RE.sub(SENTENCE_END_REPLACEMENT, LINE_SEPARATOR.join(lines))
+    text = ONLY_PERIODS_RE.sub(r'\1', text)
+    tokens = [MARKER] + text.split() + [MARKER]
+    counts = Counter()
+    for length in range(2, order + 2):
+        counts.update(zip(*[itertools.islice(tokens, start, None) for start in range(length)]))
+    # empty sentences and contexts reaching back past the start of a sentence are not links
+    for ngram in [ngram for ngram in counts if MARKER in ngram[1:-1]]:
+        del counts[ngram]
+    counts.pop((MARKER, MARKER), None)
+    return counts
+
+
+def count_turns(dialog_list):
+    """
+    Count each speaker followed by the speaker of the next line.
+
+    Returns:
+        Counter of tuples like ('PIKARD', 'RIKER'), as for an order-1 chain of speakers
+    """
+    speakers = [speaker for speaker, __ in dialog_list]
+    return Counter(zip(speakers, itertools.islice(speakers, 1, None)))
+
+
+def iter_id_counts(counts, vocabulary):
+    """
+    Group counts from count_ngrams into counts of links between word ids.
+
+    Words are interned in the vocabulary as they are reached. ValueError is raised if
+    contexts of two or more words need more word ids than pack_ngram can hold.
+
+    Returns:
+        iterator of tuples like (key, [(next_word_id, count), ...]) with keys packed by
+        pack_ngram
+    """
+    intern = vocabulary.intern
+
+    def word_id(word):
+        return SENTENCE_DELIMITER_ID if word == MARKER else intern(word)
+
+    chain = defaultdict(list)
+    order = 1
+    for ngram, count in six.iteritems(counts):
+        order = max(order, len(ngram) - 1)
+        chain[pack_ngram([word_id(word) for word in ngram[:-1]])].append(
+            (word_id(ngram[-1]), count))
+    check_ngram_vocabulary(vocabulary, order)
+    return six.iteritems(chain)
+
+
+def iter_normalized(counts, vocabulary):
+    """
+    Lazily convert counts from count_ngrams into a chain of word ids.
+
+    Words are interned in the vocabulary as they are reached.
+
+    Returns:
+        generator of tuples like NgramChainBuilder.iter_normalized yields
+    """
+    for key, followers in iter_id_counts(counts, vocabulary):
+        total = float(sum(count for __, count in followers))
+        yield key, [(follower, count / total) for follower, count in followers]
+
+
+def _count_shard(speaker_lines, order):
+    """Count n-grams for a list of (speaker, lines) in a worker process."""
+    return dict((speaker, count_ngrams(lines, order)) for speaker, lines in speaker_lines)
+
+
+def count_speakers(dialog_list, order=1, jobs=1):
+    """
+    Count n-grams of each speaker's lines, optionally sharding speakers across processes.
+
+    Returns:
+        dict of speaker names to Counters from count_ngrams
+    """
+    speaker_lines = defaultdict(list)
+    for speaker, line in dialog_list:
+        speaker_lines[speaker].append(line)
+    if jobs <= 1:
+        return _count_shard(six.iteritems(speaker_lines), order)
+
+    # deal speakers out from most to fewest lines so shards are similarly sized
+    speakers = sorted(speaker_lines, key=lambda speaker: len(speaker_lines[speaker]),
+                      reverse=True)
+    shards = [[(speaker, speaker_lines[speaker]) for speaker in speakers[number::jobs]]
+              for number in range(jobs)]
+    counts = {}
+    with ProcessPoolExecutor(jobs) as executor:
+        for shard_counts in executor.map(_count_shard, shards, itertools.repeat(order)):
+            counts.update(shard_counts)
+    return counts
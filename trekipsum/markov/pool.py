@@ -0,0 +1,181 @@
+"""
+Pool of pre-generated markov sentences, refilled in the background.
+"""
+from __future__ import absolute_import
+
+import logging
+import threading
+import timeit
+from collections import OrderedDict, deque, namedtuple
+
+import six
+from six.moves import range
+
+from ..exceptions import NoDialogFoundException
+from ..metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HIGH_WATER = 32  # sentences kept ready per speaker
+
+PoolInfo = namedtuple('PoolInfo', ('hits', 'misses', 'refills', 'failures', 'buffered',
+                                   'refill_lag'))
+
+
+class SentencePool(object):
+    """
+    Serve sentences from per-speaker buffers kept full by a background thread.
+
+    The pool wraps a MarkovRandomChooser and offers the same methods. Each speaker asked
+    for gets a buffer of up to high_water ready sentences; once it drops below low_water,
+    a refill is queued for the background thread. Taking a ready sentence is O(1), and
+    when a speaker's buffer is empty the sentence is generated on demand instead.
+
+    Refill lag, the time from queuing a refill to finishing it, is recorded in refill_lag.
+    A refill that fails is logged and counted in failures, and the speaker is refilled
+    again the next time it is asked for.
+    """
+
+    def __init__(self, chooser, high_water=DEFAULT_HIGH_WATER, low_water=None, speakers=()):
+        """Initialize a new pool for the chooser, starting to fill the given speakers."""
+        if high_water < 1:
+            raise ValueError('high_water must be at least 1')
+        self._chooser = chooser
+        self.high_water = high_water
+        self.low_water = high_water // 2 if low_water is None else low_water
+        self._buffers = {}
+        self._requested = OrderedDict()  # speakers to refill, with when they were queued
+        self._refilling = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.failures = 0
+        self.refill_lag = LatencyHistogram()
+
+        for speaker in speakers:
+            self._request_refill(speaker.upper())
+        self._thread = threading.Thread(target=self._refill_forever, name='SentencePool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Stop the background thread, waiting for any refill in progress to finish."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _request_refill(self, speaker):
+        with self._condition:
+            if speaker not in self._requested:
+                self._requested[speaker] = timeit.default_timer()
+                self._condition.notify_all()
+
+    def _refill_forever(self):
+        while True:
+            with self._condition:
+                while not self._requested and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                speaker, requested_at = self._requested.popitem(last=False)
+                self._refilling = True
+            try:
+                self._refill(speaker, requested_at)
+            except Exception:  # noqa: B902
+                logger.exception('could not refill sentences for speaker %s', speaker)
+                with self._condition:
+                    self.failures += 1
+            finally:
+                with self._condition:
+                    self._refilling = False
+                    self._condition.notify_all()
+
+    def _refill(self, speaker, requested_at):
+        """Generate sentences for the speaker until its buffer is full."""
+        buffer = self._buffers.setdefault(speaker, deque(maxlen=self.high_water))
+        try:
+            dialogs = self._chooser.random_dialogs(self.high_water - len(buffer), speaker)
+        except NoDialogFoundException:
+            logger.debug('no dialog to pool for speaker %s', speaker)
+            return
+        buffer.extend(line for __, line in dialogs)
+        self.refill_lag.record(timeit.default_timer() - requested_at)
+        with self._condition:
+            self.refills += 1
+
+    def wait_for_refills(self, timeout=None):
+        """
+        Block until every queued refill has finished, or timeout seconds have passed.
+
+        Returns:
+            True if the refills finished, else False
+        """
+        deadline = None if timeout is None else timeit.default_timer() + timeout
+        with self._condition:
+            while self._requested or self._refilling:
+                remaining = None if deadline is None else deadline - timeit.default_timer()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def info(self):
+        """Get a snapshot of the pool's hit, miss, and refill counters."""
+        with self._condition:
+            hits, misses, refills, failures = self.hits, self.misses, self.refills, self.failures
+        buffered = sum(len(buffer) for buffer in list(six.itervalues(self._buffers)))
+        return PoolInfo(hits, misses, refills, failures, buffered, self.refill_lag.info())
+
+    def random_dialog(self, speaker=None):
+        """
+        Get random line of dialog, optionally limited to specific speaker.
+
+        Returns:
+            tuple containing (speaker name, line of dialog)
+        """
+        speaker = speaker.upper() if speaker else self._chooser.random_speaker()
+        buffer = self._buffers.get(speaker)
+        line = None
+        if buffer:
+            try:
+                line = buffer.popleft()
+            except IndexError:  # another thread took the last one
+                pass
+
+        if line is None:
+            with self._condition:
+                self.misses += 1
+            speaker, line = self._chooser.random_dialog(speaker)
+        else:
+            with self._condition:
+                self.hits += 1
+
+        if buffer is None or len(buffer) < self.low_water:
+            self._request_refill(speaker)
+        return speaker, line
+
+    def random_dialogs(self, count, speaker=None, distinct=False):
+        """
+        Get several random lines of dialog, optionally limited to specific speaker.
+
+        Distinct lines are generated by the chooser rather than taken from the pool.
+
+        Returns:
+            list of tuples containing (speaker name, line of dialog)
+        """
+        if distinct:
+            return self._chooser.random_dialogs(count, speaker, distinct)
+        return [self.random_dialog(speaker) for __ in range(count)]
+
+    def random_speaker(self, from_speaker=None):
+        """Get random speaker name, optionally walking from a specific speaker."""
+        return self._chooser.random_speaker(from_speaker)
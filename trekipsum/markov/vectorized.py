@@ -0,0 +1,144 @@
+"""
+NumPy-vectorized markov walker for generating many sentences at once.
+
+NumPy is optional; batch_walker falls back to the pure-Python ChainWalker without it.
+"""
+from __future__ import absolute_import
+
+from six.moves import range
+
+from . import DEFAULT_MAX_WORDS, SENTENCE_DELIMITER_ID, WORD_ID_BITS, ChainWalker
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def batch_walker(chain, vocabulary, order=1):
+    """
+    Get a walker for building many sentences at once from a chain of word ids.
+
+    Returns:
+        VectorizedChainWalker if NumPy is installed, else ChainWalker
+    """
+    if numpy is None:
+        return ChainWalker(chain, vocabulary, order)
+    return VectorizedChainWalker(chain, vocabulary, order)
+
+
+class VectorizedChainWalker(object):
+    """
+    Markov chain walker advancing a whole batch of sentences in lockstep with NumPy.
+
+    The chain of word ids, as from DialogChainDatastore.to_id_chain, is converted to
+    compressed sparse rows: sorted keys, an indptr of each key's first follower, follower
+    ids, and cumulative weights. Each row's cumulative weights are offset by the row
+    number, so one searchsorted call over all rows draws every sentence's next word.
+    Sentences end as described for ChainWalker.build_sentence, except that there is no
+    max_chars limit.
+    """
+
+    def __init__(self, chain, vocabulary, order=1):
+        """Initialize a new walker with the given chain of word ids."""
+        if numpy is None:
+            raise ImportError('VectorizedChainWalker requires NumPy')
+        keys = sorted(chain.keys())
+        indptr = [0]
+        followers = []
+        cumulative_weights = []
+        for row, key in enumerate(keys):
+            total = 0.0
+            for next_word_id, weight in chain[key]:
+                total += weight
+                followers.append(next_word_id)
+                cumulative_weights.append(row + total)
+            indptr.append(len(followers))
+
+        self.order = order
+        self.keys = numpy.array(keys, dtype=numpy.int64)
+        self.indptr = numpy.array(indptr, dtype=numpy.int64)
+        self.followers = numpy.array(followers, dtype=numpy.int64)
+        self.cumulative_weights = numpy.array(cumulative_weights, dtype=numpy.float64)
+        # rows whose followers include the end of the sentence
+        edge_rows = numpy.repeat(numpy.arange(len(keys)), numpy.diff(self.indptr))
+        self.ends = numpy.zeros(len(keys), dtype=bool)
+        self.ends[edge_rows[self.followers == SENTENCE_DELIMITER_ID]] = True
+        self._words = numpy.array(vocabulary.words, dtype=object)
+
+    def _pack(self, history):
+        """Pack each row of word ids like pack_ngram."""
+        if history.shape[1] == 1:
+            return history[:, 0]
+        keys = numpy.zeros(len(history), dtype=numpy.int64)
+        for column in range(history.shape[1]):
+            keys = (keys << WORD_ID_BITS) | (history[:, column] + 1)
+        return keys
+
+    def _rows(self, history):
+        """Find each history's row for the longest context in the chain, backing off."""
+        rows = numpy.full(len(history), -1, dtype=numpy.int64)
+        for length in range(self.order, 0, -1):
+            missing = numpy.flatnonzero(rows < 0)
+            if len(missing) == 0:
+                break
+            keys = self._pack(history[missing, -length:])
+            positions = numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = self.keys[positions] == keys
+            rows[missing[found]] = positions[found]
+        if (rows < 0).any():
+            raise KeyError(int(history[rows < 0][0, -1]))
+        return rows
+
+    def _draw(self, rows, random_state):
+        """Choose a follower at random for each row."""
+        targets = rows + random_state.random_sample(len(rows))
+        draws = numpy.searchsorted(self.cumulative_weights, targets)
+        # rounding may carry a draw just past either end of its row
+        return self.followers[numpy.clip(draws, self.indptr[rows], self.indptr[rows + 1] - 1)]
+
+    def build_sentences(self, count, max_words=DEFAULT_MAX_WORDS, max_chars=None,
+                        random_state=None):
+        """
+        Build several complete sentences from the chain at once.
+
+        Args:
+            count: number of sentences to build
+            max_words: words per sentence before looking for an ending; must not be None
+            max_chars: unsupported, must be None; kept so calls match ChainWalker
+            random_state: optional numpy.random.RandomState for reproducible sentences,
+                else the global NumPy random state
+
+        Returns:
+            list of sentences
+        """
+        if max_words is None:
+            raise ValueError('VectorizedChainWalker needs a max_words limit')
+        if max_chars is not None:
+            raise ValueError('VectorizedChainWalker has no max_chars limit')
+        random_state = random_state or numpy.random
+        max_length = 2 * max_words
+        words = numpy.full((count, max_length), SENTENCE_DELIMITER_ID, dtype=numpy.int64)
+        # start as if a sentence delimiter preceded every context; backing off skips them
+        history = numpy.full((count, self.order), SENTENCE_DELIMITER_ID, dtype=numpy.int64)
+        active = numpy.arange(count)
+        for step in range(max_length):
+            if len(active) == 0:
+                break
+            rows = self._rows(history[active])
+            next_word_ids = self._draw(rows, random_state)
+            if step >= max_words:
+                next_word_ids[self.ends[rows]] = SENTENCE_DELIMITER_ID
+            words[active, step] = next_word_ids
+            history[active, :-1] = history[active, 1:]
+            history[active, -1] = next_word_ids
+            active = active[next_word_ids != SENTENCE_DELIMITER_ID]
+
+        ended = words == SENTENCE_DELIMITER_ID
+        lengths = numpy.where(ended.any(axis=1), ended.argmax(axis=1), max_length)
+        decoded = self._words[words]
+        return [' '.join(sentence[:length]) for sentence, length in zip(decoded, lengths)]
+
+    def build_sentence(self, max_words=DEFAULT_MAX_WORDS):
+        """Build a complete sentence from the chain."""
+        return self.build_sentences(1, max_words)[0]
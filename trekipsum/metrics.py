@@ -0,0 +1,79 @@
+import bisect
+import contextlib
+import threading
+import timeit
+from collections import namedtuple
+
+LatencyInfo = namedtuple('LatencyInfo', ('count', 'p50', 'p90', 'p99', 'max'))
+
+DEFAULT_MIN_LATENCY = 1e-6  # seconds
+DEFAULT_BUCKET_COUNT = 32  # doubling from DEFAULT_MIN_LATENCY reaches over half an hour
+
+
+class LatencyHistogram(object):
+    """
+    Thread-safe histogram of latencies in logarithmic buckets.
+
+    Each bucket's upper bound is double the last, so recording is a binary search over a
+    few dozen bounds and memory stays constant however many latencies are recorded.
+    Percentiles are reported as the upper bound of the bucket they fall in, so they may
+    overstate the true value by up to a factor of two.
+    """
+
+    def __init__(self, min_latency=DEFAULT_MIN_LATENCY, bucket_count=DEFAULT_BUCKET_COUNT):
+        """Initialize a new empty histogram."""
+        self.bounds = [min_latency * 2 ** number for number in range(bucket_count)]
+        self._counts = [0] * (bucket_count + 1)  # the last bucket holds anything larger
+        self._lock = threading.Lock()
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Add one latency to the histogram."""
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.max = max(self.max, seconds)
+
+    @contextlib.contextmanager
+    def time(self):
+        """Context manager recording how long its block takes to run."""
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.record(timeit.default_timer() - start)
+
+    def buckets(self):
+        """
+        Get a snapshot of the bucket counts.
+
+        Returns:
+            list of tuples containing (upper bound in seconds, count), where the last
+            bucket's upper bound is the largest latency recorded
+        """
+        with self._lock:
+            return list(zip(self.bounds + [self.max], self._counts))
+
+    def percentile(self, percent):
+        """Get the upper bound of the bucket holding the given percentile, in seconds."""
+        with self._lock:
+            return self._percentile(percent)
+
+    def _percentile(self, percent):
+        if self.count == 0:
+            return 0.0
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self._counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def info(self):
+        """Get a snapshot of the count, common percentiles, and maximum in seconds."""
+        with self._lock:
+            return LatencyInfo(self.count, self._percentile(50), self._percentile(90),
+                               self._percentile(99), self.max)
@@ -0,0 +1,46 @@
+import random
+
+
+class AliasTable(object):
+    """
+    Walker/Vose alias table for O(1) weighted sampling of indexes.
+
+    Building the table is O(n); each draw afterwards costs two random numbers and two
+    list lookups regardless of how many weights there are.
+    """
+
+    def __init__(self, weights):
+        """Initialize a new alias table from a sequence of non-negative weights."""
+        count = len(weights)
+        total = float(sum(weights))
+        if count == 0 or total <= 0:
+            raise ValueError('weights must include at least one positive value')
+
+        self._probabilities = [0.0] * count
+        self._aliases = list(range(count))
+
+        scaled = [weight * count / total for weight in weights]
+        small = [index for index, value in enumerate(scaled) if value < 1.0]
+        large = [index for index, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._probabilities[less] = scaled[less]
+            self._aliases[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        for index in small + large:
+            # leftovers are only off from 1.0 by floating point error
+            self._probabilities[index] = 1.0
+
+    def __len__(self):
+        return len(self._probabilities)
+
+    def sample(self, rng=random):
+        """Draw a random index with probability proportional to its weight."""
+        index = int(rng.random() * len(self._probabilities))
+        if rng.random() < self._probabilities[index]:
+            return index
+        return self._aliases[index]
@@ -2,10 +2,14 @@ import argparse
 import inspect
 import logging
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import six
 
-from .sources import chakoteya, sources
+from ..cli import positive
+from ..markov import MARKOV_LAYOUT_EDGES, MARKOV_LAYOUTS, MAX_ORDER
+from .sources import DEFAULT_FETCH_THREADS, chakoteya, sources
+from .sources.extracted import ExtractionCache
 from .writers import dictify_dialog, write_assets, writers
 
 logger = logging.getLogger(__name__)
@@ -25,6 +29,16 @@ def parse_cli_args():
     parser.add_argument('--no-assets', help='do not write trekipsum module assets',
                         action='store_true')
     parser.add_argument('--speakers', type=str, nargs='+', help='limit output to these speakers')
+    parser.add_argument('--markov-layout', choices=MARKOV_LAYOUTS, default=MARKOV_LAYOUT_EDGES,
+                        help='storage layout for markov chains (default: %(default)s)')
+    parser.add_argument('--order', type=int, choices=range(1, MAX_ORDER + 1), default=1,
+                        help='words of context for markov chains (default: %(default)s)')
+    parser.add_argument('--jobs', type=positive, default=1,
+                        help='worker processes to use (default: %(default)s)')
+    parser.add_argument('--fetch-threads', type=positive, default=DEFAULT_FETCH_THREADS,
+                        help='scripts to download at once (default: %(default)s)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='download scripts again if they changed since last downloaded')
 
     source_group = parser.add_argument_group('If specified, limit source data to')
     for name, source in six.iteritems(sources):
@@ -88,23 +102,35 @@ def main_cli():
         logger.error('Nothing to do; no outputs specified.')
         sys.exit(1)
 
-    all_dialog = read_sources(enabled_sources, args.progress)
-    write_outputs(all_dialog, args.no_assets, enabled_writers, args.speakers)
+    with ExtractionCache() as extraction_cache:
+        all_dialog = read_sources(enabled_sources, args.progress, args.fetch_threads, args.jobs,
+                                  args.refresh, extraction_cache)
+    write_outputs(all_dialog, args.no_assets, enabled_writers, args.speakers,
+                  markov_layout=args.markov_layout, order=args.order, jobs=args.jobs)
 
 
-def read_sources(enabled_sources, progress):
+def read_sources(enabled_sources, progress, fetch_threads=1, jobs=1, refresh=False,
+                 extraction_cache=None):
     """Read from all enabled sources and return all combined dialog."""
     all_dialog = []
     scraper_module = chakoteya  # TODO make this onfigurable?
-    for source in enabled_sources:
-        all_dialog += source(scraper_module, progress)
+    executor = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    try:
+        for source in enabled_sources:
+            all_dialog += source(scraper_module, progress, fetch_threads=fetch_threads,
+                                 executor=executor, refresh=refresh,
+                                 extraction_cache=extraction_cache)
+    finally:
+        if executor is not None:
+            executor.shutdown()
     return all_dialog
 
 
-def write_outputs(all_dialog, no_assets=False, enabled_writers=(), speakers=()):
+def write_outputs(all_dialog, no_assets=False, enabled_writers=(), speakers=(),
+                  markov_layout=MARKOV_LAYOUT_EDGES, order=1, jobs=1):
     """Write to all enabled writers."""
     if not no_assets:
-        write_assets(all_dialog)
+        write_assets(all_dialog, markov_layout=markov_layout, order=order, jobs=jobs)
 
     if len(enabled_writers) > 0:
         dialog_dict = dictify_dialog(all_dialog, speakers)
@@ -112,6 +138,9 @@ def write_outputs(all_dialog, no_assets=False, enabled_writers=(), speakers=()):
             'dialog_dict': dialog_dict,
             'dialog_list': all_dialog,
             'speakers': speakers,
+            'markov_layout': markov_layout,
+            'order': order,
+            'jobs': jobs,
         }
         for writer, file_path in enabled_writers:
             kwargs['file_path'] = file_path
@@ -1,4 +1,11 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import tqdm
+from six.moves import zip
+
+DEFAULT_FETCH_THREADS = 4  # concurrent downloads, still limited per host by rate_limiter
+EXTRACT_CHUNK_SIZE = 4  # scripts sent to an extraction worker process at a time
 
 sources = {}
 
@@ -9,60 +16,137 @@ def source(fn):
     return fn
 
 
-def _scrape_ids(ids, scraper, name, progress=False):
+def _fetch_ids(ids, scraper, name, progress=False, fetch_threads=1, refresh=False):
+    """Download scripts missing from disk, or changed if refresh, within the host's limits."""
+    with ThreadPoolExecutor(fetch_threads) as executor:
+        futures = [executor.submit(scraper.fetch_script, script_id, refresh)
+                   for script_id in ids]
+        done = as_completed(futures)
+        if progress:
+            done = tqdm.tqdm(done, 'Downloading {} scripts'.format(name), total=len(futures))
+        for future in done:
+            future.result()
+
+
+def _extract_dialog(scraper, script_id):
+    """Extract dialog from one script already fetched, in a worker process."""
+    return scraper.extract_dialog(script_id, fetch=False)
+
+
+def _cached_dialog(ids, scraper, extraction_cache):
+    """
+    Look up scripts' dialog in the extraction cache.
+
+    Returns:
+        tuple containing (dict of script ids to cached dialog, dict of script ids to the
+        hashes of those on disk)
+    """
+    cached = {}
+    hashes = {}
+    for script_id in ids:
+        hashes[script_id] = content_hash = scraper.script_hash(script_id)
+        if content_hash is not None:
+            dialog = extraction_cache.get(scraper.source_name, script_id,
+                                          scraper.extractor_version, content_hash)
+            if dialog is not None:
+                cached[script_id] = dialog
+    return cached, hashes
+
+
+def _scrape_ids(ids, scraper, name, progress=False, fetch_threads=1, executor=None,
+                refresh=False, extraction_cache=None):
+    """
+    Download any missing scripts, or changed ones if refresh, then extract their dialog.
+
+    Scripts are extracted in the given executor if any, such as a ProcessPoolExecutor
+    shared by all sources, else one by one. Either way dialog is returned in script order.
+    With an ExtractionCache, only scripts that are new or changed since their dialog was
+    cached are extracted.
+    """
+    # worker processes can't record downloads in this process's manifest, and cached
+    # dialog is matched to scripts on disk, so fetch first
+    fetched = (fetch_threads > 1 or refresh or executor is not None or
+               extraction_cache is not None)
+    if fetched:
+        _fetch_ids(ids, scraper, name, progress, fetch_threads, refresh)
+    dialog_by_id, hashes = {}, {}
+    if extraction_cache is not None:
+        dialog_by_id, hashes = _cached_dialog(ids, scraper, extraction_cache)
+    missing = [script_id for script_id in ids if script_id not in dialog_by_id]
+
+    if executor is None:
+        # scripts that failed to download are not tried again
+        extracted = (scraper.extract_dialog(script_id, fetch=not fetched)
+                     for script_id in missing)
+    else:
+        extracted = executor.map(_extract_dialog, itertools.repeat(scraper), missing,
+                                 chunksize=EXTRACT_CHUNK_SIZE)
+    if progress:
+        extracted = tqdm.tqdm(extracted, 'Processing {} scripts'.format(name),
+                              total=len(missing))
+    try:
+        for script_id, dialog in zip(missing, extracted):
+            dialog_by_id[script_id] = dialog
+            if hashes.get(script_id) is not None:
+                extraction_cache.put(scraper.source_name, script_id, scraper.extractor_version,
+                                     hashes[script_id], dialog)
+    finally:
+        scraper.save_manifest()
+        if extraction_cache is not None:
+            extraction_cache.commit()
+
     parsed_scripts = []
-    iterator = tqdm.tqdm(ids, 'Processing {} scripts'.format(name)) if progress else ids
-    for script_id in iterator:
-        parsed_scripts += scraper.extract_dialog(script_id)
+    for script_id in ids:
+        parsed_scripts += dialog_by_id[script_id]
     return parsed_scripts
 
 
 @source
-def tos(module, progress=False):
+def tos(module, progress=False, **kwargs):
     """Include the original series TV scripts."""
-    return _scrape_ids(module.ids['tos'], module.Scraper(), 'original', progress)
+    return _scrape_ids(module.ids['tos'], module.Scraper(), 'original', progress, **kwargs)
 
 
 @source
-def tas(module, progress=False):
+def tas(module, progress=False, **kwargs):
     """Include the animated series TV scripts."""
-    return _scrape_ids(module.ids['tas'], module.Scraper(), 'animated', progress)
+    return _scrape_ids(module.ids['tas'], module.Scraper(), 'animated', progress, **kwargs)
 
 
 @source
-def tng(module, progress=False):
+def tng(module, progress=False, **kwargs):
     """Include The Next Generation TV scripts."""
-    return _scrape_ids(module.ids['tng'], module.Scraper(), 'TNG', progress)
+    return _scrape_ids(module.ids['tng'], module.Scraper(), 'TNG', progress, **kwargs)
 
 
 @source
-def ds9(module, progress=False):
+def ds9(module, progress=False, **kwargs):
     """Include Deep Space Nine TV scripts."""
-    return _scrape_ids(module.ids['ds9'], module.Scraper(), 'DS9', progress)
+    return _scrape_ids(module.ids['ds9'], module.Scraper(), 'DS9', progress, **kwargs)
 
 
 @source
-def voy(module, progress=False):
+def voy(module, progress=False, **kwargs):
     """Include Voyager TV scripts."""
-    return _scrape_ids(module.ids['voy'], module.Scraper(), 'Voyager', progress)
+    return _scrape_ids(module.ids['voy'], module.Scraper(), 'Voyager', progress, **kwargs)
 
 
 @source
-def ent(module, progress=False):
+def ent(module, progress=False, **kwargs):
     """Include Enterprise TV scripts."""
-    return _scrape_ids(module.ids['ent'], module.Scraper(), 'Enterprise', progress)
+    return _scrape_ids(module.ids['ent'], module.Scraper(), 'Enterprise', progress, **kwargs)
 
 
 @source
-def mov_tos(module, progress=False):
+def mov_tos(module, progress=False, **kwargs):
     """Include TOS-era movie scripts."""
-    return _scrape_ids(module.ids['mov_tos'], module.Scraper(), 'TOS movies', progress)
+    return _scrape_ids(module.ids['mov_tos'], module.Scraper(), 'TOS movies', progress, **kwargs)
 
 
 @source
-def mov_tng(module, progress=False):
+def mov_tng(module, progress=False, **kwargs):
     """Include TNG-era movie scripts."""
-    return _scrape_ids(module.ids['mov_tng'], module.Scraper(), 'TNG movies', progress)
+    return _scrape_ids(module.ids['mov_tng'], module.Scraper(), 'TNG movies', progress, **kwargs)
 
 
 # @source  # not yet ready
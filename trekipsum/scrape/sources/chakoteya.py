@@ -45,6 +45,8 @@ ids = {
 class Scraper(AbstractScraper):
     """Scrape and parse scripts from chakoteya.net."""
 
+    source_name = 'chakoteya.net'
+
     def __init__(self):
         """Initialize default path to assets on disk."""
         super(Scraper, self).__init__()
@@ -64,6 +66,8 @@ class Scraper(AbstractScraper):
 class Extractor(object):
     """Parse and extract lines of dialog from HTML script."""
 
+    version = 1  # bump whenever extracted lines would change, to invalidate cached dialog
+
     line_with_speaker_matcher = re.compile(r'^([^:]*):(.*)$')
     captains_log_matcher = re.compile(r'.*\w\'S\ (?:PERSONAL\ )?(?:STAR)?LOG.*')
     speaker_semicolon_matcher = re.compile(r'^([A-Z\ \[\]\.]+);(.*)')
@@ -304,3 +308,6 @@ class Extractor(object):
                 self.__dialog = '{} {}'.format(self.__dialog, text)
         else:
             self._reset_dialog()
+
+
+Scraper.extractor_version = Extractor.version
@@ -0,0 +1,81 @@
+import json
+import logging
+import sqlite3
+from os import path
+
+import six
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTRACTION_CACHE_PATH = path.join(
+    path.dirname(path.dirname(path.dirname(path.abspath(__file__)))),
+    'assets', 'extracted.sqlite')
+
+
+class ExtractionCache(object):
+    """
+    Store of dialog already extracted from each script, to skip extracting it again.
+
+    Dialog is kept per source and script id, along with the version of the extractor
+    and the hash of the script it came from. A lookup only hits when both still match,
+    so changed scripts and changed extractors are extracted afresh.
+    """
+
+    create_sql = 'CREATE TABLE IF NOT EXISTS extracted (' \
+                 '  source VARCHAR,' \
+                 '  script_id VARCHAR,' \
+                 '  extractor_version INTEGER,' \
+                 '  content_hash VARCHAR,' \
+                 '  dialog TEXT,' \
+                 '  PRIMARY KEY (source, script_id)' \
+                 ')'
+    select_sql = 'SELECT dialog FROM extracted ' \
+                 'WHERE source=? AND script_id=? AND extractor_version=? AND content_hash=?'
+    replace_sql = 'INSERT OR REPLACE INTO extracted ' \
+                  '(source, script_id, extractor_version, content_hash, dialog) ' \
+                  'VALUES (?,?,?,?,?)'
+
+    def __init__(self, file_path=DEFAULT_EXTRACTION_CACHE_PATH):
+        """Initialize a new cache, creating its sqlite db at file_path if needed."""
+        self.file_path = file_path
+        self._conn = sqlite3.connect(file_path)
+        self._conn.execute(self.create_sql)
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Commit anything stored and close the db."""
+        self._conn.commit()
+        self._conn.close()
+        logger.debug('extraction cache had %s hits and %s misses', self.hits, self.misses)
+
+    def get(self, source, script_id, extractor_version, content_hash):
+        """
+        Get the dialog extracted from the script, if extracted from the same content.
+
+        Returns:
+            list of tuples containing (speaker name, line of dialog), or None if missing
+        """
+        row = self._conn.execute(self.select_sql, (
+            source, six.text_type(script_id), extractor_version, content_hash)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [tuple(dialog) for dialog in json.loads(row[0])]
+
+    def put(self, source, script_id, extractor_version, content_hash, dialog):
+        """Store the dialog extracted from the script, replacing any older extraction."""
+        self._conn.execute(self.replace_sql, (
+            source, six.text_type(script_id), extractor_version, content_hash,
+            json.dumps(list(dialog))))
+
+    def commit(self):
+        """Commit dialog stored so far."""
+        self._conn.commit()
@@ -0,0 +1,87 @@
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+from os import path
+
+import six
+
+from ..utils import replace_file
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def content_hash(text):
+    """Get the hex SHA-1 digest of the text as UTF-8."""
+    if isinstance(text, six.text_type):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+class ScriptManifest(object):
+    """
+    Thread-safe record of where and when each script on disk was downloaded.
+
+    Each script id maps to a dict of its url, the response's etag and last_modified
+    headers if any, the sha1 of the text written, and fetched_at as seconds since the
+    epoch. The etag and last_modified are sent back to make refreshes conditional.
+    """
+
+    def __init__(self, file_path):
+        """Initialize a new manifest, loading any entries already saved at file_path."""
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._changed = False
+        self._entries = {}
+        if path.isfile(file_path):
+            with io.open(file_path, encoding='utf-8') as f:
+                self._entries = json.load(f)
+
+    def get(self, script_id):
+        """Get the entry for the script, or None if it was never recorded."""
+        with self._lock:
+            return self._entries.get(six.text_type(script_id))
+
+    def conditional_headers(self, script_id):
+        """
+        Get headers asking the server to skip the script if it has not changed.
+
+        Returns:
+            dict of If-None-Match and If-Modified-Since headers, empty if unknown
+        """
+        entry = self.get(script_id) or {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record(self, script_id, url, response, text):
+        """Record a script just downloaded, or only refresh fetched_at if text is None."""
+        with self._lock:
+            entry = self._entries.setdefault(six.text_type(script_id), {})
+            entry['url'] = url
+            entry['fetched_at'] = time.time()
+            if text is not None:
+                entry['etag'] = response.headers.get('ETag')
+                entry['last_modified'] = response.headers.get('Last-Modified')
+                entry['sha1'] = content_hash(text)
+            self._changed = True
+
+    def save(self):
+        """Write the manifest to disk if anything was recorded since it was loaded."""
+        with self._lock:
+            if not self._changed:
+                return
+            temp_path = '{}.tmp'.format(self.file_path)
+            with io.open(temp_path, mode='w', encoding='utf-8') as f:
+                f.write(six.text_type(json.dumps(self._entries, indent=2, sort_keys=True)))
+            replace_file(temp_path, self.file_path)
+            self._changed = False
+            logger.debug('saved manifest of %s scripts to %s', len(self._entries),
+                         self.file_path)
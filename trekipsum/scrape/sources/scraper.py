@@ -1,37 +1,158 @@
 import abc
+import gzip
+import hashlib
+import io
 import logging
 import os
+import shutil
+import threading
 from os import path
 
-from ..utils import retriable_session
+from six.moves import range
+
+from ..utils import rate_limiter, replace_file, retriable_session, retry_after_seconds
+from .manifest import MANIFEST_FILE_NAME, ScriptManifest
 
 logger = logging.getLogger(__name__)
 
+RETRY_AFTER_STATUSES = (429, 503)  # statuses whose Retry-After header is honored
+NOT_MODIFIED = 304
+COMPRESSED_SUFFIX = '.gz'  # scripts are cached gzipped, beside any loose file left over
+COMPRESSED_ENCODING = 'utf-8'
+
+
+def open_script(file_path, mode='r', compressed=None):
+    """
+    Open a script file as text, streaming through gzip if it is compressed.
+
+    Files are taken to be compressed if they have COMPRESSED_SUFFIX, unless told otherwise.
+    """
+    if compressed is None:
+        compressed = file_path.endswith(COMPRESSED_SUFFIX)
+    if compressed:
+        # mtime=0 keeps the compressed bytes the same for the same script
+        return io.TextIOWrapper(gzip.GzipFile(file_path, mode + 'b', mtime=0),
+                                encoding=COMPRESSED_ENCODING)
+    return open(file_path, mode)
+
+
+def compress_script(file_path, to_file_path):
+    """Gzip a loose script file into to_file_path, then remove the loose file."""
+    temp_path = '{}.tmp'.format(to_file_path)
+    with open(file_path, 'rb') as loose, gzip.GzipFile(temp_path, 'wb', mtime=0) as compressed:
+        shutil.copyfileobj(loose, compressed)
+    replace_file(temp_path, to_file_path)
+    os.remove(file_path)
+
 
 class AbstractScraper(object):
     """Scrape and parse scripts."""
 
     __metaclass__ = abc.ABCMeta
 
+    source_name = None  # distinguishes this source's scripts in an ExtractionCache
+    extractor_version = 0  # bump whenever extraction changes, to invalidate cached dialog
+
     def __init__(self):
         """Initialize with requests session."""
-        self.session = retriable_session()
+        self._local = threading.local()
+        self._manifest_lock = threading.Lock()
+        self._manifest = None
+        self.session  # create the first thread's session up front
+        self.assets_path = None
         self.script_url = None
         self.timeout = 1.0
+        self.retry_after_attempts = 3
+
+    def __getstate__(self):
+        """Pickle without sessions or manifest, so scrapers can go to worker processes."""
+        state = self.__dict__.copy()
+        del state['_local'], state['_manifest_lock']
+        state['_manifest'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._manifest_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Get the current thread's requests session, since sessions are not thread-safe."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = retriable_session()
+        return session
 
-    def extract_dialog(self, script_id):
-        """Parse and extract dialog from script, downloading if needed."""
+    @property
+    def manifest(self):
+        """Get the ScriptManifest of downloaded scripts, or None if this scraper keeps none."""
+        with self._manifest_lock:
+            if self._manifest is None and self._manifest_path() is not None:
+                self._manifest = ScriptManifest(self._manifest_path())
+            return self._manifest
+
+    def save_manifest(self):
+        """Write any downloads recorded in the manifest to disk."""
+        if self._manifest is not None:
+            self._manifest.save()
+
+    def fetch_script(self, script_id, refresh=False):
+        """
+        Download script if it is not on disk yet, returning its compressed file path.
+
+        A loose script left from before scripts were compressed is compressed instead.
+        With refresh, a script already on disk is downloaded again if it has changed, as
+        told by its etag or last-modified time in the manifest.
+        """
         file_path = self._path_for_script_id(script_id)
-        if not path.isdir(path.dirname(file_path)):
+        compressed_path = file_path + COMPRESSED_SUFFIX
+        try:
             os.makedirs(path.dirname(file_path))
-        if not path.isfile(file_path):
-            self.scrape_script(script_id, file_path)
-        if path.isfile(file_path):
-            with open(file_path, 'r') as f:
-                logger.debug('extracting dialog from %s', file_path)
-                return self._extract_from_file(f)
-        else:
+        except OSError:  # may already exist, or another thread just made it
+            if not path.isdir(path.dirname(file_path)):
+                raise
+        if path.isfile(file_path) and not path.isfile(compressed_path):
+            logger.debug('compressing %s', file_path)
+            compress_script(file_path, compressed_path)
+        if not path.isfile(compressed_path):
+            self.scrape_script(script_id, compressed_path)
+        elif refresh:
+            self.scrape_script(script_id, compressed_path, conditional=True)
+        return compressed_path
+
+    def script_path(self, script_id):
+        """Get the path of the script on disk, compressed or not, or None if not on disk."""
+        file_path = self._path_for_script_id(script_id)
+        for script_path in (file_path + COMPRESSED_SUFFIX, file_path):
+            if path.isfile(script_path):
+                return script_path
+        return None
+
+    def script_hash(self, script_id):
+        """Get the hex SHA-1 digest of the script file on disk, or None if not on disk."""
+        script_path = self.script_path(script_id)
+        if script_path is None:
+            return None
+        with open(script_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def extract_dialog(self, script_id, fetch=True):
+        """
+        Parse and extract dialog from script, downloading if needed.
+
+        Without fetch, a script missing from disk, such as one that already failed to
+        download, yields no dialog instead of being downloaded.
+        """
+        script_path = self.script_path(script_id)
+        if script_path is None and fetch:
+            self.fetch_script(script_id)
+            script_path = self.script_path(script_id)
+        if script_path is None:
             return []
+        with open_script(script_path) as f:
+            logger.debug('extracting dialog from %s', script_path)
+            return self._extract_from_file(f)
 
     @abc.abstractmethod
     def _path_for_script_id(self, script_id):
@@ -41,19 +162,56 @@ class AbstractScraper(object):
     def _extract_from_file(self, file):
         """Extract lines from the open file."""
 
+    def _manifest_path(self):
+        """Generate file path for the manifest, or None to keep no manifest."""
+        if self.assets_path is None:
+            return None
+        return path.join(self.assets_path, MANIFEST_FILE_NAME)
+
     def _clean_response_text(self, response_text):
         """Clean the response text before writing to disk."""
         return response_text
 
-    def scrape_script(self, script_id, to_file_path):
-        """Scrape script from st-minutiae.com."""
+    def scrape_script(self, script_id, to_file_path, conditional=False):
+        """
+        Scrape script from st-minutiae.com.
+
+        Requests are limited per host by rate_limiter. When the host answers with a
+        Retry-After header, every request to it waits that long before trying again.
+        If conditional, the file is left alone when the host answers 304 Not Modified.
+        Downloads are recorded in the manifest, if any.
+        """
         url = self.script_url.format(script_id)
-        logger.debug('attempting to download script from %s', url)
-        response = self.session.get(url, timeout=self.timeout)
-        if response:
-            with open(to_file_path, mode='w') as f:
+        limiter = rate_limiter(url)
+        manifest = self.manifest
+        headers = manifest.conditional_headers(script_id) if conditional and manifest else {}
+        kwargs = {'headers': headers} if headers else {}
+        for __ in range(self.retry_after_attempts + 1):
+            delay = None
+            with limiter:
+                logger.debug('attempting to download script from %s', url)
+                response = self.session.get(url, timeout=self.timeout, **kwargs)
+                if response.status_code in RETRY_AFTER_STATUSES:
+                    delay = retry_after_seconds(response.headers.get('Retry-After'))
+                if delay is not None:
+                    limiter.hold_off(delay)
+            if delay is None:
+                break
+            logger.info('retrying %s after %s seconds', url, delay)
+        if response.status_code == NOT_MODIFIED:
+            logger.debug('script at %s is unchanged', url)
+            if manifest:
+                manifest.record(script_id, url, response, None)
+        elif response:
+            # write beside the file and move it into place, so a failure leaves no partial file
+            temp_path = '{}.tmp'.format(to_file_path)
+            compressed = to_file_path.endswith(COMPRESSED_SUFFIX)
+            with open_script(temp_path, mode='w', compressed=compressed) as f:
                 clean_text = self._clean_response_text(response.text)
                 f.write(clean_text)
+            replace_file(temp_path, to_file_path)
+            if manifest:
+                manifest.record(script_id, url, response, clean_text)
         else:
             logger.warning('could not fetch %s: %s %s',
                            response.url, response.status_code, response.reason)
@@ -29,6 +29,8 @@ ids = {
 class Scraper(AbstractScraper):
     """Scrape and parse scripts from st-minutiae.com."""
 
+    source_name = 'st-minutiae.com'
+
     def __init__(self):
         """Initialize default path to assets on disk."""
         super(Scraper, self).__init__()
@@ -61,6 +63,8 @@ class Scraper(AbstractScraper):
 class Extractor(object):
     """Parse and extract lines of dialog from a script."""
 
+    version = 1  # bump whenever extracted lines would change, to invalidate cached dialog
+
     # https://regex101.com/r/WBYM0F/1
     speaker_matcher = re.compile(r'^(?:\t{5}|\ {43})\"?(?!ACT)((?:[a-zA-Z0-9#\-/&]|\.[\ \w]|\.(?=\')|\ (?!V\.O\.|\(|COM\ )|\'(?!S(?![\w])))+)\.?.*$')  # noqa
     dialog_matcher = re.compile(r'^(?:\t{3}|\t{6}|\ {29}|\ {30})([^\t\ ].+)$')
@@ -190,3 +194,6 @@ class Extractor(object):
                     self._append_line()
             if text not in self.blacklisted_speakers:
                 self.__speaker = text
+
+
+Scraper.extractor_version = Extractor.version
@@ -1,7 +1,23 @@
+import email.utils
+import os
+import threading
+import time
+import timeit
+
 import requests
 from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlparse
 from urllib3.util.retry import Retry
 
+DEFAULT_HOST_CONCURRENCY = 2  # requests in flight at once per host
+DEFAULT_REQUESTS_PER_SECOND = 2.0  # requests started per second per host
+
+_host_limits = {}
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+replace_file = getattr(os, 'replace', os.rename)  # atomic where available
+
 
 class magicdictlist(dict):
     """Helper class to add conveniences to dict."""
@@ -21,14 +37,89 @@ class magicdictlist(dict):
 
 
 def retriable_session(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 504)):
-    """Prepare a requests.Session that has automatic retry enabled."""
+    """
+    Prepare a requests.Session that has automatic retry enabled.
+
+    Retry-After headers are left to the caller, so that a RateLimiter can hold off every
+    request to the host rather than only the one that was told to wait.
+    """
     retry = Retry(
         total=total,
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
+        respect_retry_after_header=False,
     )
     adapter = HTTPAdapter(max_retries=retry)
     session = requests.Session()
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
+
+
+class RateLimiter(object):
+    """
+    Context manager limiting concurrent requests to a host and how often they start.
+
+    Entering blocks until fewer than max_concurrent requests are in flight and at least
+    1 / requests_per_second seconds have passed since the last one started. Safe to
+    share across threads.
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_HOST_CONCURRENCY,
+                 requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+        """Initialize a new limiter with no requests in flight."""
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        with self._lock:
+            now = timeit.default_timer()
+            start = max(now, self._next_start)
+            self._next_start = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, *args):
+        self._semaphore.release()
+
+    def hold_off(self, seconds):
+        """Delay every later request by at least seconds from now, as for Retry-After."""
+        with self._lock:
+            self._next_start = max(self._next_start, timeit.default_timer() + seconds)
+
+
+def set_host_limits(host, max_concurrent=DEFAULT_HOST_CONCURRENCY,
+                    requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+    """Set the limits for requests to the host (including any port), like 'example.com'."""
+    with _rate_limiters_lock:
+        _host_limits[host] = (max_concurrent, requests_per_second)
+        _rate_limiters.pop(host, None)
+
+
+def rate_limiter(url):
+    """Get the RateLimiter shared by all requests to the url's host."""
+    host = urlparse(url).netloc
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(host)
+        if limiter is None:
+            limiter = _rate_limiters[host] = RateLimiter(*_host_limits.get(
+                host, (DEFAULT_HOST_CONCURRENCY, DEFAULT_REQUESTS_PER_SECOND)))
+        return limiter
+
+
+def retry_after_seconds(value):
+    """Get the seconds to wait from a Retry-After header's value, or None if invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(int(value)))
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
@@ -1,20 +1,32 @@
 import contextlib
+import hashlib
 import json as _json
 import logging
 import os
 import pickle as _pickle
 import sqlite3
-from collections import defaultdict
-
-import six
+from operator import itemgetter
 
 from .. import markov as _markov
+from ..dialog import compact as _compact
+from ..dialog import pickle as _dialog_pickle
 from ..dialog.sqlite import DEFAULT_SQLITE_PATH
+from ..markov import bulk as _markov_bulk
 from ..scrape.utils import magicdictlist
 
 logger = logging.getLogger(__name__)
 writers = {}
 
+# bump whenever the format of the assets write_assets builds changes, to rebuild them
+ASSETS_FORMAT_VERSION = 1
+
+FINGERPRINT_CREATE_SQL = 'CREATE TABLE IF NOT EXISTS build_info (' \
+                         '  name VARCHAR PRIMARY KEY,' \
+                         '  value VARCHAR' \
+                         ')'
+FINGERPRINT_SELECT_SQL = 'SELECT value FROM build_info WHERE name=?'
+FINGERPRINT_INSERT_SQL = 'INSERT OR REPLACE INTO build_info (name, value) VALUES (?,?)'
+
 
 def writer(fn):
     """Append function to available writers for the CLI."""
@@ -44,7 +56,15 @@ def json(file_path, dialog_dict, **kwargs):
 
 @writer
 def sqlite(file_path, dialog_list, **kwargs):
-    """Write sqlite db to file at specified path."""
+    """
+    Write sqlite db to file at specified path.
+
+    Lines are grouped by speaker so each speaker's lines occupy a contiguous run of
+    dialog_ids, letting choosers fetch random lines directly by primary key. Speakers are
+    numbered in the speakers table, and their line counts, dialog_id ranges, and word
+    counts are written to speaker_stats so choosers never need to aggregate the dialog
+    table themselves.
+    """
     file_path = os.path.abspath(file_path)
     logger.info('dumping sqlite to %s', file_path)
 
@@ -54,57 +74,188 @@ def sqlite(file_path, dialog_list, **kwargs):
                  '  speaker VARCHAR,' \
                  '  line VARCHAR' \
                  ')'
-    query = 'INSERT INTO dialog (speaker, line) VALUES (?,?)'
+    query = 'INSERT INTO dialog (dialog_id, speaker, line) VALUES (?,?,?)'
     index_sql = 'CREATE INDEX dialog_speaker_idx ON dialog(speaker)'
 
+    drop_speakers_sql = 'DROP TABLE IF EXISTS speakers'
+    create_speakers_sql = 'CREATE TABLE IF NOT EXISTS speakers (' \
+                          '  speaker_id INTEGER PRIMARY KEY,' \
+                          '  speaker VARCHAR UNIQUE' \
+                          ')'
+    speakers_query = 'INSERT INTO speakers (speaker_id, speaker) VALUES (?,?)'
+
+    drop_stats_sql = 'DROP TABLE IF EXISTS speaker_stats'
+    create_stats_sql = 'CREATE TABLE IF NOT EXISTS speaker_stats (' \
+                       '  speaker_id INTEGER PRIMARY KEY REFERENCES speakers(speaker_id),' \
+                       '  line_count INTEGER,' \
+                       '  first_dialog_id INTEGER,' \
+                       '  last_dialog_id INTEGER,' \
+                       '  word_count INTEGER' \
+                       ')'
+    stats_query = 'INSERT INTO speaker_stats ' \
+                  '(speaker_id, line_count, first_dialog_id, last_dialog_id, word_count) ' \
+                  'VALUES (?,?,?,?,?)'
+
+    rows = []
+    stats = {}
+    for dialog_id, (speaker, line) in enumerate(sorted(dialog_list, key=itemgetter(0)), 1):
+        rows.append((dialog_id, speaker, line))
+        line_count, first_id, _, word_count = stats.get(speaker, (0, dialog_id, None, 0))
+        stats[speaker] = (line_count + 1, first_id, dialog_id, word_count + len(line.split()))
+    speakers = sorted(stats.keys())
+
     with contextlib.closing(sqlite3.connect(file_path)) as conn:
         with conn as cursor:
             cursor.execute(drop_sql)
             cursor.execute(create_sql)
-            for speaker, line in dialog_list:
-                # for line in lines:
-                args = (speaker, line)
-                cursor.execute(query, args)
+            cursor.executemany(query, rows)
             cursor.execute(index_sql)
+            cursor.execute(drop_speakers_sql)
+            cursor.execute(create_speakers_sql)
+            cursor.executemany(speakers_query, enumerate(speakers))
+            cursor.execute(drop_stats_sql)
+            cursor.execute(create_stats_sql)
+            cursor.executemany(stats_query, ((speaker_id,) + stats[speaker]
+                                             for speaker_id, speaker in enumerate(speakers)))
 
 
 @writer
-def markov(file_path, dialog_list, **kwargs):
-    """Write markov chain to sqlite db at specified path."""
+def markov(file_path, dialog_list, markov_layout=_markov.MARKOV_LAYOUT_EDGES, order=1,
+           jobs=1, **kwargs):
+    """
+    Write markov chain to sqlite db at specified path.
+
+    Speakers' dialog chains follow contexts of up to order preceding words, and are
+    counted in up to jobs processes. With MARKOV_LAYOUT_ADJACENCY, also write the
+    markov_adjacency table so choosers can read chains one word at a time.
+    """
     file_path = os.path.abspath(file_path)
     logger.info('dumping sqlite markov to %s', file_path)
 
-    dialog_chain_builders = defaultdict(lambda: _markov.SentenceChainBuilder())
-    speaker_chain_builder = _markov.WordChainBuilder()
+    speaker_counts = _markov_bulk.count_speakers(dialog_list, order, jobs)
+    turn_counts = _markov_bulk.count_turns(dialog_list)
+
+    with _markov.DialogChainDatastore(file_path) as datastore:
+        with datastore.bulk_load():
+            datastore.reinitialize()
+            vocabulary = datastore.vocabulary
+            datastore.store_id_counts('speakers',
+                                      _markov_bulk.iter_id_counts(turn_counts, vocabulary))
+            while speaker_counts:
+                # release each speaker's counts as soon as they have been stored
+                speaker, counts = speaker_counts.popitem()
+                datastore.store_id_counts(
+                    speaker, _markov_bulk.iter_id_counts(counts, vocabulary), order)
+            datastore.index()
+            if markov_layout == _markov.MARKOV_LAYOUT_ADJACENCY:
+                datastore.build_adjacency()
+
+
+def update_markov(file_path, dialog_list, order=1, jobs=1):
+    """
+    Merge markov chains for new dialog into those written by markov at specified path.
+
+    Only the chain entries reached by the new lines are rewritten, so updating costs time
+    in proportion to the new dialog rather than to the whole corpus.
+    """
+    file_path = os.path.abspath(file_path)
+    logger.info('merging sqlite markov into %s', file_path)
 
-    for speaker, line in dialog_list:
-        dialog_chain_builders[speaker].process_string(line)
-        speaker_chain_builder.add_next(speaker)
+    speaker_counts = _markov_bulk.count_speakers(dialog_list, order, jobs)
+    turn_counts = _markov_bulk.count_turns(dialog_list)
 
     with _markov.DialogChainDatastore(file_path) as datastore:
-        datastore.reinitialize()
-        datastore.store_chain('speakers', speaker_chain_builder.normalize())
-        for speaker, builder in six.iteritems(dialog_chain_builders):
-            datastore.store_chain(speaker, builder.normalize())
-        datastore.index()
+        vocabulary = datastore.vocabulary
+        datastore.merge_counts('speakers', _markov_bulk.iter_id_counts(turn_counts, vocabulary))
+        while speaker_counts:
+            speaker, counts = speaker_counts.popitem()
+            datastore.merge_counts(
+                speaker, _markov_bulk.iter_id_counts(counts, vocabulary), order)
+
+
+@writer
+def compact(file_path, dialog_list, **kwargs):
+    """Write compact memory-mappable corpus to file at specified path."""
+    file_path = os.path.abspath(file_path)
+    logger.info('dumping compact corpus to %s', file_path)
+    _compact.write_corpus(file_path, dialog_list)
 
 
 @writer
 def pickle(file_path, dialog_dict, **kwargs):
-    """Write pickle to file at specified path."""
+    """
+    Write pickle to file at specified path.
+
+    If file_path is a directory (or ends with a path separator), write one pickle per
+    speaker plus an index of shard file names instead of a single pickle.
+    """
+    sharded = file_path.endswith(os.sep) or os.path.isdir(file_path)
     file_path = os.path.abspath(file_path)
-    logger.info('dumping pickle to %s', file_path)
+    if sharded:
+        logger.info('dumping pickle shards to %s', file_path)
+        if not os.path.isdir(file_path):
+            os.makedirs(file_path)
+        shard_index = {}
+        for number, speaker in enumerate(sorted(dialog_dict.keys())):
+            shard_index[speaker] = '{}.pickle'.format(number)
+            _dump_pickle(os.path.join(file_path, shard_index[speaker]), dialog_dict[speaker])
+        _dump_pickle(os.path.join(file_path, _dialog_pickle.SHARD_INDEX_FILENAME), shard_index)
+    else:
+        logger.info('dumping pickle to %s', file_path)
+        _dump_pickle(file_path, dict(dialog_dict))
+
+
+def _dump_pickle(file_path, data):
     with open(file_path, 'wb') as pickle_file:
-        _pickle.dump(dict(dialog_dict), pickle_file, protocol=2)  # 2 is py27-compatible
+        _pickle.dump(data, pickle_file, protocol=2)  # 2 is py27-compatible
+
+
+def assets_fingerprint(dialog_list, markov_layout=_markov.MARKOV_LAYOUT_EDGES, order=1):
+    """Get a hex digest identifying the assets write_assets would build."""
+    options = [ASSETS_FORMAT_VERSION, markov_layout, order]
+    digest = hashlib.sha1(_json.dumps(options).encode('utf-8'))
+    digest.update(_json.dumps(dialog_list).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _read_fingerprint(sqlite_path):
+    """Get the fingerprint of the assets built at the path, or None if unknown."""
+    if not os.path.exists(sqlite_path):
+        return None
+    with contextlib.closing(sqlite3.connect(sqlite_path)) as conn:
+        try:
+            row = conn.execute(FINGERPRINT_SELECT_SQL, ('fingerprint',)).fetchone()
+        except sqlite3.OperationalError:  # built before fingerprints were recorded
+            return None
+    return row and row[0]
+
+
+def _write_fingerprint(sqlite_path, fingerprint):
+    with contextlib.closing(sqlite3.connect(sqlite_path)) as conn:
+        conn.execute(FINGERPRINT_CREATE_SQL)
+        conn.execute(FINGERPRINT_INSERT_SQL, ('fingerprint', fingerprint))
+        conn.commit()
+
 
+def write_assets(dialog_list, markov_layout=_markov.MARKOV_LAYOUT_EDGES, order=1, jobs=1):
+    """
+    Write to standard assets within the trekipsum package.
 
-def write_assets(dialog_list):
-    """Write to standard assets within the trekipsum package."""
+    The assets are left as they are if they were last built from the same dialog with
+    the same options, as recorded by assets_fingerprint in the build_info table.
+    """
     sqlite_path = DEFAULT_SQLITE_PATH
+    fingerprint = assets_fingerprint(dialog_list, markov_layout, order)
+    if (_read_fingerprint(sqlite_path) == fingerprint and
+            os.path.exists(_compact.DEFAULT_COMPACT_PATH)):
+        logger.info('assets are up to date; not rewriting them')
+        return
     if os.path.exists(sqlite_path):
         os.remove(sqlite_path)
     sqlite(sqlite_path, dialog_list)
-    markov(sqlite_path, dialog_list)
+    markov(sqlite_path, dialog_list, markov_layout=markov_layout, order=order, jobs=jobs)
+    compact(_compact.DEFAULT_COMPACT_PATH, dialog_list)
+    _write_fingerprint(sqlite_path, fingerprint)
 
 
 def dictify_dialog(all_dialog, speakers=None):